@@ -3,10 +3,22 @@ from .models import *
 
 @admin.register(Document)
 class DocumentAdmin(admin.ModelAdmin):
-    list_display = ('id', 'name', 'file', 'is_loaded')
-    list_filter = ('is_loaded',)
+    list_display = ('id', 'name', 'file', 'status', 'progress', 'attempts', 'updated_at')
+    list_filter = ('status', 'is_loaded')
     search_fields = ('name',)
+    readonly_fields = ('status', 'progress', 'attempts', 'error', 'updated_at')
     ordering = ('id',)
+    actions = ['requeue_ingestion']
+
+    @admin.action(description="Re-queue ingestion")
+    def requeue_ingestion(self, request, queryset):
+        from .tasks import enqueue_document
+
+        ids = list(queryset.values_list('id', flat=True))
+        queryset.update(status=Document.PENDING, is_loaded=False, error="")
+        for document_id in ids:
+            enqueue_document(document_id)
+        self.message_user(request, f"{len(ids)} document(s) queued for ingestion.")
 
 
 @admin.register(LoadedFile)
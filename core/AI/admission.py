@@ -0,0 +1,294 @@
+import os
+import time
+import uuid
+import asyncio
+from contextlib import asynccontextmanager
+from redis.exceptions import RedisError
+from AI.cache import get_redis
+
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_MAX_QUEUED_PER_USER = int(os.getenv("LLM_MAX_QUEUED_PER_USER", "3"))
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))
+LLM_QUEUE_POLL = float(os.getenv("LLM_QUEUE_POLL", "0.25"))
+# Slots are leases renewed while a generation runs, so a crashed worker's
+# slots free themselves.
+LLM_SLOT_LEASE = float(os.getenv("LLM_SLOT_LEASE", "30"))
+# Tokens (prompt + answer) a user may spend per LLM_QUOTA_WINDOW seconds; 0 disables.
+LLM_USER_TOKEN_QUOTA = int(os.getenv("LLM_USER_TOKEN_QUOTA", "200000"))
+LLM_QUOTA_WINDOW = int(os.getenv("LLM_QUOTA_WINDOW", "3600"))
+# After a Redis error, skip Redis (local limit, no quota) for this many seconds
+# instead of waiting out socket timeouts on every request.
+LLM_ADMISSION_REDIS_BACKOFF = float(os.getenv("LLM_ADMISSION_REDIS_BACKOFF", "30"))
+
+WAIT_BUCKETS = [0.1, 0.5, 1, 2, 5, 10, 30]
+
+SLOTS_KEY = "ai:llm:slots"
+QUEUE_KEY = "ai:llm:queue"
+WAITING_KEY = "ai:llm:waiting"
+METRICS_KEY = "ai:llm:metrics"
+
+# Returns 0 when the ticket got a slot, its 1-based queue position otherwise,
+# or -1 if the user already has too many requests queued or running.
+#
+# Queue order is fair between users: a ticket's score is the number of tickets
+# its user already had queued or running when it arrived, so everyone's first
+# request is served before anyone's second. Tickets are named
+# "<arrival ms>|<user>|<id>", which orders equal scores by arrival.
+ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+for _, t in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+    redis.call('ZREM', KEYS[2], t)
+end
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+
+if not redis.call('ZSCORE', KEYS[2], ARGV[1]) then
+    local needle = '|' .. ARGV[2] .. '|'
+    local round = 0
+    for _, key in ipairs({KEYS[1], KEYS[2]}) do
+        for _, t in ipairs(redis.call('ZRANGE', key, 0, -1)) do
+            if string.find(t, needle, 1, true) then round = round + 1 end
+        end
+    end
+    if round >= tonumber(ARGV[7]) then return -1 end
+    redis.call('ZADD', KEYS[2], round, ARGV[1])
+end
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[6]), ARGV[1])
+
+local free = tonumber(ARGV[4]) - redis.call('ZCARD', KEYS[1])
+local rank = redis.call('ZRANK', KEYS[2], ARGV[1])
+if rank < free then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[5]), ARGV[1])
+    return 0
+end
+return rank + 1
+"""
+
+
+class AdmissionRejected(Exception):
+    """The request was not admitted to the LLM; `reason` is busy, quota or timeout."""
+
+    def __init__(self, reason, message):
+        super().__init__(message)
+        self.reason = reason
+        self.message = message
+
+
+class LLMAdmission:
+    """
+    Global limit on concurrent LLM generations across all daphne processes.
+
+    Slots, the fair wait queue and per-user token usage live in Redis. While a
+    request waits, `on_position(n)` is called whenever its queue position
+    changes. If Redis is unreachable each process falls back to a local
+    semaphore of the same size, so an outage degrades fairness, not availability;
+    after a failure Redis is left alone for `redis_backoff` seconds.
+    """
+
+    def __init__(
+        self,
+        max_concurrency=LLM_MAX_CONCURRENCY,
+        max_queued_per_user=LLM_MAX_QUEUED_PER_USER,
+        queue_timeout=LLM_QUEUE_TIMEOUT,
+        token_quota=LLM_USER_TOKEN_QUOTA,
+        quota_window=LLM_QUOTA_WINDOW,
+        redis_backoff=LLM_ADMISSION_REDIS_BACKOFF,
+    ):
+        self.max_concurrency = max_concurrency
+        self.max_queued_per_user = max_queued_per_user
+        self.queue_timeout = queue_timeout
+        self.token_quota = token_quota
+        self.quota_window = quota_window
+        self.redis_backoff = redis_backoff
+        self.stats = {
+            "admitted": 0,
+            "admitted_local": 0,
+            "rejected_busy": 0,
+            "rejected_quota": 0,
+            "timeouts": 0,
+            "wait_seconds": 0.0,
+        }
+        self._script = None
+        self._local = None
+        self._local_loop = None
+        self._redis_down_until = 0.0
+
+    def redis_available(self):
+        return time.monotonic() >= self._redis_down_until
+
+    def _redis_failed(self, action, error):
+        if self.redis_available():
+            print(f"⚠️ LLM {action} failed, skipping Redis for {self.redis_backoff:g}s: {error}")
+        self._redis_down_until = time.monotonic() + self.redis_backoff
+
+    def _quota_key(self, user):
+        window = int(time.time() // self.quota_window)
+        return f"ai:llm:quota:{user}:{window}"
+
+    def _local_semaphore(self):
+        loop = asyncio.get_running_loop()
+        if self._local is None or self._local_loop is not loop:
+            self._local = asyncio.Semaphore(self.max_concurrency)
+            self._local_loop = loop
+        return self._local
+
+    async def _record(self, name, amount=1):
+        self.stats[name] += amount
+        if not self.redis_available():
+            return
+        try:
+            if isinstance(amount, float):
+                await get_redis().hincrbyfloat(METRICS_KEY, name, amount)
+            else:
+                await get_redis().hincrby(METRICS_KEY, name, amount)
+        except RedisError as e:
+            self._redis_failed("metrics write", e)
+
+    async def _record_wait(self, waited):
+        await self._record("wait_seconds", waited)
+        if not self.redis_available():
+            return
+        bucket = next((f"wait_le_{b}" for b in WAIT_BUCKETS if waited <= b), "wait_gt_30")
+        try:
+            await get_redis().hincrby(METRICS_KEY, bucket, 1)
+        except RedisError as e:
+            self._redis_failed("metrics write", e)
+
+    async def tokens_used(self, user):
+        if not self.redis_available():
+            return 0
+        try:
+            value = await get_redis().get(self._quota_key(user))
+        except RedisError as e:
+            self._redis_failed("quota read", e)
+            return 0
+        return int(value) if value else 0
+
+    async def charge(self, user, tokens):
+        """Add a finished generation's tokens to the user's usage in the current window."""
+        if not tokens or not self.redis_available():
+            return
+        key = self._quota_key(user)
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.incrby(key, int(tokens))
+                pipe.expire(key, self.quota_window)
+                await pipe.execute()
+        except RedisError as e:
+            self._redis_failed("quota write", e)
+
+    async def _acquire(self, ticket, user):
+        if self._script is None:
+            self._script = get_redis().register_script(ACQUIRE_SCRIPT)
+        return int(await self._script(
+            keys=[SLOTS_KEY, QUEUE_KEY, WAITING_KEY],
+            args=[
+                ticket,
+                user,
+                time.time(),
+                self.max_concurrency,
+                LLM_SLOT_LEASE,
+                max(LLM_QUEUE_POLL * 8, 2),
+                self.max_queued_per_user,
+            ],
+            client=get_redis(),
+        ))
+
+    async def _renew(self, ticket):
+        while True:
+            await asyncio.sleep(LLM_SLOT_LEASE / 3)
+            if not self.redis_available():
+                continue
+            try:
+                await get_redis().zadd(SLOTS_KEY, {ticket: time.time() + LLM_SLOT_LEASE}, xx=True)
+            except RedisError as e:
+                self._redis_failed("slot renewal", e)
+
+    async def _release(self, ticket):
+        # While Redis is skipped the ticket is left to expire with its lease.
+        if not self.redis_available():
+            return
+        try:
+            async with get_redis().pipeline(transaction=False) as pipe:
+                pipe.zrem(SLOTS_KEY, ticket)
+                pipe.zrem(QUEUE_KEY, ticket)
+                pipe.zrem(WAITING_KEY, ticket)
+                await pipe.execute()
+        except RedisError as e:
+            self._redis_failed("slot release", e)
+
+    async def _wait_for_slot(self, ticket, user, on_position):
+        deadline = time.monotonic() + self.queue_timeout
+        position = None
+        while True:
+            result = await self._acquire(ticket, user)
+            if result == 0:
+                return
+            if result < 0:
+                await self._record("rejected_busy")
+                raise AdmissionRejected(
+                    "busy", "You already have questions waiting for an answer. Please wait for them to finish."
+                )
+            if time.monotonic() >= deadline:
+                await self._record("timeouts")
+                raise AdmissionRejected("timeout", "The assistant is very busy right now. Please try again shortly.")
+            if result != position and on_position is not None:
+                position = result
+                await on_position(position)
+            await asyncio.sleep(LLM_QUEUE_POLL)
+
+    @asynccontextmanager
+    async def slot(self, user, on_position=None):
+        """Hold one of the global generation slots for the duration of the block."""
+        if self.token_quota and await self.tokens_used(user) >= self.token_quota:
+            await self._record("rejected_quota")
+            raise AdmissionRejected(
+                "quota", "You have reached your usage limit for now. Please try again later."
+            )
+
+        ticket = f"{int(time.time() * 1000):013d}|{user}|{uuid.uuid4().hex}"
+        started = time.monotonic()
+
+        shared = self.redis_available()
+        if shared:
+            try:
+                await self._wait_for_slot(ticket, user, on_position)
+            except RedisError as e:
+                self._redis_failed("admission", e)
+                shared = False
+                await self._release(ticket)
+            except BaseException:
+                await self._release(ticket)
+                raise
+
+        if not shared:
+            async with self._local_semaphore():
+                self.stats["admitted_local"] += 1
+                self.stats["wait_seconds"] += time.monotonic() - started
+                yield
+            return
+
+        await self._record_wait(time.monotonic() - started)
+        await self._record("admitted")
+        renewal = asyncio.create_task(self._renew(ticket))
+        try:
+            yield
+        finally:
+            renewal.cancel()
+            await self._release(ticket)
+
+    async def metrics(self):
+        """Counters across all processes (falls back to this process's)."""
+        if not self.redis_available():
+            return dict(self.stats)
+        try:
+            raw = await get_redis().hgetall(METRICS_KEY)
+        except RedisError as e:
+            self._redis_failed("metrics read", e)
+            return dict(self.stats)
+        return {key.decode(): float(value) for key, value in raw.items()}
+
+
+llm_admission = LLMAdmission()
@@ -0,0 +1,147 @@
+import os
+import json
+import time
+import uuid
+import logging
+import numpy as np
+from redis.exceptions import RedisError
+from AI.cache import get_redis
+from AI.intents import INTENTS
+from AI.upstream import CACHES
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "200"))
+
+# Answers are only cached for intents whose context comes from an upstream
+# cache, so the answer can never outlive the data it was generated from.
+INTENT_SOURCES = {
+    INTENTS["TIME_SERIES"]: "time_series",
+    INTENTS["MINISTRY_SCORE"]: "ministry_score",
+    INTENTS["MINISTRY_PERFORMANCE"]: "ministry_performance",
+}
+
+
+class AnswerCache:
+    """
+    Semantic cache of final answers.
+
+    Entries are bucketed by the resolved route (intent, year, quarter,
+    performance type) and matched inside a bucket by cosine similarity of the
+    question embedding. Each entry records the upstream cache generation it was
+    built from; once that data is refreshed the entry is ignored.
+    """
+
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "latency_saved": 0.0}
+
+    @staticmethod
+    def _bucket(route, year_requested):
+        parts = [
+            route.get("intent"),
+            route.get("year"),
+            route.get("quarter"),
+            route.get("performance_type"),
+            year_requested,
+        ]
+        return "ai:answers:" + json.dumps(parts, default=str, separators=(",", ":"))
+
+    @staticmethod
+    def _normalise(embedding):
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    async def lookup(self, embedding, route, year_requested):
+        """Return the cached answer text, or None."""
+        source = INTENT_SOURCES.get(route.get("intent"))
+        if source is None:
+            return None
+
+        bucket = self._bucket(route, year_requested)
+        upstream = CACHES[source]
+
+        try:
+            redis = get_redis()
+            vectors = await redis.hgetall(f"{bucket}:vec")
+            if not vectors:
+                self.stats["misses"] += 1
+                return None
+
+            ids = list(vectors.keys())
+            matrix = np.frombuffer(b"".join(vectors[i] for i in ids), dtype=np.float32)
+            matrix = matrix.reshape(len(ids), -1)
+            scores = matrix @ self._normalise(embedding)
+            best = int(np.argmax(scores))
+
+            if scores[best] < self.threshold:
+                self.stats["misses"] += 1
+                return None
+
+            raw = await redis.hget(f"{bucket}:doc", ids[best])
+            generation = await upstream.generation()
+        except RedisError as e:
+            logger.warning("Answer cache read failed: %s", e)
+            return None
+
+        entry = json.loads(raw) if raw else None
+        if (
+            not entry
+            or entry["generation"] != generation
+            or time.time() - entry["created"] > upstream.ttl
+        ):
+            self.stats["misses"] += 1
+            return None
+
+        self.stats["hits"] += 1
+        self.stats["latency_saved"] += entry["latency"]
+        logger.info(
+            "Answer cache hit (similarity %.3f), saved %.2fs, hit rate %.1f%%",
+            scores[best], entry["latency"], self.hit_rate() * 100,
+        )
+        return entry["answer"]
+
+    async def store(self, embedding, route, year_requested, answer, latency):
+        source = INTENT_SOURCES.get(route.get("intent"))
+        if source is None or not answer:
+            return
+
+        bucket = self._bucket(route, year_requested)
+        upstream = CACHES[source]
+        entry_id = uuid.uuid4().hex
+
+        try:
+            redis = get_redis()
+            generation = await upstream.generation()
+            if generation is None:
+                return
+
+            entry = {
+                "answer": answer,
+                "latency": latency,
+                "generation": generation,
+                "created": time.time(),
+            }
+            async with redis.pipeline(transaction=False) as pipe:
+                pipe.hset(f"{bucket}:vec", entry_id, self._normalise(embedding).tobytes())
+                pipe.hset(f"{bucket}:doc", entry_id, json.dumps(entry))
+                pipe.expire(f"{bucket}:vec", upstream.ttl)
+                pipe.expire(f"{bucket}:doc", upstream.ttl)
+                pipe.hlen(f"{bucket}:vec")
+                *_, size = await pipe.execute()
+
+            if size > self.max_entries:
+                # Buckets are small and short-lived; starting over is cheaper than LRU bookkeeping.
+                await redis.delete(f"{bucket}:vec", f"{bucket}:doc")
+        except RedisError as e:
+            logger.warning("Answer cache write failed: %s", e)
+
+    def hit_rate(self):
+        total = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / total if total else 0.0
+
+
+answer_cache = AnswerCache()
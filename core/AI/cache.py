@@ -0,0 +1,214 @@
+import os
+import json
+import hashlib
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/1")
+
+_redis = None
+_redis_loop = None
+
+
+def get_redis():
+    """
+    Shared async Redis client (the same server that backs CHANNEL_LAYERS).
+    Like the upstream HTTP client it is tied to the loop that created it.
+    """
+    global _redis, _redis_loop
+    loop = asyncio.get_running_loop()
+
+    if _redis is not None and _redis_loop is loop:
+        return _redis
+
+    _redis = aioredis.from_url(REDIS_URL, socket_timeout=0.5, socket_connect_timeout=0.5)
+    _redis_loop = loop
+    return _redis
+
+
+# Bumped after every document ingestion; anything derived from the document
+# collection (entity index, cached retrieval results) is keyed on it.
+INGESTION_KEY = "ai:ingestion:generation"
+
+
+async def ingestion_generation():
+    try:
+        value = await get_redis().get(INGESTION_KEY)
+    except RedisError as e:
+        logger.warning("Redis cache read failed: %s", e)
+        return None
+    return int(value) if value else 0
+
+
+async def mark_ingested():
+    """Called after ingestion so every process drops data derived from the old documents."""
+    try:
+        await get_redis().incr(INGESTION_KEY)
+    except RedisError as e:
+        logger.warning("Could not record the ingestion: %s", e)
+
+
+def _retrieve_exception(task):
+    if not task.cancelled():
+        task.exception()
+
+
+class LRUCache:
+    """Small in-process LRU with a per-entry expiry."""
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return None
+
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class TieredCache:
+    """
+    In-process LRU in front of Redis for JSON-serialisable values.
+
+    Empty responses ({} / [] / None) are cached with the shorter negative_ttl so a
+    missing indicator is not re-fetched on every question either. If fetch()
+    raises, nothing is cached and the error reaches every waiter. Concurrent
+    misses for the same key within a process share one fetch, which runs to
+    completion and caches its result even if every waiter gave up (e.g. the
+    fetch_many deadline). Redis errors are treated as misses so a Redis outage
+    only costs the upstream call.
+    """
+
+    def __init__(self, namespace, ttl, negative_ttl=300, maxsize=1024):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.local = LRUCache(maxsize)
+        self.stats = {"local_hits": 0, "redis_hits": 0, "misses": 0, "negative_hits": 0}
+        self._inflight = {}
+
+    def make_key(self, *parts):
+        return f"ai:{self.namespace}:" + json.dumps(parts, default=str, separators=(",", ":"))
+
+    def _ttl_for(self, value):
+        return self.ttl if value else self.negative_ttl
+
+    async def get(self, key):
+        value = self.local.get(key)
+        if value is not None:
+            self.stats["local_hits"] += 1
+            if not value:
+                self.stats["negative_hits"] += 1
+            return value
+
+        try:
+            raw = await get_redis().get(key)
+        except RedisError as e:
+            logger.warning("Redis cache read failed: %s", e)
+            raw = None
+
+        if raw is None:
+            return None
+
+        value = json.loads(raw)
+        self.stats["redis_hits"] += 1
+        if not value:
+            self.stats["negative_hits"] += 1
+        self.local.set(key, value, self._ttl_for(value))
+        return value
+
+    async def set(self, key, value):
+        ttl = self._ttl_for(value)
+        self.local.set(key, value, ttl)
+        try:
+            await get_redis().set(key, json.dumps(value, default=str), ex=int(ttl))
+        except RedisError as e:
+            logger.warning("Redis cache write failed: %s", e)
+
+    async def delete(self, key):
+        self.local.delete(key)
+        try:
+            await get_redis().delete(key)
+        except RedisError as e:
+            logger.warning("Redis cache delete failed: %s", e)
+
+    async def generation(self):
+        """
+        Counter bumped whenever a refetch returns different data than last time.
+        Anything derived from this namespace (e.g. cached answers) records the
+        generation it was built from and is stale once it changes.
+        """
+        try:
+            value = await get_redis().get(f"ai:{self.namespace}:generation")
+        except RedisError as e:
+            logger.warning("Redis cache read failed: %s", e)
+            return None
+        return int(value) if value else 0
+
+    async def _track_refresh(self, key, value):
+        fingerprint = hashlib.sha1(json.dumps(value, sort_keys=True).encode()).hexdigest()
+        try:
+            redis = get_redis()
+            previous = await redis.getset(f"{key}:fp", fingerprint)
+            if previous is not None and previous.decode() != fingerprint:
+                await redis.incr(f"ai:{self.namespace}:generation")
+        except RedisError as e:
+            logger.warning("Redis cache write failed: %s", e)
+
+    async def _fetch_and_store(self, key, fetch):
+        try:
+            value = await fetch()
+            if value is None:
+                value = {}
+            await self.set(key, value)
+            await self._track_refresh(key, value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    async def get_or_fetch(self, key, fetch):
+        value = await self.get(key)
+        if value is not None:
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["misses"] += 1
+            task = asyncio.ensure_future(self._fetch_and_store(key, fetch))
+            # Waiters re-raise the error; this only keeps a fetch that nobody
+            # is waiting for any more from logging "exception never retrieved".
+            task.add_done_callback(_retrieve_exception)
+            self._inflight[key] = task
+        return await asyncio.shield(task)
+
+    def hit_rate(self):
+        hits = self.stats["local_hits"] + self.stats["redis_hits"]
+        total = hits + self.stats["misses"]
+        return hits / total if total else 0.0
@@ -1,6 +1,10 @@
 from langchain_core.prompts import PromptTemplate
 from AI.intents import INTENTS
 import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
 
 PROMPT = PromptTemplate(
     input_variables=["question"],
@@ -35,10 +39,17 @@ Return ONLY the intent name.
 """
 )
 
+def _parse_intent(content: str) -> str:
+    intent = content.strip().upper()
+    return intent if intent in INTENTS else INTENTS["UNKNOWN"]
+
 def classify_intent(llm, question: str) -> str:
     result = llm.invoke(PROMPT.format(question=question))
-    intent = result.content.strip().upper()
-    return intent if intent in INTENTS else INTENTS["UNKNOWN"]
+    return _parse_intent(result.content)
+
+async def aclassify_intent(llm, question: str) -> str:
+    result = await llm.ainvoke(PROMPT.format(question=question))
+    return _parse_intent(result.content)
 
 DPMES_EXTRACTION_YEAR_QUARTER_PROMPT = PromptTemplate(
     input_variables=["question"],
@@ -62,14 +73,9 @@ Return ONLY raw JSON:
 """
 )
 
-def extract_year_quarter(llm, question: str) -> dict:
-    """
-    Parses the question to extract normalized year and quarter.
-    Returns a dictionary, e.g., {"year": "2017", "quarter": "9month"}
-    """
-    result = llm.invoke(DPMES_EXTRACTION_YEAR_QUARTER_PROMPT.format(question=question))
-    clean_content = result.content.strip().replace("```json", "").replace("```", "")
-    
+def _parse_year_quarter(content: str) -> dict:
+    clean_content = content.strip().replace("```json", "").replace("```", "")
+
     try:
         data = json.loads(clean_content)
         return {
@@ -79,6 +85,19 @@ def extract_year_quarter(llm, question: str) -> dict:
     except (json.JSONDecodeError, ValueError):
         return {"year": None, "quarter": "12month"}
 
+def extract_year_quarter(llm, question: str) -> dict:
+    """
+    Parses the question to extract normalized year and quarter.
+    Returns a dictionary, e.g., {"year": "2017", "quarter": "9month"}
+    """
+    result = llm.invoke(DPMES_EXTRACTION_YEAR_QUARTER_PROMPT.format(question=question))
+    return _parse_year_quarter(result.content)
+
+async def aextract_year_quarter(llm, question: str) -> dict:
+    """Async variant of extract_year_quarter that does not block the event loop."""
+    result = await llm.ainvoke(DPMES_EXTRACTION_YEAR_QUARTER_PROMPT.format(question=question))
+    return _parse_year_quarter(result.content)
+
 DPMES_PERFORMANCE_STATUS_EXTRACTOR = PromptTemplate(
     input_variables=["question"],
     template="""
@@ -99,14 +118,145 @@ Question: {question}
 Return (on_track/in_progress/weak_performance/no_data/null):"""
 )
 
-def extract_performance_type(llm, question: str):
-    result = llm.invoke(DPMES_PERFORMANCE_STATUS_EXTRACTOR.format(question=question))
-    content = result.content.strip().lower()
-    
+def _parse_performance_type(content: str):
+    content = content.strip().lower()
+
     valid_keys = ['on_track', 'in_progress', 'weak_performance', 'no_data']
 
     for key in valid_keys:
         if key in content:
             return key
             
-    return None 
\ No newline at end of file
+    return None
+
+def extract_performance_type(llm, question: str):
+    result = llm.invoke(DPMES_PERFORMANCE_STATUS_EXTRACTOR.format(question=question))
+    return _parse_performance_type(result.content)
+
+async def aextract_performance_type(llm, question: str):
+    result = await llm.ainvoke(DPMES_PERFORMANCE_STATUS_EXTRACTOR.format(question=question))
+    return _parse_performance_type(result.content)
+
+# gpt-oss reasons before it answers; the cap must leave room for the JSON
+# after the reasoning, or the route is cut off and falls back to UNKNOWN.
+ROUTER_MAX_TOKENS = int(os.getenv("ROUTER_MAX_TOKENS", "1024"))
+# Sent as reasoning_effort; empty for models that do not accept it.
+ROUTER_REASONING_EFFORT = os.getenv("ROUTER_REASONING_EFFORT", "low")
+
+PERIODS = ["3month", "6month", "9month", "12month"]
+
+ROUTER_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "intent": {"type": "string", "enum": list(INTENTS.values())},
+        "year": {"type": ["string", "null"], "pattern": "^[0-9]{4}$"},
+        "quarter": {"type": ["string", "null"], "enum": PERIODS + [None]},
+        "performance_type": {
+            "type": ["string", "null"],
+            "enum": ["on_track", "in_progress", "weak_performance", "no_data", None],
+        },
+    },
+    "required": ["intent", "year", "quarter", "performance_type"],
+    "additionalProperties": False,
+}
+
+ROUTER_PROMPT = PromptTemplate(
+    input_variables=["question"],
+    template="""
+You route user questions for the DPMES system. Fill in ALL four fields.
+
+intent (choose ONE):
+- MINISTRY_SCORE: a specific Ministry, Government Body or Agency (e.g., "MoH", "Ministry of Health", "MoPD") and its performance, score, ranking or status. If a Ministry is named, this takes priority over TIME_SERIES.
+- MINISTRY_PERFORMANCE: a FILTERED LIST of a ministry's indicators/KPIs by status (e.g., "weak KPIs for MoA", "which health goals are on track").
+- TIME_SERIES: a specific economic or social indicator (e.g., "GDP", "Inflation", "Export value", "Unemployment rate") and its values or trend.
+- POLICY_AREA_SCORE: a thematic sector rather than an institution (e.g., "How is the Health Sector doing?").
+- GOAL_SCORE: strategic goals, Ten Year Development Plan goals or national targets.
+- UNKNOWN: greetings, general chat or topics unrelated to DPMES data.
+
+year: "YYYY" or null.
+
+quarter (normalize):
+- "3 month", "1st quarter", "Q1" -> "3month"
+- "6 month", "half year", "2nd quarter", "Q2" -> "6month"
+- "9 month", "3rd quarter", "Q3" -> "9month"
+- "Annual", "Full year", "12 month", "4th quarter", "Q4" -> "12month"
+- not mentioned -> null
+
+performance_type (ignore year/quarter words):
+- "on_track": good, success, achieved, excellent, best, meeting targets
+- "in_progress": average, satisfactory, moving, developing, mid-range
+- "weak_performance": bad, poor, critical, failing, behind, low scores
+- "no_data": missing, not reported, unknown, blank, unsubmitted
+- general performance without a specific status -> null
+
+Question: {question}
+
+Return ONLY raw JSON:
+{{"intent": "...", "year": "YYYY or null", "quarter": "period or null", "performance_type": "key or null"}}
+"""
+)
+
+def _parse_route(content: str) -> dict:
+    """
+    Validate the router JSON field by field. A field that is missing or invalid
+    falls back to what the dedicated extractor would have returned.
+    """
+    route = {
+        "intent": INTENTS["UNKNOWN"],
+        "year": None,
+        "quarter": "12month",
+        "performance_type": None,
+    }
+
+    clean_content = content.strip().replace("```json", "").replace("```", "")
+    try:
+        data = json.loads(clean_content)
+    except (json.JSONDecodeError, ValueError):
+        data = None
+
+    if not isinstance(data, dict):
+        # Usually the completion ran out of tokens before the JSON was complete.
+        logger.warning("Router returned no usable JSON, falling back to UNKNOWN: %r", content[:200])
+        return route
+
+    route["intent"] = _parse_intent(str(data.get("intent") or ""))
+    if route["intent"] == INTENTS["UNKNOWN"] and str(data.get("intent") or "").upper() != INTENTS["UNKNOWN"]:
+        logger.warning("Router returned an invalid intent %r, using UNKNOWN", data.get("intent"))
+
+    year = data.get("year")
+    if year and str(year).isdigit() and len(str(year)) == 4:
+        route["year"] = str(year)
+
+    if "quarter" in data:
+        quarter = data.get("quarter")
+        if quarter is None or str(quarter).lower() == "null":
+            route["quarter"] = None
+        elif quarter in PERIODS:
+            route["quarter"] = quarter
+
+    route["performance_type"] = _parse_performance_type(str(data.get("performance_type") or ""))
+    return route
+
+def _router_llm(llm):
+    kwargs = {"reasoning_effort": ROUTER_REASONING_EFFORT} if ROUTER_REASONING_EFFORT else {}
+    return llm.bind(
+        max_tokens=ROUTER_MAX_TOKENS,
+        response_format={
+            "type": "json_schema",
+            "json_schema": {"name": "dpmes_route", "schema": ROUTER_SCHEMA},
+        },
+        **kwargs,
+    )
+
+def route_question(llm, question: str) -> dict:
+    """
+    One LLM round-trip for intent, year, quarter and performance type.
+    Returns e.g. {"intent": "MINISTRY_PERFORMANCE", "year": "2017",
+    "quarter": "9month", "performance_type": "weak_performance"}
+    """
+    result = _router_llm(llm).invoke(ROUTER_PROMPT.format(question=question))
+    return _parse_route(result.content)
+
+async def aroute_question(llm, question: str) -> dict:
+    result = await _router_llm(llm).ainvoke(ROUTER_PROMPT.format(question=question))
+    return _parse_route(result.content)
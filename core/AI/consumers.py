@@ -1,116 +1,125 @@
 import json
 import asyncio
+import logging
 import re
-import requests
+from collections import deque
+from contextlib import aclosing
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from AI.classifier import classify_intent,extract_year_quarter, extract_performance_type
+from AI import upstream
+from AI.upstream import fetch_many
+from AI.context import build_time_series_context, build_ministry_score_context, build_ministry_performance_context
+from AI.classifier import aroute_question
+from AI.fastpath import fast_route, route_for_intent, likely_route
+from AI.intent_index import intent_index
+from AI.entity_index import entity_index
+from AI.streaming import StreamCoalescer, stream_settings
+from AI.history import (
+    history_writer,
+    history_compression,
+    history_frame,
+    page_limit,
+    HISTORY_RING_SIZE,
+    HISTORY_PAGE_SIZE,
+)
+from AI.summary import conversation_summarizer, budgeted_history
+from AI.admission import llm_admission, AdmissionRejected
+from AI.tokens import count_tokens
 from AI.intents import INTENTS
 
-class ChatConsumer(AsyncWebsocketConsumer):
+logger = logging.getLogger(__name__)
 
-    # ==========================
-    # WebSocket lifecycle
-    # ==========================
 
-    async def connect(self):
-        self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
-        self.room_group_name = f"chat_{self.room_name}"
+async def cancel_tasks(*tasks):
+    """Cancel whichever of `tasks` are still running and wait for all of them."""
+    tasks = [task for task in tasks if task is not None]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
 
-        # Fetch instance ID safely
-        self.instance_id = await self.get_instance_id(self.room_name)
 
-        if not self.instance_id:
-            await self.close()
-            return
-
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+class ChatSessionMixin:
+    """
+    What ChatConsumer and ChatWebConsumer share: answer task tracking, LLM
+    admission frames, the in-memory turn history and its summary.
+    """
 
-        await self.accept()
+    # ==========================
+    # Answer tasks
+    # ==========================
 
     async def disconnect(self, close_code):
+        # Nobody will read the rest of the answer: stop generating it.
+        generations = list(self.generations)
+        for task in generations:
+            task.cancel()
+        await asyncio.gather(*generations, return_exceptions=True)
+
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
 
-    # ==========================
-    # Incoming messages
-    # ==========================
-
-    async def receive(self, text_data):
-        from AI.utils import run_chain_stream
-        from .vectorstore import get_retriever
-        from .providers import get_llm_instance
-
-        llm = get_llm_instance()
-        retriever = get_retriever()
-
-        data = json.loads(text_data)
-        question_text = data.get("message", "").strip()
+    def start_answer(self, data):
+        """
+        Answer in a task tracked by the connection so disconnect() can cancel
+        it; the lock keeps one answer streaming at a time, in arrival order.
+        """
+        task = asyncio.create_task(self.answer(data))
+        self.generations.add(task)
+        task.add_done_callback(self.answer_done)
 
-        if not question_text:
+    def answer_done(self, task):
+        self.generations.discard(task)
+        if task.cancelled() or task.exception() is None:
             return
+        logger.error("Answer failed for chat %s", self.instance_id, exc_info=task.exception())
+        # The client is waiting for is_final; tell it the answer is not coming.
+        notice = asyncio.create_task(self.send_failure())
+        self.generations.add(notice)
+        notice.add_done_callback(self.generations.discard)
 
-        # Save question
-        await self.save_question(self.instance_id, question_text)
-
-        year_requested = self.extract_year_from_question(question_text)
-
-
-
-        intent = classify_intent(llm, question_text)
-        docs = retriever.invoke(question_text)
-
-
-        if intent == INTENTS["TIME_SERIES"]:
-            full_context = await self.create_context(docs, year_requested)
-        elif intent == INTENTS["MINISTRY_SCORE"]:
-            period_requested = extract_year_quarter(llm, question_text)
-            full_context = await self.create_ministry_context(docs, period_requested)
-        elif intent == INTENTS["MINISTRY_PERFORMANCE"]:
-            period_requested = extract_year_quarter(llm, question_text)
-            performance_requested = extract_performance_type(llm, question_text)
-            full_context = await self.create_ministry_performance_context(docs, period_requested,performance_requested)
-        else:
-            full_context = "Please clarify your question related to DPMES indicators."
-
-
-        full_response = []
-
-        history = await self.get_history(self.instance_id)
-        conversation_list = self.format_history_for_llm(history)
-
-        # STREAM DIRECTLY TO CLIENT
-        async for chunk in run_chain_stream(llm, conversation_list, full_context, question_text, intent):
-            if not chunk:
-                continue
-
-            full_response.append(chunk)
-
-            await self.send(text_data=json.dumps({
-                "message": chunk,
-                "is_stream": True,
-            }))
-
-            # Yield control to event loop 
-            await asyncio.sleep(0)
+    async def answer(self, data):
+        async with self.answer_lock:
+            await self.answer_question(data)
 
-        final_response = "".join(full_response)
+    # ==========================
+    # Outgoing frames
+    # ==========================
 
-        # Save full response
-        await self.save_response(self.instance_id, final_response)
+    async def send_queue_position(self, position):
+        await self.send(text_data=json.dumps({
+            "type": "queue",
+            "position": position,
+            "is_stream": False,
+            "is_final": False,
+        }))
 
-        # Explicit end-of-stream signal
+    async def send_rejection(self, rejection):
         await self.send(text_data=json.dumps({
-            "message": "",
+            "message": f"<p>{rejection.message}</p>",
+            "error": rejection.reason,
             "is_stream": False,
             "is_final": True,
         }))
 
+    async def send_failure(self):
+        try:
+            await self.send(text_data=json.dumps({
+                "message": "<p>Sorry, something went wrong while answering. Please try again.</p>",
+                "error": "failed",
+                "is_stream": False,
+                "is_final": True,
+            }))
+        except Exception as e:
+            logger.warning("Could not report the failed answer for chat %s: %r", self.instance_id, e)
+
+    async def charge_tokens(self, conversation_list, context, question, answer):
+        """Count this generation against the user's token quota (system rules excluded)."""
+        tokens = sum(count_tokens(m["content"]) for m in conversation_list)
+        tokens += count_tokens(context) + count_tokens(question) + count_tokens(answer)
+        await llm_admission.charge(self.user_key, tokens)
+
     async def chat_message(self, event):
         await self.send(text_data=json.dumps({
             "message": event["message"],
@@ -119,348 +128,95 @@ class ChatConsumer(AsyncWebsocketConsumer):
         }))
 
     # ==========================
-    # Database helpers
+    # History
     # ==========================
 
     @database_sync_to_async
-    def get_instance_id(self, room_name):
+    def get_chat(self, room_name):
         from .models import ChatInstance
-        instance = ChatInstance.objects.filter(
+        return ChatInstance.objects.filter(
             id=room_name,
             is_deleted=False
-        ).first()
-        return instance.id if instance else None
-
-    @database_sync_to_async
-    def get_history(self, instance_id):
-        from .models import QuestionHistory
-        return list(
-            QuestionHistory.objects.filter(
-                instance_id=instance_id
-            ).order_by("created_at")
-             .values("question", "response")
-        )
-
-    @database_sync_to_async
-    def save_question(self, instance_id, question):
-        from .models import QuestionHistory
-        return QuestionHistory.objects.create(
-            instance_id=instance_id,
-            question=question
-        )
+        ).values("id", "user_id").first()
 
     @database_sync_to_async
-    def save_response(self, instance_id, response):
+    def get_recent_history(self, instance_id, limit):
         from .models import QuestionHistory
-        last = QuestionHistory.objects.filter(
+        rows = QuestionHistory.objects.filter(
             instance_id=instance_id
-        ).order_by("-created_at").first()
-        if last:
-            last.response = response
-            last.save()
-
-    # ==========================
-    # Context building
-    # ==========================
+        ).order_by("-id").values("id", "question", "response")[:limit]
+        count = QuestionHistory.objects.filter(instance_id=instance_id).count()
+        return list(reversed(rows)), count
 
-    async def create_context(self, docs, year_requested):
-        contexts = []
-
-        for doc in docs:
-
-            meta = doc.metadata
-
-            indicator_code = meta.get("indicator_code", "")
-            annual_measurement_unit = meta.get("annual_measurement_unit", "")
-            quarter_measurement_unit = meta.get("quarter_measurement_unit", "")
-            month_measurement_unit = meta.get("month_measurement_unit", "")
-            name = meta.get("indicator_eng", "")
-            topic = meta.get("topic_name", "")
-            category = meta.get("category_name", "")
-            source = meta.get("source", "")
-            kpi_type = meta.get("characteristics", "")
-            parent = meta.get("parent", "")
-
-            response = await self.fetch_time_series_value(
-                indicator_code,
-                year_requested
-            )
-
-            historical_info = self.format_time_series(
-                response,
-                year_requested
-            )
-
-            metadata_info = f"""
-<h3>Indicator Metadata</h3>
-<p><b>Name:</b> {name}</p>
-<p><b>Code:</b> {indicator_code}</p>
-<p><b>Topic:</b> {topic}</p>
-<p><b>Category:</b> {category}</p>
-<p><b>Annual Measurement Unit:</b> {annual_measurement_unit}</p>
-<p><b>Quarter Measurement Unit:</b> {quarter_measurement_unit}</p>
-<p><b>Month Measurement Unit:</b> {month_measurement_unit}</p>
-<p><b>Source:</b> {source}</p>
-<p><b>KPI Type:</b> {kpi_type}</p>
-<p><b>Parent:</b> {parent}</p>
-"""
-
-            contexts.append(
-                doc.page_content +
-                "\n\n" +
-                metadata_info +
-                "\n\n" +
-                historical_info
-            )
-
-        return "\n<hr/>\n".join(contexts)
-    
-    async def create_ministry_context(self, docs, period_requested):
-        contexts = []
-
-        for doc in docs:
-            meta = doc.metadata or {}
+    async def load_recent_turns(self, instance_id, limit):
+        """
+        The latest `limit` turns and the total turn count, loaded once on
+        connect. Turns still queued in the history writer (e.g. a quick
+        reconnect) are merged in.
+        """
+        pending = history_writer.pending(instance_id)
+        rows, count = await self.get_recent_history(instance_id, limit)
 
-            m_id = meta.get("responsible_ministry_id", "")
-            m_name = meta.get("responsible_ministry_eng", "Unknown Ministry")
-            m_code = meta.get("responsible_ministry_code", "N/A")
-            m_source = meta.get("source", "Ministry of Planning and Development")
-            
-    
-            response = await self.fetch_ministry_score(m_id, year=period_requested['year'], quarter=period_requested['quarter'])
-            
-
-            performance_info = self.format_ministry_score(response)
-
-        
-            metadata_info = f"""
-    <h3>Ministry Metadata</h3>
-    <p><b>Ministry Name:</b> {m_name}</p>
-    <p><b>Code:</b> {m_code}</p>
-    <p><b>Data Source:</b> {m_source}</p>
-    <p><b>Entity ID:</b> {m_id}</p>
-    """
+        queued = {turn.pk: turn.response for turn in pending if turn.pk is not None}
+        rows = [{**row, "response": queued.get(row["id"], row["response"])} for row in rows]
 
-            contexts.append(
-                f"{doc.page_content}\n\n{metadata_info}\n\n{performance_info}"
-            )
+        unsaved = [turn for turn in pending if turn.pk is None]
+        rows += [{"id": None, "question": turn.question, "response": turn.response} for turn in unsaved]
 
-        return "\n<hr/>\n".join(contexts)
-    
-    async def create_ministry_performance_context(self, docs, period_requested,performance_requested):
-        contexts = []
+        return rows, count + len(unsaved)
 
-        for doc in docs:
-            meta = doc.metadata or {}
+    def remember_turn(self, turn):
+        """
+        Record a turn once its answer is finished, sent or not. Rejected,
+        failed and cancelled questions have QuestionHistory rows too, so they
+        count as well; the summariser's offsets are positions in those rows.
+        """
+        self.turns.append({"question": turn.question, "response": turn.response})
+        self.turn_count += 1
+        self.refresh_summary()
 
-            m_id = meta.get("responsible_ministry_id", "")
-            m_name = meta.get("responsible_ministry_eng", "Unknown Ministry")
-            m_code = meta.get("responsible_ministry_code", "N/A")
-            m_source = meta.get("source", "Ministry of Planning and Development")
-            
-    
-            response = await self.fetch_ministry_performance(m_id, year=period_requested['year'], quarter=period_requested['quarter'], performance_requested = performance_requested)
-            
-
-            performance_info = self.format_ministry_performance(response)
-
-        
-            metadata_info = f"""
-    <h3>Ministry Metadata</h3>
-    <p><b>Ministry Name:</b> {m_name}</p>
-    <p><b>Code:</b> {m_code}</p>
-    <p><b>Data Source:</b> {m_source}</p>
-    <p><b>Entity ID:</b> {m_id}</p>
-    """
+    def refresh_summary(self):
+        """Fold turns that left the history window into the chat summary, in the background."""
+        from .providers import get_llm_instance
 
-            contexts.append(
-                f"{doc.page_content}\n\n{metadata_info}\n\n{performance_info}"
-            )
+        task = conversation_summarizer.schedule(
+            get_llm_instance(), self.instance_id, self.summarized_turns, self.turn_count
+        )
+        if task is not None:
+            task.add_done_callback(self.summary_updated)
 
-        return "\n<hr/>\n".join(contexts)
+    def summary_updated(self, task):
+        if not task.cancelled() and task.exception() is None:
+            self.summary, self.summarized_turns = task.result()
 
-            
     # ==========================
     # Utilities
     # ==========================
 
-    @database_sync_to_async
-    def fetch_time_series_value(self, indicator_code, year):
-        url = "https://time-series.mopd.gov.et/api/mobile/annual_value/"
-        params = {"code": indicator_code, "year": year}
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return {}
+    async def fetch_time_series_value(self, indicator_code, year):
+        return await upstream.fetch_time_series_value(indicator_code, year)
 
-    @database_sync_to_async
-    def fetch_ministry_score(self,ministry_id, year, quarter):
-        url = f"https://dpmes.mopd.gov.et/api/ai/ministry-score/{ministry_id}"
-        params = {}
-        if year and year.lower() != "null":
-            params["year"] = year
-        if quarter and quarter.lower() != "null":
-            params["quarter"] = quarter
-
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return {}
-    
-    @database_sync_to_async
-    def fetch_ministry_performance(self,ministry_id, year, quarter, performance_requested):
-        url = f"https://dpmes.mopd.gov.et/api/ai/ministry-kpi-performance/{ministry_id}"
-        params = {}
-        if year and year.lower() != "null":
-            params["year"] = year
-        if quarter and quarter.lower() != "null":
-            params["quarter"] = quarter
-        if performance_requested:
-            params["performance_type"] = performance_requested
-            
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return {}
-    
-    
     @staticmethod
     def extract_year_from_question(question):
         match = re.search(r"\b(19|20)\d{2}\b", question)
         return int(match.group()) if match else None
 
-    @staticmethod
-    def format_time_series(response, year):
-        if not response:
-            return "<p>Data not available</p>"
-
-        ts = response.get("time_series")
-        if not ts:
-            value = response.get("value")
-            if value:
-                return f"<p>{year}: {value}</p>"
-            return "<p>Data not available</p>"
-
-        output = ""
-
-        for key, label in [
-            ("annual", "Annual Data"),
-            ("quarter", "Quarterly Data"),
-            ("month", "Monthly Data"),
-        ]:
-            items = ts.get(key, [])
-            if items:
-                output += f"<h4>{label}</h4>"
-                for item in items:
-                    output += f"<p>{item}</p>"
-
-        return output or "<p>No historical data available</p>"
-    
-    @staticmethod
-    def format_ministry_score(data):
-        if not data:
-            return "<p>No ministry performance data found.</p>"
-        
-        ministry_name = data.get("responsible_ministry_eng", "Unknown Ministry")
-        code = data.get("code", "N/A")
-        total_indicators = data.get("number_of_indicators", 0)
-        
-        score_card = data.get("ministry_score_card", {})
-        overall_score = score_card.get("score", "N/A")
-        year = score_card.get("year", "N/A")
-        quarter = score_card.get("quarter", "Annual")
-        score_color = score_card.get("score_color", "#000000")
-        
-        header_html = f"""
-    <h3>Ministry Performance Overview: {ministry_name} ({code})</h3>
-    <p><b>Reporting Period:</b> {year} {f'- {quarter}' if quarter != 'Annual' else ''}</p>
-    <p><b>Overall Ministry Score:</b> <span style="color: {score_color}; font-weight: bold;">{overall_score}</span></p>
-    <p><b>Performance Status Color:</b> {score_color}</p>
-    <p><b>Total Indicators Tracked:</b> {total_indicators}</p>
-    <hr/>
-    """
-
-        policy_areas = data.get("policy_areas", [])
-        table_rows = ""
-        for area in policy_areas:
-            name = area.get("policy_area_eng", "N/A")
-            score = area.get("score", "N/A")
-            p_color = area.get("score_color", "")
-            
-            table_rows += f"<tr><td>{name}</td><td>{score} {f'({p_color})' if p_color else ''}</td></tr>"
-
-        policy_html = f"""
-    <h4>Breakdown by Policy Area</h4>
-    <table>
-        <thead>
-            <tr><th>Policy Area</th><th>Score</th></tr>
-        </thead>
-        <tbody>
-            {table_rows}
-        </tbody>
-    </table>
-    """
-        return header_html + policy_html
-    
-    @staticmethod
-    def format_ministry_performance(data):
-        if not data or not data.get("kpis"):
-            return "<p>No specific indicator performance data found for the selected criteria.</p>"
-        
-        ministry_name = data.get("responsible_ministry_eng", "Unknown Ministry")
-        code = data.get("code", "N/A")
-        kpis = data.get("kpis", [])
-        
-        first_kpi = kpis[0]
-        year = first_kpi.get("year", "N/A")
-        quarter = first_kpi.get("quarter", "Annual")
-
-        header_html = f"""
-    <h3>Indicator Performance List: {ministry_name} ({code})</h3>
-    <p><b>Reporting Period:</b> {year} {f'- {quarter}' if quarter != 'Annual' else ''}</p>
-    <p><b>Total Indicators in this Category:</b> {len(kpis)}</p>
-    <hr/>
-    """
-
-        table_rows = ""
-        for item in kpis:
-            name = item.get("indicator_name", "Unknown Indicator")
-            score = item.get("score", "N/A")
-            color = item.get("scorecard", "#000000")
-            
-            table_rows += f"""
-            <tr>
-                <td style="padding: 8px; border-bottom: 1px solid #ddd;">{name}</td>
-                <td style="padding: 8px; border-bottom: 1px solid #ddd; text-align: center;">
-                    <span style="color: {color}; font-weight: bold;">{score}%</span>
-                </td>
-            </tr>"""
-
-        table_html = f"""
-    <h4>Detailed Indicator Breakdown</h4>
-    <table style="width: 100%; border-collapse: collapse;">
-        <thead>
-            <tr style="background-color: #f2f2f2;">
-                <th style="text-align: left; padding: 8px;">Indicator Name</th>
-                <th style="text-align: center; padding: 8px;">Score</th>
-            </tr>
-        </thead>
-        <tbody>
-            {table_rows}
-        </tbody>
-    </table>
-    """
-        return header_html + table_html
-        
-    
-    
-    def format_history_for_llm(self, history, max_turns=3):
+    def format_history_for_llm(self, history, max_turns=3, total=None, summary=None):
         """
-        Convert DB history to LLM-compatible message format.
-        Keeps last N conversation turns.
+        Convert history to LLM-compatible message format: the running summary
+        of older turns, then the last N-ish turns (see utils.history_window)
+        with plain-text answers, within HISTORY_TOKEN_BUDGET.
         """
+        from AI.utils import history_window
+
         messages = []
-        history = history[-max_turns:]
+        if summary:
+            messages.append({
+                "role": "system",
+                "content": f"Summary of the earlier conversation:\n{summary}"
+            })
+
+        history = budgeted_history(history_window(history, max_turns, total))
 
         for entry in history:
             if entry.get("question"):
@@ -471,15 +227,14 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
             if entry.get("response"):
                 messages.append({
-                    "role": "system",
+                    "role": "assistant",
                     "content": entry["response"]
                 })
 
         return messages
 
 
-
-class ChatWebConsumer(AsyncWebsocketConsumer):
+class ChatConsumer(ChatSessionMixin, AsyncWebsocketConsumer):
 
     # ==========================
     # WebSocket lifecycle
@@ -488,272 +243,438 @@ class ChatWebConsumer(AsyncWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
         self.room_group_name = f"chat_{self.room_name}"
+        self.generations = set()
+        self.answer_lock = asyncio.Lock()
 
         # Fetch instance ID safely
-        self.instance_id = await self.get_instance_id(self.room_name)
+        chat = await self.get_chat(self.room_name)
 
-        if not self.instance_id:
+        if not chat:
             await self.close()
             return
 
+        self.instance_id = chat["id"]
+        # LLM admission is fair per user; chats without an owner count on their own.
+        self.user_key = f"user:{chat['user_id']}" if chat["user_id"] else f"chat:{chat['id']}"
+
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
 
+        self.stream_settings = stream_settings(self.scope)
+        rows, self.turn_count = await self.load_recent_turns(self.instance_id, HISTORY_RING_SIZE)
+        self.turns = deque(rows, maxlen=HISTORY_RING_SIZE)
+        self.summary, self.summarized_turns = await conversation_summarizer.load(self.instance_id)
         await self.accept()
 
-        # Stream chat history
-        history = await self.get_history(self.instance_id)
-
-        for entry in history:
-            await self.send(text_data=json.dumps({
-                "question": entry["question"],
-                "response": entry["response"]
-            }))
-            await asyncio.sleep(0.05)
-
-    async def disconnect(self, close_code):
-        await self.channel_layer.group_discard(
-            self.room_group_name,
-            self.channel_name
-        )
-
     # ==========================
     # Incoming messages
     # ==========================
 
     async def receive(self, text_data):
+        self.start_answer(json.loads(text_data))
+
+    async def answer_question(self, data):
         from AI.utils import run_chain_stream
-        from AI.ai_instance import get_retriever, llm
+        from .vectorstore import aembed_query, aretrieve_by_vector
+        from .providers import get_llm_instance
+        from .answer_cache import answer_cache
 
-        
-        retriever = get_retriever()
+        llm = get_llm_instance()
+        started = asyncio.get_running_loop().time()
 
-        data = json.loads(text_data)
         question_text = data.get("message", "").strip()
 
-
-
-        
-
         if not question_text:
             return
 
-        # Save question
-        await self.save_question(self.instance_id, question_text)
+        # Save question (write-behind; never delays the first token)
+        turn = history_writer.add_question(self.instance_id, question_text)
+        embedding_task = retrieval_task = prefetch_task = None
+        try:
+            year_requested = self.extract_year_from_question(question_text)
+
+            # The question embedding is shared by retrieval and the answer cache;
+            # both run while the router call is in flight.
+            # Questions that name an indicator or ministry exactly resolve to its
+            # documents without a vector search.
+            entity_index.refresh_if_stale()
+            entities = entity_index.match(question_text)
+            guess = likely_route(question_text)
+
+            embedding_task = asyncio.create_task(aembed_query(question_text))
+            if self.needs_documents(guess):
+                retrieval_task = asyncio.create_task(
+                    self.find_documents(entities, guess["intent"], embedding_task, question_text, aretrieve_by_vector)
+                )
+                # Speculatively fetch upstream data for the most likely route too; the
+                # result is kept only if the router agrees.
+                prefetch_task = asyncio.create_task(self.prefetch_context(guess, retrieval_task, year_requested))
+
+            route = await self.resolve_route(llm, question_text, embedding_task)
+            intent = route["intent"]
+
+            conversation_list = self.format_history_for_llm(self.turns, total=self.turn_count, summary=self.summary)
+            # Cached answers are keyed on the question alone, so only turns asked
+            # without any conversation in the prompt can use or fill the cache.
+            cacheable = not conversation_list
+
+            embedding = await embedding_task
+            cached_answer = await answer_cache.lookup(embedding, route, year_requested) if cacheable else None
+            if cached_answer:
+                await cancel_tasks(prefetch_task, retrieval_task)
+                await self.send_cached_answer(turn, cached_answer)
+                return
+
+            if not self.needs_documents(route):
+                # Clarification routes have a constant context; don't wait on Milvus.
+                await cancel_tasks(prefetch_task, retrieval_task)
+                full_context, context_complete = await self.create_route_context(route, [], year_requested)
+            elif prefetch_task is not None and self.context_key(route) == self.context_key(guess):
+                full_context, context_complete = await prefetch_task
+            else:
+                if retrieval_task is not None and (
+                    entities.documents(route["intent"]) == entities.documents(guess["intent"])
+                ):
+                    await cancel_tasks(prefetch_task)
+                    docs = await retrieval_task
+                else:
+                    await cancel_tasks(prefetch_task, retrieval_task)
+                    docs = await self.find_documents(
+                        entities, route["intent"], embedding_task, question_text, aretrieve_by_vector
+                    )
+                full_context, context_complete = await self.create_route_context(route, docs, year_requested)
+
+            full_response = []
+
+            # STREAM TO CLIENT (coalesced into fewer, larger frames), once admitted
+            stream = StreamCoalescer(self.send, **self.stream_settings)
+            try:
+                async with llm_admission.slot(self.user_key, self.send_queue_position):
+                    async with aclosing(run_chain_stream(llm, conversation_list, full_context, question_text, intent)) as chunks:
+                        async for chunk in chunks:
+                            if not chunk:
+                                continue
+
+                            full_response.append(chunk)
+                            await stream.add(chunk)
+            except AdmissionRejected as e:
+                await self.send_rejection(e)
+                return
+            except asyncio.CancelledError:
+                # Client went away mid-answer; keep what was generated.
+                stream.discard()
+                if full_response:
+                    history_writer.set_response(turn, "".join(full_response))
+                raise
+
+            await stream.close()
+
+            final_response = "".join(full_response)
+
+            # Save full response
+            history_writer.set_response(turn, final_response)
+
+            # Explicit end-of-stream signal
+            await self.send(text_data=json.dumps({
+                "message": "",
+                "is_stream": False,
+                "is_final": True,
+            }))
+
+            latency = asyncio.get_running_loop().time() - started
+            await self.charge_tokens(conversation_list, full_context, question_text, final_response)
+            # An answer built while upstream data was unavailable must not be replayed.
+            if cacheable and context_complete:
+                await answer_cache.store(embedding, route, year_requested, final_response, latency)
+        finally:
+            self.remember_turn(turn)
+            # Nothing awaits these once the answer is sent, rejected or
+            # abandoned (the router raised, or the client went away).
+            await cancel_tasks(embedding_task, retrieval_task, prefetch_task)
+
+    @staticmethod
+    async def resolve_route(llm, question_text, embedding_task):
+        """
+        Cheapest router first: keyword rules, then k-NN over the question
+        embedding, and the LLM router only when neither is confident.
+        """
+        route = fast_route(question_text)
+        if route:
+            return route
 
-        year_requested = self.extract_year_from_question(question_text)
+        if await intent_index.aload():
+            intent = intent_index.confident_intent(await embedding_task)
+            if intent:
+                return route_for_intent(question_text, intent)
 
-        docs = retriever.invoke(question_text)
+        return await aroute_question(llm, question_text)
 
+    @staticmethod
+    async def find_documents(entities, intent, embedding_task, question_text, aretrieve_by_vector):
+        """Documents for the entities the question names, else a search restricted to them."""
+        docs = entities.documents(intent)
         if docs:
-            full_context = await self.create_context(docs, year_requested)
-        else:
-            full_context = "No relevant indicator found."
+            return docs
+        return await aretrieve_by_vector(await embedding_task, question_text, entities.filters())
 
+    async def send_cached_answer(self, turn, answer):
+        """Replay a cached answer through the same is_stream frames as a live one."""
+        stream = StreamCoalescer(self.send, **self.stream_settings)
+        await stream.add(answer)
+        await stream.close()
 
-        full_response = []
+        history_writer.set_response(turn, answer)
 
-        history = await self.get_history(self.instance_id)
-        conversation_list = self.format_history_for_llm(history)
+        await self.send(text_data=json.dumps({
+            "message": "",
+            "is_stream": False,
+            "is_final": True,
+        }))
 
-        # STREAM DIRECTLY TO CLIENT
-        async for chunk in run_chain_stream(llm, conversation_list, full_context, question_text):
-            if not chunk:
-                continue
+    # ==========================
+    # Context building
+    # ==========================
 
-            full_response.append(chunk)
+    async def create_route_context(self, route, docs, year_requested):
+        """(context, complete): complete is False if any upstream fetch failed or timed out."""
+        intent = route["intent"]
+        period_requested = {"year": route["year"], "quarter": route["quarter"]}
 
-            await self.send(text_data=json.dumps({
-                "message": chunk,
-                "is_stream": True,
-            }))
+        if intent == INTENTS["TIME_SERIES"]:
+            return await self.create_context(docs, year_requested)
+        elif intent == INTENTS["MINISTRY_SCORE"]:
+            return await self.create_ministry_context(docs, period_requested)
+        elif intent == INTENTS["MINISTRY_PERFORMANCE"]:
+            return await self.create_ministry_performance_context(docs, period_requested, route["performance_type"])
+        return "Please clarify your question related to DPMES indicators.", True
 
-            # Yield control to event loop 
-            await asyncio.sleep(0)
+    @staticmethod
+    def context_key(route):
+        """The parts of a route that create_route_context depends on."""
+        intent = route["intent"]
+        if intent == INTENTS["TIME_SERIES"]:
+            return (intent,)
+        elif intent == INTENTS["MINISTRY_SCORE"]:
+            return (intent, route["year"], route["quarter"])
+        elif intent == INTENTS["MINISTRY_PERFORMANCE"]:
+            return (intent, route["year"], route["quarter"], route["performance_type"])
+        return (None,)
 
-        final_response = "".join(full_response)
+    @classmethod
+    def needs_documents(cls, route):
+        """Whether the route's context is built from retrieved documents."""
+        return cls.context_key(route) != (None,)
 
-        # Save full response
-        await self.save_response(self.instance_id, final_response)
+    async def prefetch_context(self, route, retrieval_task, year_requested):
+        # Shielded: discarding the speculation must not cancel the shared retrieval.
+        docs = await asyncio.shield(retrieval_task)
+        return await self.create_route_context(route, docs, year_requested)
 
-        # Explicit end-of-stream signal
-        await self.send(text_data=json.dumps({
-            "message": "",
-            "is_stream": False,
-            "is_final": True,
-        }))
+    async def create_context(self, docs, year_requested):
+        keys = [(doc.metadata.get("indicator_code", ""), year_requested) for doc in docs]
+        responses = await fetch_many(self.fetch_time_series_value, keys)
+        context = build_time_series_context(docs, [responses[key] for key in keys], year_requested)
+        return context, responses.complete
+    
+    async def create_ministry_context(self, docs, period_requested):
+        keys = [
+            ((doc.metadata or {}).get("responsible_ministry_id", ""), period_requested['year'], period_requested['quarter'])
+            for doc in docs
+        ]
+        responses = await fetch_many(self.fetch_ministry_score, keys)
+        return build_ministry_score_context(docs, [responses[key] for key in keys]), responses.complete
+    
+    async def create_ministry_performance_context(self, docs, period_requested,performance_requested):
+        keys = [
+            ((doc.metadata or {}).get("responsible_ministry_id", ""), period_requested['year'], period_requested['quarter'], performance_requested)
+            for doc in docs
+        ]
+        responses = await fetch_many(self.fetch_ministry_performance, keys)
+        return build_ministry_performance_context(docs, [responses[key] for key in keys]), responses.complete
+
+    # ==========================
+    # Utilities
+    # ==========================
 
+    async def fetch_ministry_score(self, ministry_id, year, quarter):
+        return await upstream.fetch_ministry_score(ministry_id, year, quarter)
 
+    async def fetch_ministry_performance(self, ministry_id, year, quarter, performance_requested):
+        return await upstream.fetch_ministry_performance(ministry_id, year, quarter, performance_requested)
 
-    async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            "message": event["message"],
-            "is_stream": event.get("is_stream", False),
-            "is_final": event.get("is_final", False)
-        }))
+
+class ChatWebConsumer(ChatSessionMixin, AsyncWebsocketConsumer):
 
     # ==========================
-    # Database helpers
+    # WebSocket lifecycle
     # ==========================
 
-    @database_sync_to_async
-    def get_instance_id(self, room_name):
-        from .models import ChatInstance
-        instance = ChatInstance.objects.filter(
-            id=room_name,
-            is_deleted=False
-        ).first()
-        return instance.id if instance else None
+    async def connect(self):
+        self.room_name = self.scope["url_route"]["kwargs"]["room_name"]
+        self.room_group_name = f"chat_{self.room_name}"
+        self.generations = set()
+        self.answer_lock = asyncio.Lock()
 
-    @database_sync_to_async
-    def get_history(self, instance_id):
-        from .models import QuestionHistory
-        return list(
-            QuestionHistory.objects.filter(
-                instance_id=instance_id
-            ).order_by("created_at")
-             .values("question", "response")
+        # Fetch instance ID safely
+        chat = await self.get_chat(self.room_name)
+
+        if not chat:
+            await self.close()
+            return
+
+        self.instance_id = chat["id"]
+        # LLM admission is fair per user; chats without an owner count on their own.
+        self.user_key = f"user:{chat['user_id']}" if chat["user_id"] else f"chat:{chat['id']}"
+
+        await self.channel_layer.group_add(
+            self.room_group_name,
+            self.channel_name
         )
 
-    @database_sync_to_async
-    def save_question(self, instance_id, question):
-        from .models import QuestionHistory
-        return QuestionHistory.objects.create(
-            instance_id=instance_id,
-            question=question
+        self.stream_settings = stream_settings(self.scope)
+        self.compress_history = history_compression(self.scope)
+        rows, self.turn_count = await self.load_recent_turns(
+            self.instance_id, max(HISTORY_PAGE_SIZE, HISTORY_RING_SIZE)
         )
+        self.turns = deque(rows[-HISTORY_RING_SIZE:], maxlen=HISTORY_RING_SIZE)
+        self.summary, self.summarized_turns = await conversation_summarizer.load(self.instance_id)
+        await self.accept()
 
-    @database_sync_to_async
-    def save_response(self, instance_id, response):
-        from .models import QuestionHistory
-        last = QuestionHistory.objects.filter(
-            instance_id=instance_id
-        ).order_by("-created_at").first()
-        if last:
-            last.response = response
-            last.save()
+        # Latest page of chat history in one frame; older pages on request
+        page = rows[-HISTORY_PAGE_SIZE:]
+        cursor = next((row["id"] for row in page if row["id"] is not None), None)
+        await self.send(text_data=history_frame(
+            page,
+            cursor,
+            has_more=cursor is not None and self.turn_count > len(page),
+            compress=self.compress_history,
+        ))
 
     # ==========================
-    # Context building
+    # Incoming messages
     # ==========================
 
-    async def create_context(self, docs, year_requested):
-        contexts = []
-
-        for doc in docs:
-            meta = doc.metadata
-
-            indicator_code = meta.get("indicator_code", "")
-            annual_measurement_unit = meta.get("annual_measurement_unit", "")
-            quarter_measurement_unit = meta.get("quarter_measurement_unit", "")
-            month_measurement_unit = meta.get("month_measurement_unit", "")
-            name = meta.get("indicator_eng", "")
-            topic = meta.get("topic_name", "")
-            category = meta.get("category_name", "")
-            source = meta.get("source", "")
-            kpi_type = meta.get("characteristics", "")
-            parent = meta.get("parent", "")
-
-            response = await self.fetch_time_series_value(
-                indicator_code,
-                year_requested
-            )
-
-            historical_info = self.format_time_series(
-                response,
-                year_requested
-            )
-
-            metadata_info = f"""
-<h3>Indicator Metadata</h3>
-<p><b>Name:</b> {name}</p>
-<p><b>Code:</b> {indicator_code}</p>
-<p><b>Topic:</b> {topic}</p>
-<p><b>Category:</b> {category}</p>
-<p><b>Annual Measurement Unit:</b> {annual_measurement_unit}</p>
-<p><b>Quarter Measurement Unit:</b> {quarter_measurement_unit}</p>
-<p><b>Month Measurement Unit:</b> {month_measurement_unit}</p>
-<p><b>Source:</b> {source}</p>
-<p><b>KPI Type:</b> {kpi_type}</p>
-<p><b>Parent:</b> {parent}</p>
-"""
-
-            contexts.append(
-                doc.page_content +
-                "\n\n" +
-                metadata_info +
-                "\n\n" +
-                historical_info
-            )
-
-        return "\n<hr/>\n".join(contexts)
+    async def receive(self, text_data):
+        data = json.loads(text_data)
+
+        # {"type": "history", "before": <cursor>, "limit": 20} pages back through the chat
+        if data.get("type") == "history":
+            await self.send_history_page(data.get("before"), data.get("limit"))
+            return
+
+        self.start_answer(data)
+
+    async def answer_question(self, data):
+        from AI.utils import run_chain_stream
+        from .vectorstore import aembed_query, aretrieve_by_vector
+        from .providers import get_llm_instance
+
+        llm = get_llm_instance()
+
+        question_text = data.get("message", "").strip()
+
+        if not question_text:
+            return
+
+        # Save question (write-behind; never delays the first token)
+        turn = history_writer.add_question(self.instance_id, question_text)
+
+        try:
+            year_requested = self.extract_year_from_question(question_text)
+
+            entity_index.refresh_if_stale()
+            entities = entity_index.match(question_text)
+            docs = entities.documents(INTENTS["TIME_SERIES"])
+            if not docs:
+                docs = await aretrieve_by_vector(await aembed_query(question_text), question_text, entities.filters())
+
+            if docs:
+                full_context = await self.create_context(docs, year_requested)
+            else:
+                full_context = "No relevant indicator found."
+
+
+            full_response = []
+
+            conversation_list = self.format_history_for_llm(self.turns, total=self.turn_count, summary=self.summary)
+
+            # STREAM TO CLIENT (coalesced into fewer, larger frames), once admitted
+            stream = StreamCoalescer(self.send, **self.stream_settings)
+            try:
+                async with llm_admission.slot(self.user_key, self.send_queue_position):
+                    async with aclosing(run_chain_stream(llm, conversation_list, full_context, question_text)) as chunks:
+                        async for chunk in chunks:
+                            if not chunk:
+                                continue
+
+                            full_response.append(chunk)
+                            await stream.add(chunk)
+            except AdmissionRejected as e:
+                await self.send_rejection(e)
+                return
+            except asyncio.CancelledError:
+                # Client went away mid-answer; keep what was generated.
+                stream.discard()
+                if full_response:
+                    history_writer.set_response(turn, "".join(full_response))
+                raise
+
+            await stream.close()
+
+            final_response = "".join(full_response)
+
+            # Save full response
+            history_writer.set_response(turn, final_response)
+
+            # Explicit end-of-stream signal
+            await self.send(text_data=json.dumps({
+                "message": "",
+                "is_stream": False,
+                "is_final": True,
+            }))
+
+            await self.charge_tokens(conversation_list, full_context, question_text, final_response)
+        finally:
+            self.remember_turn(turn)
 
     # ==========================
-    # Utilities
+    # Database helpers
     # ==========================
 
     @database_sync_to_async
-    def fetch_time_series_value(self, indicator_code, year):
-        url = "https://time-series.mopd.gov.et/api/mobile/annual_value/"
-        params = {"code": indicator_code, "year": year}
-        response = requests.get(url, params=params, timeout=10)
-        if response.status_code == 200:
-            return response.json()
-        return {}
-
-    @staticmethod
-    def extract_year_from_question(question):
-        match = re.search(r"\b(19|20)\d{2}\b", question)
-        return int(match.group()) if match else None
+    def get_history_page(self, instance_id, before, limit):
+        from .models import QuestionHistory
+        rows = list(
+            QuestionHistory.objects.filter(
+                instance_id=instance_id,
+                id__lt=before,
+            ).order_by("-id")
+             .values("id", "question", "response")[:limit + 1]
+        )
+        return list(reversed(rows[:limit])), len(rows) > limit
 
-    @staticmethod
-    def format_time_series(response, year):
-        if not response:
-            return "<p>Data not available</p>"
-
-        ts = response.get("time_series")
-        if not ts:
-            value = response.get("value")
-            if value:
-                return f"<p>{year}: {value}</p>"
-            return "<p>Data not available</p>"
-
-        output = ""
-
-        for key, label in [
-            ("annual", "Annual Data"),
-            ("quarter", "Quarterly Data"),
-            ("month", "Monthly Data"),
-        ]:
-            items = ts.get(key, [])
-            if items:
-                output += f"<h4>{label}</h4>"
-                for item in items:
-                    output += f"<p>{item}</p>"
-
-        return output or "<p>No historical data available</p>"
-    
-    def format_history_for_llm(self, history, max_turns=3):
-        """
-        Convert DB history to LLM-compatible message format.
-        Keeps last N conversation turns.
-        """
-        messages = []
-        history = history[-max_turns:]
+    async def send_history_page(self, before, limit):
+        try:
+            before = int(before)
+        except (TypeError, ValueError):
+            await self.send(text_data=json.dumps({"error": "history request needs a 'before' cursor"}))
+            return
 
-        for entry in history:
-            if entry.get("question"):
-                messages.append({
-                    "role": "user",
-                    "content": entry["question"]
-                })
+        rows, has_more = await self.get_history_page(self.instance_id, before, page_limit(limit))
+        await self.send(text_data=history_frame(
+            rows,
+            rows[0]["id"] if rows else None,
+            has_more,
+            compress=self.compress_history,
+        ))
 
-            if entry.get("response"):
-                messages.append({
-                    "role": "system",
-                    "content": entry["response"]
-                })
+    # ==========================
+    # Context building
+    # ==========================
 
-        return messages
+    async def create_context(self, docs, year_requested):
+        keys = [(doc.metadata.get("indicator_code", ""), year_requested) for doc in docs]
+        responses = await fetch_many(self.fetch_time_series_value, keys)
+        return build_time_series_context(docs, [responses[key] for key in keys], year_requested)
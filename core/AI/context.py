@@ -0,0 +1,406 @@
+import json
+import logging
+from django.conf import settings
+from AI.intents import INTENTS
+from AI.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+HTML = "html"
+COMPACT = "compact"
+
+
+def context_format():
+    return getattr(settings, "AI_CONTEXT_FORMAT", COMPACT)
+
+
+def token_budget(intent):
+    return getattr(settings, "AI_CONTEXT_TOKEN_BUDGETS", {}).get(intent)
+
+
+# ==========================
+# HTML renderer (original output)
+# ==========================
+
+def format_time_series(response, year):
+    if not response:
+        return "<p>Data not available</p>"
+
+    ts = response.get("time_series")
+    if not ts:
+        value = response.get("value")
+        if value:
+            return f"<p>{year}: {value}</p>"
+        return "<p>Data not available</p>"
+
+    output = ""
+
+    for key, label in [
+        ("annual", "Annual Data"),
+        ("quarter", "Quarterly Data"),
+        ("month", "Monthly Data"),
+    ]:
+        items = ts.get(key, [])
+        if items:
+            output += f"<h4>{label}</h4>"
+            for item in items:
+                output += f"<p>{item}</p>"
+
+    return output or "<p>No historical data available</p>"
+
+def format_ministry_score(data):
+    if not data:
+        return "<p>No ministry performance data found.</p>"
+
+    ministry_name = data.get("responsible_ministry_eng", "Unknown Ministry")
+    code = data.get("code", "N/A")
+    total_indicators = data.get("number_of_indicators", 0)
+
+    score_card = data.get("ministry_score_card", {})
+    overall_score = score_card.get("score", "N/A")
+    year = score_card.get("year", "N/A")
+    quarter = score_card.get("quarter", "Annual")
+    score_color = score_card.get("score_color", "#000000")
+
+    header_html = f"""
+<h3>Ministry Performance Overview: {ministry_name} ({code})</h3>
+<p><b>Reporting Period:</b> {year} {f'- {quarter}' if quarter != 'Annual' else ''}</p>
+<p><b>Overall Ministry Score:</b> <span style="color: {score_color}; font-weight: bold;">{overall_score}</span></p>
+<p><b>Performance Status Color:</b> {score_color}</p>
+<p><b>Total Indicators Tracked:</b> {total_indicators}</p>
+<hr/>
+"""
+
+    policy_areas = data.get("policy_areas", [])
+    table_rows = ""
+    for area in policy_areas:
+        name = area.get("policy_area_eng", "N/A")
+        score = area.get("score", "N/A")
+        p_color = area.get("score_color", "")
+
+        table_rows += f"<tr><td>{name}</td><td>{score} {f'({p_color})' if p_color else ''}</td></tr>"
+
+    policy_html = f"""
+<h4>Breakdown by Policy Area</h4>
+<table>
+    <thead>
+        <tr><th>Policy Area</th><th>Score</th></tr>
+    </thead>
+    <tbody>
+        {table_rows}
+    </tbody>
+</table>
+"""
+    return header_html + policy_html
+
+def format_ministry_performance(data):
+    if not data or not data.get("kpis"):
+        return "<p>No specific indicator performance data found for the selected criteria.</p>"
+
+    ministry_name = data.get("responsible_ministry_eng", "Unknown Ministry")
+    code = data.get("code", "N/A")
+    kpis = data.get("kpis", [])
+
+    first_kpi = kpis[0]
+    year = first_kpi.get("year", "N/A")
+    quarter = first_kpi.get("quarter", "Annual")
+
+    header_html = f"""
+<h3>Indicator Performance List: {ministry_name} ({code})</h3>
+<p><b>Reporting Period:</b> {year} {f'- {quarter}' if quarter != 'Annual' else ''}</p>
+<p><b>Total Indicators in this Category:</b> {len(kpis)}</p>
+<hr/>
+"""
+
+    table_rows = ""
+    for item in kpis:
+        name = item.get("indicator_name", "Unknown Indicator")
+        score = item.get("score", "N/A")
+        color = item.get("scorecard", "#000000")
+
+        table_rows += f"""
+        <tr>
+            <td style="padding: 8px; border-bottom: 1px solid #ddd;">{name}</td>
+            <td style="padding: 8px; border-bottom: 1px solid #ddd; text-align: center;">
+                <span style="color: {color}; font-weight: bold;">{score}%</span>
+            </td>
+        </tr>"""
+
+    table_html = f"""
+<h4>Detailed Indicator Breakdown</h4>
+<table style="width: 100%; border-collapse: collapse;">
+    <thead>
+        <tr style="background-color: #f2f2f2;">
+            <th style="text-align: left; padding: 8px;">Indicator Name</th>
+            <th style="text-align: center; padding: 8px;">Score</th>
+        </tr>
+    </thead>
+    <tbody>
+        {table_rows}
+    </tbody>
+</table>
+"""
+    return header_html + table_html
+
+
+def html_indicator_section(doc, response, year_requested):
+    meta = doc.metadata
+
+    indicator_code = meta.get("indicator_code", "")
+    annual_measurement_unit = meta.get("annual_measurement_unit", "")
+    quarter_measurement_unit = meta.get("quarter_measurement_unit", "")
+    month_measurement_unit = meta.get("month_measurement_unit", "")
+    name = meta.get("indicator_eng", "")
+    topic = meta.get("topic_name", "")
+    category = meta.get("category_name", "")
+    source = meta.get("source", "")
+    kpi_type = meta.get("characteristics", "")
+    parent = meta.get("parent", "")
+
+    historical_info = format_time_series(
+        response,
+        year_requested
+    )
+
+    metadata_info = f"""
+<h3>Indicator Metadata</h3>
+<p><b>Name:</b> {name}</p>
+<p><b>Code:</b> {indicator_code}</p>
+<p><b>Topic:</b> {topic}</p>
+<p><b>Category:</b> {category}</p>
+<p><b>Annual Measurement Unit:</b> {annual_measurement_unit}</p>
+<p><b>Quarter Measurement Unit:</b> {quarter_measurement_unit}</p>
+<p><b>Month Measurement Unit:</b> {month_measurement_unit}</p>
+<p><b>Source:</b> {source}</p>
+<p><b>KPI Type:</b> {kpi_type}</p>
+<p><b>Parent:</b> {parent}</p>
+"""
+
+    return (
+        doc.page_content +
+        "\n\n" +
+        metadata_info +
+        "\n\n" +
+        historical_info
+    )
+
+
+def html_ministry_section(doc, performance_info):
+    meta = doc.metadata or {}
+
+    m_id = meta.get("responsible_ministry_id", "")
+    m_name = meta.get("responsible_ministry_eng", "Unknown Ministry")
+    m_code = meta.get("responsible_ministry_code", "N/A")
+    m_source = meta.get("source", "Ministry of Planning and Development")
+
+    metadata_info = f"""
+    <h3>Ministry Metadata</h3>
+    <p><b>Ministry Name:</b> {m_name}</p>
+    <p><b>Code:</b> {m_code}</p>
+    <p><b>Data Source:</b> {m_source}</p>
+    <p><b>Entity ID:</b> {m_id}</p>
+    """
+
+    return f"{doc.page_content}\n\n{metadata_info}\n\n{performance_info}"
+
+
+# ==========================
+# Compact renderer
+# ==========================
+
+def _fields(pairs):
+    return " | ".join(f"{label}: {value}" for label, value in pairs if value not in (None, ""))
+
+
+def _item(item):
+    if isinstance(item, dict):
+        return json.dumps(item, ensure_ascii=False, separators=(",", ":"))
+    return str(item)
+
+
+def compact_indicator_section(doc, response, year_requested):
+    """Return (full, summary) plain-text renderings of one indicator document."""
+    meta = doc.metadata or {}
+
+    header = _fields([
+        ("Indicator", meta.get("indicator_eng")),
+        ("Code", meta.get("indicator_code")),
+        ("Topic", meta.get("topic_name")),
+        ("Category", meta.get("category_name")),
+        ("Unit (annual)", meta.get("annual_measurement_unit")),
+        ("Unit (quarter)", meta.get("quarter_measurement_unit")),
+        ("Unit (month)", meta.get("month_measurement_unit")),
+        ("Source", meta.get("source")),
+        ("KPI Type", meta.get("characteristics")),
+        ("Parent", meta.get("parent")),
+    ])
+
+    lines = []
+    ts = (response or {}).get("time_series")
+    if ts:
+        for key, label in [("annual", "Annual"), ("quarter", "Quarterly"), ("month", "Monthly")]:
+            items = ts.get(key, [])
+            if items:
+                lines.append(f"{label}: " + "; ".join(_item(i) for i in items))
+    elif response and response.get("value"):
+        lines.append(f"{year_requested}: {response['value']}")
+
+    data = "\n".join(lines) or "Data not available"
+    full = f"{header}\n{doc.page_content}\n{data}"
+    summary = f"{header}\n(data omitted to fit the context budget)"
+    return full, summary
+
+
+def _ministry_header(doc):
+    meta = doc.metadata or {}
+    return _fields([
+        ("Ministry", meta.get("responsible_ministry_eng", "Unknown Ministry")),
+        ("Code", meta.get("responsible_ministry_code", "N/A")),
+        ("Entity ID", meta.get("responsible_ministry_id")),
+        ("Source", meta.get("source", "Ministry of Planning and Development")),
+    ])
+
+
+def _period(year, quarter):
+    return f"{year} - {quarter}" if quarter and quarter != "Annual" else f"{year}"
+
+
+def compact_ministry_score_section(doc, data):
+    header = _ministry_header(doc)
+    if not data:
+        text = f"{header}\nNo ministry performance data found."
+        return text, text
+
+    score_card = data.get("ministry_score_card", {})
+    overview = "\n".join([
+        f"Overview: {data.get('responsible_ministry_eng', 'Unknown Ministry')} ({data.get('code', 'N/A')})",
+        f"Reporting Period: {_period(score_card.get('year', 'N/A'), score_card.get('quarter', 'Annual'))}",
+        f"Overall Ministry Score: {score_card.get('score', 'N/A')} (color {score_card.get('score_color', '#000000')})",
+        f"Total Indicators Tracked: {data.get('number_of_indicators', 0)}",
+    ])
+
+    areas = [
+        f"{a.get('policy_area_eng', 'N/A')}: {a.get('score', 'N/A')}" + (f" ({a['score_color']})" if a.get("score_color") else "")
+        for a in data.get("policy_areas", [])
+    ]
+    full = f"{header}\n{doc.page_content}\n{overview}"
+    if areas:
+        full += "\nPolicy Areas (name: score (color)):\n" + "\n".join(areas)
+    return full, f"{header}\n{overview}"
+
+
+def compact_ministry_performance_section(doc, data):
+    header = _ministry_header(doc)
+    if not data or not data.get("kpis"):
+        text = f"{header}\nNo specific indicator performance data found for the selected criteria."
+        return text, text
+
+    kpis = data["kpis"]
+    first_kpi = kpis[0]
+    overview = "\n".join([
+        f"Indicator Performance List: {data.get('responsible_ministry_eng', 'Unknown Ministry')} ({data.get('code', 'N/A')})",
+        f"Reporting Period: {_period(first_kpi.get('year', 'N/A'), first_kpi.get('quarter', 'Annual'))}",
+        f"Total Indicators in this Category: {len(kpis)}",
+    ])
+    rows = [
+        f"{k.get('indicator_name', 'Unknown Indicator')}: {k.get('score', 'N/A')}% ({k.get('scorecard', '#000000')})"
+        for k in kpis
+    ]
+    full = f"{header}\n{doc.page_content}\n{overview}\nIndicators (name: score (color)):\n" + "\n".join(rows)
+    return full, f"{header}\n{overview}"
+
+
+def truncate_to_tokens(text, budget):
+    """Cut text at a line boundary so it fits in roughly `budget` tokens."""
+    kept, used = [], 0
+    for line in text.split("\n"):
+        cost = count_tokens(line) + 1
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    return "\n".join(kept)
+
+
+def fit_to_budget(sections, budget):
+    """
+    sections: [(full, summary)] in retrieval rank order (best first).
+    Degrades the lowest-ranked sections first: full -> summary -> dropped,
+    and truncates the top section only if it alone exceeds the budget.
+    """
+    return _fit_to_budget(sections, budget)[0]
+
+
+def _fit_to_budget(sections, budget):
+    """fit_to_budget plus the token counts of all full sections and of the chosen ones."""
+    chosen = [full for full, _ in sections]
+    costs = [count_tokens(text) for text in chosen]
+    full_tokens = sum(costs)
+
+    if budget is None or full_tokens <= budget:
+        return chosen, full_tokens, full_tokens
+
+    for i in reversed(range(len(sections))):
+        if sum(costs) <= budget:
+            break
+        chosen[i] = sections[i][1]
+        costs[i] = count_tokens(chosen[i])
+
+    while len(chosen) > 1 and sum(costs) > budget:
+        chosen.pop()
+        costs.pop()
+
+    if sum(costs) > budget:
+        chosen[0] = truncate_to_tokens(chosen[0], budget)
+        costs[0] = count_tokens(chosen[0])
+
+    return chosen, full_tokens, sum(costs)
+
+
+def _render(intent, html_sections, compact_sections):
+    if context_format() == HTML:
+        return "\n<hr/>\n".join(html_sections())
+
+    sections = compact_sections()
+    chosen, full_tokens, tokens = _fit_to_budget(sections, token_budget(intent))
+    context = "\n---\n".join(chosen)
+
+    # Counted while fitting the budget, so this costs nothing extra.
+    logger.info(
+        "Context %s: %s tokens (%s saved by the budget, %s/%s docs)",
+        intent, tokens, full_tokens - tokens, len(chosen), len(sections),
+    )
+    # Rendering and tokenizing the HTML too doubles the work; only for debugging.
+    if logger.isEnabledFor(logging.DEBUG):
+        html_tokens = count_tokens("\n<hr/>\n".join(html_sections()))
+        logger.debug("Context %s: %s tokens saved vs HTML", intent, html_tokens - tokens)
+    return context
+
+
+# ==========================
+# Entry points
+# ==========================
+
+def build_time_series_context(docs, responses, year_requested):
+    """responses: upstream payloads aligned with docs."""
+    return _render(
+        INTENTS["TIME_SERIES"],
+        lambda: [html_indicator_section(d, r, year_requested) for d, r in zip(docs, responses)],
+        lambda: [compact_indicator_section(d, r, year_requested) for d, r in zip(docs, responses)],
+    )
+
+
+def build_ministry_score_context(docs, responses):
+    return _render(
+        INTENTS["MINISTRY_SCORE"],
+        lambda: [html_ministry_section(d, format_ministry_score(r)) for d, r in zip(docs, responses)],
+        lambda: [compact_ministry_score_section(d, r) for d, r in zip(docs, responses)],
+    )
+
+
+def build_ministry_performance_context(docs, responses):
+    return _render(
+        INTENTS["MINISTRY_PERFORMANCE"],
+        lambda: [html_ministry_section(d, format_ministry_performance(r)) for d, r in zip(docs, responses)],
+        lambda: [compact_ministry_performance_section(d, r) for d, r in zip(docs, responses)],
+    )
@@ -0,0 +1,245 @@
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from langchain_core.documents import Document
+from AI.cache import ingestion_generation
+from AI.intents import INTENTS
+from AI.ingestion import join_chunks
+
+ENTITY_INDEX_CHECK_SECONDS = int(os.getenv("ENTITY_INDEX_CHECK_SECONDS", "30"))
+ENTITY_INDEX_MAX_DOCS = int(os.getenv("ENTITY_INDEX_MAX_DOCS", "4"))
+
+# Metadata field holding a name or code -> the field that identifies the entity.
+# Names are matched case-insensitively, codes (MoH, indicator codes) exactly.
+NAME_FIELDS = {
+    "indicator_eng": "indicator_code",
+    "responsible_ministry_eng": "responsible_ministry_id",
+}
+CODE_FIELDS = {
+    "indicator_code": "indicator_code",
+    "responsible_ministry_code": "responsible_ministry_id",
+}
+MINISTRY_INTENTS = {INTENTS["MINISTRY_SCORE"], INTENTS["MINISTRY_PERFORMANCE"]}
+
+# Metadata the context renderers show for a resolved document.
+DOCUMENT_FIELDS = [
+    "indicator_code", "indicator_eng", "topic_name", "category_name", "source", "characteristics", "parent",
+    "annual_measurement_unit", "quarter_measurement_unit", "month_measurement_unit",
+    "responsible_ministry_id", "responsible_ministry_eng", "responsible_ministry_code",
+]
+# Everything load() reads: the dense and sparse vectors are left in Milvus.
+ENTITY_INDEX_FIELDS = list(dict.fromkeys([
+    "pk", "text", "parent_id", "chunk_index",
+    *NAME_FIELDS, *NAME_FIELDS.values(), *CODE_FIELDS, *CODE_FIELDS.values(),
+    *DOCUMENT_FIELDS,
+]))
+
+
+def normalise(text):
+    return re.sub(r"\s+", " ", text or "").strip().lower()
+
+
+def merge_chunks(rows):
+    """One row per item: chunks sharing a parent_id are joined back in order (see join_chunks)."""
+    parents = {}
+    for row in rows:
+        parents.setdefault(row.get("parent_id") or id(row), []).append(row)
+
+    for chunks in parents.values():
+        chunks.sort(key=lambda row: row.get("chunk_index", 0))
+        row = dict(chunks[0])
+        if len(chunks) > 1:
+            row["text"] = join_chunks((chunk.get("chunk_index", 0), chunk.get("text", "")) for chunk in chunks)
+        yield row
+
+
+class Automaton:
+    """Aho-Corasick matcher: every pattern occurrence in one pass over the text."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [[]]
+
+    def add(self, pattern, value):
+        node = 0
+        for char in pattern:
+            if char not in self.goto[node]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.out.append([])
+                self.goto[node][char] = len(self.goto) - 1
+            node = self.goto[node][char]
+        self.out[node].append((len(pattern), value))
+
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                state = self.fail[node]
+                while state and char not in self.goto[state]:
+                    state = self.fail[state]
+                self.fail[child] = self.goto[state].get(char, 0)
+                self.out[child] = self.out[child] + self.out[self.fail[child]]
+
+    def find(self, text):
+        """(start, end, value) for every whole-word occurrence, longest non-overlapping first."""
+        hits = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, value in self.out[node]:
+                start, end = i - length + 1, i + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (end == len(text) or not text[end].isalnum()):
+                    hits.append((start, end, value))
+
+        hits.sort(key=lambda hit: (hit[0], hit[0] - hit[1]))
+        selected, covered = [], 0
+        for start, end, value in hits:
+            if start >= covered:
+                selected.append((start, end, value))
+                covered = end
+        return selected
+
+
+class EntityMatches:
+    """Entities named in one question, and the documents they resolve to."""
+
+    def __init__(self, entities, documents):
+        self.entities = entities
+        self._documents = documents
+
+    def __bool__(self):
+        return bool(self.entities)
+
+    def filters(self):
+        """Scalar filters for a search restricted to the named entities."""
+        filters = {}
+        for field, value in self.entities:
+            filters.setdefault(field, []).append(value)
+        return filters
+
+    def documents(self, intent):
+        """
+        Documents to use instead of a vector search, or [] when a search is
+        still needed. Named indicators always resolve; a named ministry only
+        does for ministry intents, since a question like "MoH immunisation
+        coverage" is about one of its indicators.
+        """
+        indicators = [e for e in self.entities if e[0] == "indicator_code"]
+        ministries = [e for e in self.entities if e[0] == "responsible_ministry_id"]
+        entities = indicators or (ministries if intent in MINISTRY_INTENTS else [])
+
+        docs = [self._documents[entity] for entity in entities if entity in self._documents]
+        return docs[:ENTITY_INDEX_MAX_DOCS]
+
+
+class EntityIndex:
+    """
+    Exact ministry and indicator lookup built from the metadata stored with the
+    documents in Milvus, so questions that name an entity skip vector search.
+
+    The index is rebuilt in the background when ingestion bumps the shared
+    ingestion generation (checked at most every ENTITY_INDEX_CHECK_SECONDS);
+    until the first build finishes, match() finds nothing.
+    """
+
+    def __init__(self):
+        self.names = None
+        self.codes = None
+        self.documents = {}
+        self.generation = None
+        self._checked_at = None
+        self._task = None
+
+    def build(self, rows):
+        names, codes, documents = Automaton(), Automaton(), {}
+        added = set()
+
+        for row in merge_chunks(rows):
+            text = row.pop("text", "")
+            row.pop("vector", None)
+            row.pop("sparse", None)
+            doc = Document(page_content=text, metadata=row)
+
+            for source, automaton in ((NAME_FIELDS, names), (CODE_FIELDS, codes)):
+                for field, entity_field in source.items():
+                    pattern, entity_id = row.get(field), row.get(entity_field)
+                    if not pattern or entity_id in (None, ""):
+                        continue
+                    entity = (entity_field, entity_id)
+                    documents.setdefault(entity, doc)
+                    pattern = normalise(pattern) if source is NAME_FIELDS else str(pattern)
+                    if (automaton is names, pattern, entity) not in added:
+                        added.add((automaton is names, pattern, entity))
+                        automaton.add(pattern, entity)
+
+        names.build()
+        codes.build()
+        self.names, self.codes, self.documents = names, codes, documents
+
+    def load(self):
+        from AI.vectorstore import get_milvus_client, COLLECTION_NAME
+
+        iterator = get_milvus_client().query_iterator(
+            collection_name=COLLECTION_NAME,
+            batch_size=1000,
+            filter="",
+            output_fields=ENTITY_INDEX_FIELDS,
+        )
+        rows = []
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    break
+                rows.extend(batch)
+        finally:
+            iterator.close()
+
+        started = time.perf_counter()
+        self.build(rows)
+        print(
+            f"📇 Entity index built: {len(self.documents)} entities from {len(rows)} documents "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def match(self, question):
+        if self.names is None:
+            return EntityMatches([], {})
+
+        found = [value for _, _, value in self.names.find(normalise(question))]
+        found += [value for _, _, value in self.codes.find(question)]
+        return EntityMatches(list(dict.fromkeys(found)), self.documents)
+
+    def refresh_if_stale(self):
+        """Schedule a background rebuild if the index is missing or ingestion changed the data."""
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < ENTITY_INDEX_CHECK_SECONDS:
+            return
+        self._checked_at = now
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._refresh())
+
+    async def _refresh(self):
+        generation = await ingestion_generation()
+        if generation is None:
+            generation = self.generation
+
+        if self.names is not None and generation == self.generation:
+            return
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.load)
+            self.generation = generation
+        except Exception as e:
+            print(f"⚠️ Entity index build failed: {e}")
+
+
+entity_index = EntityIndex()
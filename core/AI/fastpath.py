@@ -0,0 +1,172 @@
+import re
+from AI.intents import INTENTS
+
+# Same normalisation as DPMES_EXTRACTION_YEAR_QUARTER_PROMPT.
+PERIOD_PATTERNS = [
+    (r"\b(3[\s-]?months?|1st quarter|first quarter|q1)\b", "3month"),
+    (r"\b(6[\s-]?months?|half[\s-]year|2nd quarter|second quarter|q2)\b", "6month"),
+    (r"\b(9[\s-]?months?|3rd quarter|third quarter|q3)\b", "9month"),
+    (r"\b(annual|annually|full[\s-]year|12[\s-]?months?|4th quarter|fourth quarter|q4)\b", "12month"),
+]
+
+# Same synonyms as DPMES_PERFORMANCE_STATUS_EXTRACTOR.
+PERFORMANCE_SYNONYMS = {
+    "on_track": ["on track", "on-track", "good", "success", "successful", "achieved", "excellent", "best", "meeting targets", "meeting their targets"],
+    "in_progress": ["in progress", "average", "satisfactory", "moving", "developing", "mid-range", "moderate"],
+    "weak_performance": ["weak", "bad", "poor", "poorly", "critical", "failing", "behind", "low score", "low scores", "lagging"],
+    "no_data": ["no data", "missing", "not reported", "unreported", "blank", "unsubmitted"],
+}
+
+# The subset that only ever names a KPI status. The rest ("good", "best",
+# "behind", "moving", ...) also appear in score and general questions, so the
+# fast path leaves questions containing them to the router.
+UNAMBIGUOUS_PERFORMANCE_SYNONYMS = {
+    "on_track": ["on track", "on-track", "achieved", "meeting targets", "meeting their targets"],
+    "in_progress": ["in progress"],
+    "weak_performance": ["weak", "poor", "poorly", "failing", "lagging"],
+    "no_data": ["no data", "missing", "not reported", "unreported", "unsubmitted"],
+}
+AMBIGUOUS_PERFORMANCE_WORDS = [
+    word
+    for key, words in PERFORMANCE_SYNONYMS.items()
+    for word in words
+    if word not in UNAMBIGUOUS_PERFORMANCE_SYNONYMS[key]
+]
+
+MINISTRY_PATTERNS = [
+    r"\bministry of [a-z]",
+    r"\bministries\b",
+    r"\bministry\b",
+]
+# Ministry acronyms are matched case-sensitively: MoH, MoA, MoPD, MoF, MoTRI ...
+MINISTRY_CODE_PATTERN = r"\bMo[A-Z][A-Za-z]{0,5}\b"
+
+INDICATOR_KEYWORDS = [
+    "gdp", "gross domestic product", "inflation", "cpi", "consumer price",
+    "export", "exports", "import", "imports", "unemployment", "employment",
+    "exchange rate", "interest rate", "revenue", "tax", "remittance",
+    "foreign direct investment", "fdi", "population", "poverty", "literacy",
+    "enrollment", "enrolment", "mortality", "life expectancy", "electricity",
+    "production", "growth rate", "debt", "budget deficit", "reserves",
+]
+
+KPI_LIST_WORDS = ["kpi", "kpis", "indicators", "list of", "which indicators", "which goals"]
+SCORE_WORDS = ["score", "scores", "rank", "ranking", "rating", "performance", "performing", "doing", "status", "evaluation"]
+POLICY_AREA_WORDS = ["sector", "policy area", "policy areas"]
+GOAL_WORDS = ["goal", "goals", "ten year", "10 year", "development plan", "national target", "national targets"]
+GREETINGS = ["hi", "hello", "hey", "good morning", "good afternoon", "good evening", "thanks", "thank you"]
+
+
+def _has_any(text, phrases):
+    return any(re.search(rf"\b{re.escape(p)}\b", text) for p in phrases)
+
+
+def extract_year(question):
+    match = re.search(r"\b(19|20)\d{2}\b", question)
+    return match.group() if match else None
+
+
+def extract_period(text):
+    periods = {period for pattern, period in PERIOD_PATTERNS if re.search(pattern, text)}
+    if len(periods) == 1:
+        return periods.pop()
+    return None
+
+
+def extract_performance(text, synonyms=PERFORMANCE_SYNONYMS):
+    matches = [key for key, words in synonyms.items() if _has_any(text, words)]
+    if len(matches) == 1:
+        return matches[0]
+    return None
+
+
+def mentions_ministry(question):
+    text = question.lower()
+    return (
+        any(re.search(p, text) for p in MINISTRY_PATTERNS)
+        or re.search(MINISTRY_CODE_PATTERN, question) is not None
+    )
+
+
+def fast_route(question):
+    """
+    Deterministic router for questions whose intent is obvious from keywords.
+
+    Returns the same dict as classifier.aroute_question, or None when the
+    rules are not confident and the LLM router should decide.
+    """
+    text = question.lower().strip()
+    if not text:
+        return None
+
+    route = {
+        "intent": None,
+        "year": extract_year(question),
+        "quarter": extract_period(text),
+        "performance_type": None,
+    }
+
+    if text.rstrip("!.? ") in GREETINGS:
+        route["intent"] = INTENTS["UNKNOWN"]
+        return route
+
+    ministry = mentions_ministry(question)
+    indicator = _has_any(text, INDICATOR_KEYWORDS)
+    policy_area = _has_any(text, POLICY_AREA_WORDS)
+    goal = _has_any(text, GOAL_WORDS)
+    performance = extract_performance(text, UNAMBIGUOUS_PERFORMANCE_SYNONYMS)
+    # "How good is the MoH score?" or "Is MoH behind schedule?" could be
+    # either ministry intent; only the router can tell.
+    if _has_any(text, AMBIGUOUS_PERFORMANCE_WORDS):
+        return None
+
+    if ministry:
+        # KPI performance only on explicit KPI / list phrasing.
+        if _has_any(text, KPI_LIST_WORDS):
+            route["intent"] = INTENTS["MINISTRY_PERFORMANCE"]
+            route["performance_type"] = performance
+        elif _has_any(text, SCORE_WORDS) and not (policy_area or goal or indicator or performance):
+            route["intent"] = INTENTS["MINISTRY_SCORE"]
+        else:
+            return None
+        return route
+
+    # Without a ministry, exactly one family of keywords must match.
+    families = [indicator, policy_area, goal]
+    if sum(families) != 1 or performance:
+        return None
+
+    if indicator:
+        route["intent"] = INTENTS["TIME_SERIES"]
+    elif policy_area:
+        route["intent"] = INTENTS["POLICY_AREA_SCORE"]
+    else:
+        route["intent"] = INTENTS["GOAL_SCORE"]
+    return route
+
+
+def route_for_intent(question, intent):
+    """Fill in period and performance type with the rules once the intent is known."""
+    text = question.lower()
+    return {
+        "intent": intent,
+        "year": extract_year(question),
+        "quarter": extract_period(text),
+        "performance_type": extract_performance(text) if intent == INTENTS["MINISTRY_PERFORMANCE"] else None,
+    }
+
+
+def likely_route(question):
+    """
+    Best guess at the route before the router has answered, so upstream data
+    can be fetched while it runs. Unlike fast_route it always returns a route.
+    """
+    route = fast_route(question)
+    if route:
+        return route
+
+    if mentions_ministry(question):
+        if extract_performance(question.lower()):
+            return route_for_intent(question, INTENTS["MINISTRY_PERFORMANCE"])
+        return route_for_intent(question, INTENTS["MINISTRY_SCORE"])
+    return route_for_intent(question, INTENTS["TIME_SERIES"])
@@ -0,0 +1,182 @@
+import os
+import json
+import zlib
+import base64
+import asyncio
+from urllib.parse import parse_qs
+from channels.db import database_sync_to_async
+
+HISTORY_FLUSH_INTERVAL = float(os.getenv("HISTORY_FLUSH_INTERVAL", "0.2"))
+HISTORY_FLUSH_BATCH = int(os.getenv("HISTORY_FLUSH_BATCH", "200"))
+HISTORY_MAX_ATTEMPTS = 5
+# Turns each websocket connection keeps in memory; must cover utils.history_window
+# (up to 2 * max_turns - 1 turns).
+HISTORY_RING_SIZE = int(os.getenv("HISTORY_RING_SIZE", "6"))
+# History replay: turns per page, largest page a client may ask for, and the
+# size above which a compressed page is actually compressed.
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+HISTORY_PAGE_MAX = int(os.getenv("HISTORY_PAGE_MAX", "100"))
+HISTORY_COMPRESS_MIN_BYTES = int(os.getenv("HISTORY_COMPRESS_MIN_BYTES", "1024"))
+
+
+def history_compression(scope):
+    """Whether the client asked for compressed history pages (ws/chat-web/12/?compress=zlib)."""
+    params = parse_qs(scope.get("query_string", b"").decode())
+    return params.get("compress", [""])[0] == "zlib"
+
+
+def page_limit(value):
+    try:
+        return min(max(1, int(value)), HISTORY_PAGE_MAX)
+    except (TypeError, ValueError):
+        return HISTORY_PAGE_SIZE
+
+
+def history_frame(turns, cursor, has_more, compress=False):
+    """
+    One page of chat history, oldest turn first. `cursor` is the id to send
+    back as "before" to get the previous page. With compress, `turns` is the
+    JSON list deflated with zlib and base64-encoded, flagged by "encoding".
+    """
+    frame = {"type": "history", "cursor": cursor, "has_more": has_more, "turns": turns}
+
+    if compress:
+        payload = json.dumps(turns, separators=(",", ":")).encode("utf-8")
+        if len(payload) >= HISTORY_COMPRESS_MIN_BYTES:
+            frame["encoding"] = "zlib+base64"
+            frame["turns"] = base64.b64encode(zlib.compress(payload)).decode("ascii")
+    return json.dumps(frame)
+
+
+class PendingTurn:
+    """One question/response pair on its way to the QuestionHistory table."""
+
+    __slots__ = ("instance_id", "question", "response", "pk", "response_dirty", "attempts")
+
+    def __init__(self, instance_id, question):
+        self.instance_id = instance_id
+        self.question = question
+        self.response = None
+        self.pk = None
+        self.response_dirty = False
+        self.attempts = 0
+
+
+class HistoryWriter:
+    """
+    Write-behind queue for chat history.
+
+    Consumers hand over turns and return to streaming immediately; a
+    background task flushes them every HISTORY_FLUSH_INTERVAL seconds: new
+    turns with one bulk INSERT, answers with one bulk UPDATE of only the
+    response column by primary key (never "the latest row", which races when
+    messages overlap). A turn whose answer arrives before its first flush is
+    inserted with the answer in a single statement.
+    """
+
+    def __init__(self, flush_interval=HISTORY_FLUSH_INTERVAL, batch_size=HISTORY_FLUSH_BATCH):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self._queue = []
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def add_question(self, instance_id, question):
+        turn = PendingTurn(instance_id, question)
+        self._queue.append(turn)
+        self._schedule()
+        return turn
+
+    def set_response(self, turn, response):
+        turn.response = response
+        turn.response_dirty = True
+        if turn not in self._queue:
+            self._queue.append(turn)
+        self._schedule()
+
+    def pending(self, instance_id):
+        """Turns for this chat that may not be visible in the database yet."""
+        return [turn for turn in self._queue if turn.instance_id == instance_id]
+
+    def _schedule(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self):
+        while self._queue:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            batch = self._queue[:self.batch_size]
+            if not batch:
+                return
+
+            failed = set()
+            try:
+                await self._write(batch)
+            except Exception as e:
+                # One bad row fails the whole statement; find it instead of
+                # holding back (and eventually dropping) everyone's turns.
+                print(f"⚠️ Chat history flush failed ({len(batch)} turns), writing one at a time: {e}")
+                failed = await self._write_each(batch)
+
+            dropped = {turn for turn in failed if turn.attempts >= HISTORY_MAX_ATTEMPTS}
+            if dropped:
+                print(f"❌ Dropping {len(dropped)} chat history turns after {HISTORY_MAX_ATTEMPTS} attempts")
+
+            done = {turn for turn in batch if turn not in failed}
+            self._queue = [
+                turn for turn in self._queue
+                if turn not in dropped and (turn not in done or turn.response_dirty)
+            ]
+
+    async def _write_each(self, batch):
+        failed = set()
+        for turn in batch:
+            try:
+                await self._write([turn])
+            except Exception as e:
+                turn.attempts += 1
+                failed.add(turn)
+                print(f"⚠️ Chat history turn for chat {turn.instance_id} failed (attempt {turn.attempts}): {e}")
+        return failed
+
+    @database_sync_to_async
+    def _write(self, batch):
+        from .models import QuestionHistory
+
+        max_question = QuestionHistory._meta.get_field("question").max_length
+
+        # Responses can be set from the event loop while this runs in the DB
+        # thread, so a turn is only marked clean if what we wrote is still current.
+        new_turns = [turn for turn in batch if turn.pk is None]
+        if new_turns:
+            sent = [turn.response for turn in new_turns]
+            created = QuestionHistory.objects.bulk_create([
+                QuestionHistory(
+                    instance_id=turn.instance_id,
+                    question=turn.question[:max_question],
+                    response=response,
+                )
+                for turn, response in zip(new_turns, sent)
+            ])
+            for turn, row, response in zip(new_turns, created, sent):
+                turn.pk = row.pk
+                if turn.response is response:
+                    turn.response_dirty = False
+
+        answered = [turn for turn in batch if turn.pk is not None and turn.response_dirty]
+        if answered:
+            sent = [turn.response for turn in answered]
+            QuestionHistory.objects.bulk_update(
+                [QuestionHistory(pk=turn.pk, response=response) for turn, response in zip(answered, sent)],
+                ["response"],
+            )
+            for turn, response in zip(answered, sent):
+                if turn.response is response:
+                    turn.response_dirty = False
+
+
+history_writer = HistoryWriter()
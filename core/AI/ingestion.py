@@ -0,0 +1,433 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import count, islice
+
+INGEST_EMBED_BATCH = int(os.getenv("INGEST_EMBED_BATCH", "64"))
+INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", "4"))
+INGEST_MAX_ATTEMPTS = int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+INGEST_RETRY_BACKOFF = float(os.getenv("INGEST_RETRY_BACKOFF", "1.0"))
+INGEST_READ_SIZE = int(os.getenv("INGEST_READ_SIZE", str(64 * 1024)))
+# Metadata fields that identify an item across uploads of the same file.
+INGEST_IDENTITY_FIELDS = [
+    field.strip()
+    for field in os.getenv("INGEST_IDENTITY_FIELDS", "indicator_code,responsible_ministry_id").split(",")
+    if field.strip()
+]
+
+# Items longer than CHUNK_SIZE characters are embedded as chunks that repeat
+# up to CHUNK_OVERLAP characters of the previous one.
+CHUNK_SIZE = 800
+CHUNK_OVERLAP = 160
+# Items longer than the splitter's chunk size are split on a process pool;
+# 0 splits in-process.
+INGEST_CHUNK_WORKERS = int(os.getenv("INGEST_CHUNK_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+PK_NAMESPACE = uuid.UUID("6f1c7a52-3d4e-5b8a-9c0d-2e4f6a8b1c3d")
+
+_decoder = json.JSONDecoder()
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_json_array(file, read_size=INGEST_READ_SIZE):
+    """
+    Yield the items of a top-level JSON array one at a time, reading `file`
+    (opened in text mode) in read_size pieces. Memory is bounded by the
+    largest single item rather than the file size.
+    """
+    buffer, pos, eof = "", 0, False
+
+    def fill(size=read_size):
+        nonlocal buffer, pos, eof
+        chunk = file.read(size)
+        if not chunk:
+            eof = True
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def skip():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos < len(buffer) or eof:
+                return
+            fill()
+
+    def peek():
+        skip()
+        if pos >= len(buffer):
+            raise ValueError("Unterminated JSON array")
+        return buffer[pos]
+
+    skip()
+    if buffer[pos:pos + 1] != "[":
+        raise ValueError("Expected a JSON array at the top level")
+    pos += 1
+    skip()
+    if buffer[pos:pos + 1] == "]":
+        return
+
+    while True:
+        if peek() in ",]":
+            raise ValueError("Expected a value in the JSON array")
+
+        # Double the read while one item spans several pieces, so a large
+        # item is re-decoded O(log n) times rather than once per piece.
+        size = read_size
+        while True:
+            try:
+                item, end = _decoder.raw_decode(buffer, pos)
+                # A number at the very end of the buffer may be cut short.
+                if end < len(buffer) or eof:
+                    break
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill(size)
+            size *= 2
+
+        pos = end
+        yield item
+
+        # Exactly one comma between items.
+        separator = peek()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or ']' after a JSON array item, got {separator!r}")
+        pos += 1
+
+
+class IngestionFailed(Exception):
+    """A file could not be ingested. retryable is False when running it again cannot help."""
+
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def content_hash(doc):
+    payload = json.dumps([doc.page_content, doc.metadata], sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def document_identity(doc, fields=None):
+    """
+    Stable identity of an item: its identity fields when it has them, its
+    content otherwise (so an edited item without them is a delete + insert).
+    """
+    fields = INGEST_IDENTITY_FIELDS if fields is None else fields
+    values = [doc.metadata.get(field) for field in fields]
+    if any(value not in (None, "") for value in values):
+        return json.dumps(values, default=str)
+    return content_hash(doc)
+
+
+class Reingestion:
+    """
+    Incremental ingestion of one source file. Primary keys are uuid5s of the
+    source and each item's identity, so uploading the file again addresses the
+    same rows. `existing` maps those item pks to (content hash, stored row pks):
+    an item split into chunks is stored as several rows sharing its parent_id.
+    A hash of None (see stored_rows) makes the item be written again.
+    """
+
+    def __init__(self, source, existing):
+        self.source = source
+        self.existing = existing
+        self.seen = set()
+        self.skipped = 0
+        self.rewritten = set()
+        self.written = set()
+        self._occurrences = {}
+
+    def pk(self, doc):
+        identity = document_identity(doc)
+        # Repeated identities within a file are told apart by their order.
+        occurrence = self._occurrences.get(identity, 0)
+        self._occurrences[identity] = occurrence + 1
+        return str(uuid.uuid5(PK_NAMESPACE, f"{self.source}|{identity}|{occurrence}"))
+
+    def changed(self, documents):
+        """(pk, document) for every new or changed item; unchanged ones are skipped."""
+        for doc in documents:
+            pk = self.pk(doc)
+            self.seen.add(pk)
+            digest = content_hash(doc)
+            if self.existing.get(pk, (None,))[0] == digest:
+                self.skipped += 1
+                continue
+            if pk in self.existing:
+                self.rewritten.add(pk)
+            # ingest_source, not source: the export's own source field is
+            # shown to the LLM as where the figures come from.
+            doc.metadata = {**doc.metadata, "ingest_source": self.source, "content_hash": digest, "parent_id": pk}
+            yield pk, doc
+
+    def track(self, rows):
+        """Pass rows through, remembering those of items stored before (see removed())."""
+        for pk, doc in rows:
+            if doc.metadata.get("parent_id") in self.existing:
+                self.written.add(pk)
+            yield pk, doc
+
+    def removed(self):
+        """
+        Stored rows of items no longer in the file, and rows of changed items
+        that this run did not overwrite (e.g. now split into fewer chunks).
+        """
+        stale = []
+        for parent, (_, rows) in self.existing.items():
+            if parent not in self.seen:
+                stale.extend(rows)
+            elif parent in self.rewritten:
+                stale.extend(row for row in rows if row not in self.written)
+        return stale
+
+class IngestionReport:
+    def __init__(self):
+        self.documents = 0
+        self.inserted = 0
+        self.skipped = 0
+        self.deleted = 0
+        self.failed_ids = []
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def docs_per_second(self):
+        return self.inserted / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.inserted}/{self.documents} documents in {self.seconds:.1f}s "
+            f"({self.docs_per_second:.1f} docs/s), {self.skipped} unchanged skipped, "
+            f"{self.deleted} deleted, {len(self.failed_ids)} failed"
+        )
+
+
+async def retry(label, func, attempts=None, backoff=None):
+    """Await func() up to `attempts` times with exponential backoff."""
+    attempts = attempts or INGEST_MAX_ATTEMPTS
+    backoff = INGEST_RETRY_BACKOFF if backoff is None else backoff
+    for attempt in range(1, attempts + 1):
+        try:
+            return await func()
+        except Exception as e:
+            if attempt == attempts:
+                raise
+            delay = backoff * 2 ** (attempt - 1)
+            print(f"⚠️ {label} failed (attempt {attempt}/{attempts}), retrying in {delay:.1f}s: {e}")
+            await asyncio.sleep(delay)
+
+
+def milvus_upsert(client, collection_name):
+    """
+    Upsert precomputed embeddings in the layout the langchain Milvus store
+    uses (pk, text, vector, metadata as dynamic fields).
+    """
+    def insert(texts, vectors, metadatas, ids):
+        client.upsert(
+            collection_name=collection_name,
+            data=[
+                {**metadata, "pk": pk, "text": text, "vector": vector}
+                for pk, text, vector, metadata in zip(ids, texts, vectors, metadatas)
+            ],
+        )
+    return insert
+
+
+def join_chunks(chunks, max_overlap=CHUNK_OVERLAP):
+    """
+    The text of an item from (chunk_index, text) pieces. Adjacent chunks
+    repeat the end of the previous one, so the longest repeat (up to
+    max_overlap characters, ending at a word boundary) is dropped; pieces
+    with a gap between them are joined with a newline.
+    """
+    joined, last = "", None
+    for index, text in sorted(chunks, key=lambda chunk: chunk[0]):
+        if last is None:
+            joined = text
+        elif index == last + 1:
+            overlap = next(
+                (
+                    size for size in range(min(max_overlap, len(text), len(joined)), 0, -1)
+                    if (size == len(text) or text[size].isspace()) and joined.endswith(text[:size])
+                ),
+                0,
+            )
+            joined += text[overlap:] if overlap else "\n" + text
+        else:
+            joined += "\n" + text
+        last = index
+    return joined
+
+
+def stored_rows(client, collection_name, source):
+    """
+    item pk -> (content_hash, [row pks]) for what is already ingested from
+    `source`. An item missing some of its chunk_count chunks (a batch of them
+    failed) or whose rows disagree on the hash gets hash None, so it is
+    rewritten rather than skipped as unchanged.
+    """
+    iterator = client.query_iterator(
+        collection_name=collection_name,
+        batch_size=1000,
+        filter=f"ingest_source == {json.dumps(source)}",
+        output_fields=["pk", "content_hash", "parent_id", "chunk_count"],
+    )
+    hashes, rows, expected = {}, {}, {}
+    try:
+        while batch := iterator.next():
+            for row in batch:
+                parent = row.get("parent_id") or row["pk"]
+                hashes.setdefault(parent, set()).add(row.get("content_hash"))
+                rows.setdefault(parent, []).append(row["pk"])
+                expected[parent] = max(expected.get(parent, 1), row.get("chunk_count") or 1)
+    finally:
+        iterator.close()
+
+    existing = {}
+    for parent, pks in rows.items():
+        complete = len(hashes[parent]) == 1 and len(set(pks)) >= expected[parent]
+        existing[parent] = (next(iter(hashes[parent])) if complete else None, pks)
+    return existing
+
+
+def chunk_documents(items, split, chunk_size, workers=INGEST_CHUNK_WORKERS, group=INGEST_EMBED_BATCH):
+    """
+    Split (pk, document) items longer than chunk_size into chunk rows with
+    split(text) -> [text]. Chunks keep the parent's metadata plus parent_id,
+    chunk_index and chunk_count, and get pks derived from the parent's. Splitting runs on
+    a process pool a group of items at a time, one group ahead of the rows
+    being yielded; it stays in-process when workers is 0 or this process may
+    not have children (a daemonic Celery prefork worker). Either way the
+    generator blocks, so ingest_documents consumes it on a worker thread.
+    """
+    executor = None
+    if workers > 0 and not multiprocessing.current_process().daemon:
+        executor = get_chunk_executor(workers)
+
+    def submit(group_items):
+        texts = [doc.page_content for _, doc in group_items if len(doc.page_content) > chunk_size]
+        if executor is None:
+            pieces = map(split, texts)
+        else:
+            pieces = executor.map(split, texts, chunksize=max(1, len(texts) // workers))
+        return group_items, pieces
+
+    def rows(group_items, pieces):
+        for pk, doc in group_items:
+            if len(doc.page_content) <= chunk_size:
+                yield pk, doc
+                continue
+            texts = next(pieces)
+            for index, text in enumerate(texts):
+                metadata = {**doc.metadata, "parent_id": pk, "chunk_index": index, "chunk_count": len(texts)}
+                yield str(uuid.uuid5(PK_NAMESPACE, f"{pk}|{index}")), type(doc)(page_content=text, metadata=metadata)
+
+    pending = deque()
+    for group_items in batched(items, group):
+        pending.append(submit(group_items))
+        if len(pending) > 1:
+            yield from rows(*pending.popleft())
+    while pending:
+        yield from rows(*pending.popleft())
+
+
+_chunk_executor = None
+
+
+def get_chunk_executor(workers=INGEST_CHUNK_WORKERS):
+    global _chunk_executor
+    if _chunk_executor is None:
+        _chunk_executor = ProcessPoolExecutor(max_workers=workers)
+    return _chunk_executor
+
+
+def delete_rows(client, collection_name, pks, batch_size=1000):
+    for batch in batched(pks, batch_size):
+        client.delete(collection_name=collection_name, ids=batch)
+
+
+async def ingest_documents(
+    items,
+    embeddings,
+    insert,
+    batch_size=INGEST_EMBED_BATCH,
+    concurrency=INGEST_CONCURRENCY,
+    on_batch=None,
+):
+    """
+    Embed and insert documents in batches.
+
+    `items` is an iterable of (pk, Document) pairs and may be lazy; at most
+    `concurrency` batches are held in memory. Up to `concurrency` batches are
+    in flight at once, each embedded with one request and inserted as soon as
+    its vectors arrive, so inserts of earlier batches overlap embedding of
+    later ones. A batch that still fails after INGEST_MAX_ATTEMPTS is
+    reported in failed_ids and the rest carry on.
+
+    insert(texts, vectors, metadatas, ids) is a blocking call run on a worker
+    thread, and so is pulling the next batch from `items` (reading, parsing
+    and chunking the file). on_batch(report), if given, is awaited after
+    every finished batch.
+    """
+    report = IngestionReport()
+    slots = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def run_batch(batch_no, batch):
+        batch_ids = [doc_id for doc_id, _ in batch]
+        texts = [doc.page_content for _, doc in batch]
+        metadatas = [doc.metadata for _, doc in batch]
+        try:
+            vectors = await retry(
+                f"Embedding batch {batch_no}", lambda: embeddings.aembed_documents(texts)
+            )
+            await retry(
+                f"Insert batch {batch_no}",
+                lambda: loop.run_in_executor(None, insert, texts, vectors, metadatas, batch_ids),
+            )
+            report.inserted += len(batch)
+        except Exception as e:
+            print(f"❌ Batch {batch_no} ({len(batch)} documents) failed: {e}")
+            report.failed_ids.extend(batch_ids)
+        finally:
+            slots.release()
+
+        if on_batch is not None:
+            try:
+                await on_batch(report)
+            except Exception as e:
+                print(f"⚠️ Progress update failed: {e}")
+
+    batches = batched(items, batch_size)
+    tasks = []
+    try:
+        for batch_no in count():
+            batch = await loop.run_in_executor(None, next, batches, None)
+            if batch is None:
+                break
+            await slots.acquire()
+            report.documents += len(batch)
+            tasks = [task for task in tasks if not task.done()]
+            tasks.append(asyncio.create_task(run_batch(batch_no, batch)))
+    finally:
+        # Let batches already in flight finish even if reading the input failed.
+        await asyncio.gather(*tasks)
+
+    report.seconds = time.perf_counter() - report.started
+    return report
@@ -0,0 +1,149 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import logging
+from pathlib import Path
+import numpy as np
+from AI.intents import INTENTS
+
+EXAMPLES_FILE = Path(__file__).resolve().parent / "data" / "intent_examples.json"
+
+INTENT_KNN_K = int(os.getenv("INTENT_KNN_K", "5"))
+INTENT_KNN_THRESHOLD = float(os.getenv("INTENT_KNN_THRESHOLD", "0.8"))
+INTENT_KNN_MIN_SIMILARITY = float(os.getenv("INTENT_KNN_MIN_SIMILARITY", "0.6"))
+INTENT_INDEX_RETRY_SECONDS = 60
+
+logger = logging.getLogger(__name__)
+
+
+def load_examples(path=EXAMPLES_FILE):
+    with open(path, "r", encoding="utf-8") as f:
+        return [row for row in json.load(f) if row.get("intent") in INTENTS]
+
+
+def example_pk(text):
+    return hashlib.sha1(text.strip().lower().encode("utf-8")).hexdigest()
+
+
+def seed_intent_collection(examples=None):
+    """Embed the labelled examples and upsert them into the intent collection."""
+    from AI.providers import get_remote_embeddings
+    from AI.vectorstore import ensure_intent_collection, INTENT_COLLECTION_NAME
+
+    examples = examples if examples is not None else load_examples()
+    client = ensure_intent_collection()
+    if client is None or not examples:
+        return 0
+
+    vectors = get_remote_embeddings().embed_documents([row["text"] for row in examples])
+    client.upsert(
+        collection_name=INTENT_COLLECTION_NAME,
+        data=[
+            {"pk": example_pk(row["text"]), "text": row["text"], "intent": row["intent"], "vector": vector}
+            for row, vector in zip(examples, vectors)
+        ],
+    )
+    return len(examples)
+
+
+class IntentIndex:
+    """
+    k-NN intent classifier over labelled example questions.
+
+    The examples live in the INTENT_COLLECTION_NAME Milvus collection next to the
+    document vectors and are pulled into a normalised numpy matrix once per
+    process, so classifying an already-embedded question is a single
+    matrix-vector product.
+    """
+
+    def __init__(self, k=INTENT_KNN_K, threshold=INTENT_KNN_THRESHOLD, min_similarity=INTENT_KNN_MIN_SIMILARITY):
+        self.k = k
+        self.threshold = threshold
+        self.min_similarity = min_similarity
+        self.matrix = None
+        self.labels = []
+        self._lock = asyncio.Lock()
+        self._last_attempt = None
+
+    def fit(self, vectors, labels):
+        matrix = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        self.matrix = matrix / norms
+        self.labels = list(labels)
+
+    def load(self):
+        # The collection is created by `manage.py build_intent_index`, not on the chat path.
+        from AI.vectorstore import get_milvus_client, INTENT_COLLECTION_NAME
+
+        client = get_milvus_client()
+        if not client.has_collection(collection_name=INTENT_COLLECTION_NAME):
+            logger.warning("Intent collection is missing; run `manage.py build_intent_index`.")
+            return False
+
+        rows = client.query(
+            collection_name=INTENT_COLLECTION_NAME,
+            filter="",
+            output_fields=["intent", "vector"],
+            limit=16384,
+        )
+        if not rows:
+            logger.warning("Intent collection is empty; run `manage.py build_intent_index`.")
+            return False
+
+        self.fit([row["vector"] for row in rows], [row["intent"] for row in rows])
+        return True
+
+    async def aload(self):
+        if self.matrix is not None:
+            return True
+
+        async with self._lock:
+            recently_failed = (
+                self._last_attempt is not None
+                and time.monotonic() - self._last_attempt < INTENT_INDEX_RETRY_SECONDS
+            )
+            if self.matrix is None and not recently_failed:
+                self._last_attempt = time.monotonic()
+                try:
+                    await asyncio.get_running_loop().run_in_executor(None, self.load)
+                except Exception as e:
+                    # Routing falls back to the LLM; retried after INTENT_INDEX_RETRY_SECONDS.
+                    logger.warning("Could not load the intent index: %r", e)
+        return self.matrix is not None
+
+    def classify(self, embedding):
+        """Return (intent, confidence), or (None, 0.0) if the index is not loaded."""
+        if self.matrix is None or not len(self.labels):
+            return None, 0.0
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm:
+            query = query / norm
+
+        scores = self.matrix @ query
+        k = min(self.k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+
+        if scores[top].max() < self.min_similarity:
+            return None, 0.0
+
+        votes = {}
+        for i in top:
+            weight = max(float(scores[i]), 0.0)
+            votes[self.labels[i]] = votes.get(self.labels[i], 0.0) + weight
+
+        intent = max(votes, key=votes.get)
+        total = sum(votes.values())
+        return intent, (votes[intent] / total if total else 0.0)
+
+    def confident_intent(self, embedding):
+        """The k-NN intent if it clears the confidence threshold, else None."""
+        intent, confidence = self.classify(embedding)
+        return intent if intent and confidence >= self.threshold else None
+
+
+intent_index = IntentIndex()
@@ -0,0 +1,89 @@
+import json
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from AI.fastpath import fast_route
+
+BENCHMARKS = Path(__file__).resolve().parents[2] / "benchmarks"
+# routing_questions.json was written alongside the rules; the held-out set was
+# not, and its rows marked "fast": false must be left to the router.
+DEFAULT_FILES = [
+    str(BENCHMARKS / "routing_questions.json"),
+    str(BENCHMARKS / "routing_questions_heldout.json"),
+]
+FIELDS = ("intent", "year", "quarter", "performance_type")
+
+
+class Command(BaseCommand):
+    help = "Report fast-path routing coverage, agreement with labels / the LLM router, and latency saved."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", nargs="+", default=DEFAULT_FILES, help="Labelled questions (JSON lists).")
+        parser.add_argument("--llm", action="store_true", help="Also run the LLM router for comparison.")
+
+    def handle(self, *args, **options):
+        llm = None
+        if options["llm"]:
+            from AI.providers import get_llm_instance
+            llm = get_llm_instance()
+
+        for path in options["file"]:
+            self.stdout.write(f"== {Path(path).name}")
+            self.report(json.loads(Path(path).read_text(encoding="utf-8")), llm)
+
+    def report(self, rows, llm):
+        if llm is not None:
+            from AI.classifier import route_question
+
+        covered = agree_label = agree_llm = llm_correct = 0
+        negatives = false_fires = 0
+        fast_seconds = llm_seconds = saved_seconds = 0.0
+
+        for row in rows:
+            expected = {field: row.get(field) for field in FIELDS}
+
+            started = time.perf_counter()
+            fast = fast_route(row["question"])
+            fast_seconds += time.perf_counter() - started
+
+            llm_route = None
+            if llm is not None:
+                started = time.perf_counter()
+                llm_route = route_question(llm, row["question"])
+                elapsed = time.perf_counter() - started
+                llm_seconds += elapsed
+                llm_correct += llm_route == expected
+                if fast is not None:
+                    saved_seconds += elapsed
+
+            if row.get("fast") is False:
+                negatives += 1
+                if fast is not None:
+                    false_fires += 1
+                    self.stdout.write(f"  should defer to the router: {row['question']!r} -> {fast}")
+
+            if fast is None:
+                continue
+
+            covered += 1
+            agree_label += fast == expected
+            if llm_route is not None:
+                agree_llm += fast == llm_route
+            if fast != expected and row.get("fast") is not False:
+                self.stdout.write(f"  mismatch: {row['question']!r} -> {fast}")
+
+        total = len(rows)
+        self.stdout.write(f"Questions:            {total}")
+        self.stdout.write(f"Fast-path coverage:   {covered}/{total} ({covered / total:.1%})")
+        if covered:
+            self.stdout.write(f"Agreement w/ labels:  {agree_label}/{covered} ({agree_label / covered:.1%})")
+        if negatives:
+            self.stdout.write(f"Negative cases fired: {false_fires}/{negatives}")
+        self.stdout.write(f"Fast-path time:       {fast_seconds / total * 1e6:.1f} µs/question")
+
+        if llm is not None:
+            self.stdout.write(f"LLM accuracy:         {llm_correct}/{total} ({llm_correct / total:.1%})")
+            self.stdout.write(f"LLM router time:      {llm_seconds / total * 1000:.1f} ms/question")
+            if covered:
+                self.stdout.write(f"Agreement w/ LLM:     {agree_llm}/{covered} ({agree_llm / covered:.1%})")
+            self.stdout.write(f"Latency saved:        {saved_seconds:.2f}s total, {saved_seconds / total * 1000:.1f} ms/question")
@@ -0,0 +1,65 @@
+import time
+import asyncio
+from django.core.management.base import BaseCommand
+from langchain_core.documents import Document
+from langchain_openai import OpenAIEmbeddings
+from AI.ingestion import ingest_documents, INGEST_EMBED_BATCH, INGEST_CONCURRENCY
+from AI.management.commands.stub_embedding_server import start_stub_server
+
+
+def synthetic_documents(count):
+    for i in range(count):
+        yield Document(
+            page_content=f"Indicator {i}: annual value of synthetic series {i % 97} reported by ministry {i % 23}. " * 4,
+            metadata={"indicator_code": f"SYN_{i:06d}", "responsible_ministry_id": i % 23},
+        )
+
+
+class Command(BaseCommand):
+    help = "Measure ingestion throughput (docs/s): one embed + insert call vs the batched concurrent pipeline."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--docs", type=int, default=2000)
+        parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH)
+        parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+        parser.add_argument("--embedding-url", help="Embedding server to use instead of the built-in stub.")
+        parser.add_argument("--latency-ms", type=float, default=50, help="Stub: fixed cost per request.")
+        parser.add_argument("--per-item-ms", type=float, default=1, help="Stub: cost per embedded text.")
+        parser.add_argument("--insert-ms-per-doc", type=float, default=0.2, help="Simulated Milvus insert cost.")
+
+    def handle(self, *args, **options):
+        server = None
+        base_url = options["embedding_url"]
+        if not base_url:
+            server, base_url = start_stub_server(
+                latency=options["latency_ms"] / 1000, per_item=options["per_item_ms"] / 1000
+            )
+
+        embeddings = OpenAIEmbeddings(
+            model="BAAI/bge-base-en-v1.5",
+            api_key="empty",
+            base_url=base_url,
+            tiktoken_enabled=False,
+            check_embedding_ctx_length=False,
+        )
+        insert_cost = options["insert_ms_per_doc"] / 1000
+
+        def insert(texts, vectors, metadatas, ids):
+            # Stands in for a Milvus insert so the benchmark needs no collection.
+            time.sleep(insert_cost * len(ids))
+
+        count = options["docs"]
+        runs = [
+            ("single call", count, 1),
+            ("pipeline", options["batch_size"], options["concurrency"]),
+        ]
+        try:
+            for name, batch_size, concurrency in runs:
+                items = ((f"bench-{i}", doc) for i, doc in enumerate(synthetic_documents(count)))
+                report = asyncio.run(
+                    ingest_documents(items, embeddings, insert, batch_size, concurrency)
+                )
+                self.stdout.write(f"{name:>12} (batch {batch_size}, concurrency {concurrency}): {report}")
+        finally:
+            if server is not None:
+                server.shutdown()
@@ -0,0 +1,62 @@
+import json
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from AI.classifier import classify_intent
+from AI.intent_index import IntentIndex
+from AI.providers import get_llm_instance, get_remote_embeddings
+
+DEFAULT_FILE = Path(__file__).resolve().parents[2] / "benchmarks" / "routing_questions.json"
+
+
+class Command(BaseCommand):
+    help = "Compare the k-NN intent classifier against the LLM classify_intent prompt (accuracy and latency)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default=str(DEFAULT_FILE), help="Labelled questions (JSON list).")
+        parser.add_argument("--skip-llm", action="store_true", help="Only evaluate the k-NN classifier.")
+
+    def handle(self, *args, **options):
+        rows = json.loads(Path(options["file"]).read_text(encoding="utf-8"))
+        questions = [row["question"] for row in rows]
+        labels = [row["intent"] for row in rows]
+
+        index = IntentIndex()
+        if not index.load():
+            self.stderr.write("Intent index is empty; run `manage.py build_intent_index` first.")
+            return
+
+        # Embedding is already paid for by retrieval in the chat path, so it is not counted here.
+        embeddings = get_remote_embeddings().embed_documents(questions)
+
+        knn_correct = confident = confident_correct = 0
+        started = time.perf_counter()
+        results = [index.classify(embedding) for embedding in embeddings]
+        knn_seconds = time.perf_counter() - started
+
+        for (intent, confidence), label in zip(results, labels):
+            knn_correct += intent == label
+            if intent and confidence >= index.threshold:
+                confident += 1
+                confident_correct += intent == label
+
+        total = len(rows)
+        self.stdout.write(f"Questions:              {total}")
+        self.stdout.write(f"k-NN accuracy:          {knn_correct}/{total} ({knn_correct / total:.1%})")
+        self.stdout.write(f"k-NN confident:         {confident}/{total} ({confident / total:.1%}), escalated {total - confident}")
+        if confident:
+            self.stdout.write(f"Accuracy when confident: {confident_correct}/{confident} ({confident_correct / confident:.1%})")
+        self.stdout.write(f"k-NN latency:           {knn_seconds / total * 1e6:.1f} µs/question")
+
+        if options["skip_llm"]:
+            return
+
+        llm = get_llm_instance()
+        llm_correct = 0
+        started = time.perf_counter()
+        for question, label in zip(questions, labels):
+            llm_correct += classify_intent(llm, question) == label
+        llm_seconds = time.perf_counter() - started
+
+        self.stdout.write(f"LLM accuracy:           {llm_correct}/{total} ({llm_correct / total:.1%})")
+        self.stdout.write(f"LLM latency:            {llm_seconds / total * 1000:.1f} ms/question")
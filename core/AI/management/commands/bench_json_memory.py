@@ -0,0 +1,88 @@
+import os
+import gc
+import json
+import time
+import asyncio
+import tempfile
+import tracemalloc
+from types import SimpleNamespace
+from django.core.management.base import BaseCommand
+from AI.utils import split_json, iter_json_documents
+from AI.ingestion import ingest_documents, INGEST_EMBED_BATCH, INGEST_CONCURRENCY
+
+
+def write_synthetic_export(path, items, text_size):
+    """Write an indicator-export-shaped JSON array item by item."""
+    filler = "Synthetic indicator description with values by year. " * (text_size // 52 + 1)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("[\n")
+        for i in range(items):
+            if i:
+                f.write(",\n")
+            json.dump({
+                "page_content": f"Indicator SYN_{i:07d}: {filler[:text_size]}",
+                "metadata": {
+                    "indicator_code": f"SYN_{i:07d}",
+                    "indicator_eng": f"Synthetic indicator {i}",
+                    "responsible_ministry_id": i % 23,
+                    "values": {str(year): i * 0.5 + year for year in range(2000, 2025)},
+                },
+            }, f)
+        f.write("\n]")
+
+
+class NullEmbeddings:
+    def __init__(self, dim):
+        self.vector = [0.0] * dim
+
+    async def aembed_documents(self, texts):
+        return [self.vector] * len(texts)
+
+
+class Command(BaseCommand):
+    help = "Compare peak Python memory of json.load ingestion vs the streaming parser on a synthetic large export."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=100_000)
+        parser.add_argument("--text-size", type=int, default=1000, help="Characters of page_content per item.")
+        parser.add_argument("--file", help="Existing JSON export to use instead of a synthetic one.")
+        parser.add_argument("--batch-size", type=int, default=INGEST_EMBED_BATCH)
+        parser.add_argument("--concurrency", type=int, default=INGEST_CONCURRENCY)
+
+    def measure(self, label, func):
+        gc.collect()
+        tracemalloc.start()
+        started = time.perf_counter()
+        result = func()
+        seconds = time.perf_counter() - started
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.stdout.write(f"{label:>10}: peak {peak / 2**20:8.1f} MiB, {seconds:6.2f}s, {result}")
+
+    def handle(self, *args, **options):
+        path = options["file"]
+        cleanup = False
+        if not path:
+            fd, path = tempfile.mkstemp(suffix=".json")
+            os.close(fd)
+            cleanup = True
+            self.stdout.write(f"Writing {options['items']} synthetic items to {path}...")
+            write_synthetic_export(path, options["items"], options["text_size"])
+        self.stdout.write(f"File size: {os.path.getsize(path) / 2**20:.1f} MiB")
+
+        embeddings = NullEmbeddings(768)
+
+        def ingest(documents):
+            return asyncio.run(ingest_documents(
+                ((str(i), doc) for i, doc in enumerate(documents)), embeddings, lambda *args: None,
+                options["batch_size"], options["concurrency"],
+            ))
+
+        try:
+            # Embedding and insert are no-ops, so the peak is what parsing and
+            # holding documents costs.
+            self.measure("json.load", lambda: ingest(split_json(path)))
+            self.measure("streaming", lambda: ingest(iter_json_documents(path)))
+        finally:
+            if cleanup:
+                os.remove(path)
@@ -0,0 +1,143 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from django.core.management.base import BaseCommand
+from langchain_openai import ChatOpenAI
+from AI.rules import SYSTEM_RULES
+from AI.tokens import tokenize
+from AI.utils import build_messages, history_window
+
+# vLLM's prefix cache works on fixed-size KV blocks; only whole blocks are reused.
+BLOCK_SIZE = 16
+
+# Real answers are long HTML with tables and <chart-data>; replayed history is mostly these.
+STUB_ANSWER = "<p>Stub answer.</p><table>" + "<tr><td>2015</td><td>10.2</td></tr>" * 30 + "</table>"
+
+QUESTIONS = [
+    "What is GDP growth in 2015?",
+    "And in 2016?",
+    "How does that compare to inflation?",
+    "Show me the export value trend.",
+    "What about imports in 2016?",
+    "Summarise the trade balance.",
+    "What was the exchange rate in 2016?",
+    "How did remittances change?",
+    "Which of these grew fastest?",
+]
+
+
+def flatten(messages):
+    """Approximate a chat template: what vLLM actually prefills."""
+    return "".join(f"<|{m['role']}|>{m['content']}<|end|>" for m in messages)
+
+
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        n += 1
+    return n
+
+
+class StubState:
+    def __init__(self):
+        self.previous = []
+        self.turns = []
+
+
+def make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            tokens = tokenize(flatten(body["messages"]))
+            reused = common_prefix(tokens, state.previous)
+            state.turns.append({
+                "prompt_tokens": len(tokens),
+                "prefix_tokens": reused,
+                "cached_tokens": reused // BLOCK_SIZE * BLOCK_SIZE,
+            })
+            state.previous = tokens
+
+            chunk = {
+                "id": "stub", "object": "chat.completion.chunk", "model": body.get("model"),
+                "choices": [{"index": 0, "delta": {"role": "assistant", "content": STUB_ANSWER}, "finish_reason": None}],
+            }
+            done = {**chunk, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for payload in (chunk, done):
+                self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.write(b"data: [DONE]\n\n")
+
+    return Handler
+
+
+def legacy_window(history, max_turns):
+    return history[-max_turns:]
+
+
+def legacy_messages(system_rule, conversation_list, context, question):
+    """The pre-change layout: retrieved context between the rules and the history."""
+    return [
+        {"role": "system", "content": system_rule},
+        {"role": "user", "content": f"Context:\n{context}"},
+        *conversation_list,
+        {"role": "user", "content": question},
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare prompt layouts for prefix-cache reuse against a local OpenAI-compatible stub."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-turns", type=int, default=3, help="History turns kept, as in format_history_for_llm.")
+
+    def run_layout(self, window, build, max_turns):
+        state = StubState()
+        server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(state))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        llm = ChatOpenAI(
+            base_url=f"http://127.0.0.1:{server.server_port}/v1",
+            api_key="EMPTY",
+            model="stub",
+            streaming=True,
+        )
+
+        history = []
+        try:
+            for i, question in enumerate(QUESTIONS):
+                context = f"<h3>Indicator Metadata</h3><p>Retrieved context #{i} for {question}</p>" * 20
+                conversation = []
+                for turn in window(history, max_turns):
+                    conversation.append({"role": "user", "content": turn[0]})
+                    conversation.append({"role": "system", "content": turn[1]})
+
+                answer = "".join(chunk.content for chunk in llm.stream(build(SYSTEM_RULES, conversation, context, question)))
+                history.append((question, answer))
+        finally:
+            server.shutdown()
+
+        return state.turns
+
+    def handle(self, *args, **options):
+        layouts = (
+            ("legacy", legacy_window, legacy_messages),
+            ("prefix-first", history_window, build_messages),
+        )
+        for name, window, build in layouts:
+            turns = self.run_layout(window, build, options["max_turns"])
+            prompt_total = sum(t["prompt_tokens"] for t in turns)
+            cached_total = sum(t["cached_tokens"] for t in turns[1:])
+
+            self.stdout.write(f"\n{name}")
+            self.stdout.write("turn  prompt  prefix  cached(blocks)")
+            for i, t in enumerate(turns, 1):
+                self.stdout.write(f"{i:>4}  {t['prompt_tokens']:>6}  {t['prefix_tokens']:>6}  {t['cached_tokens']:>6}")
+            self.stdout.write(f"prefill tokens saved: {cached_total}/{prompt_total} ({cached_total / prompt_total:.1%})")
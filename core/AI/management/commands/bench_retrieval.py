@@ -0,0 +1,87 @@
+import json
+import random
+import time
+from pathlib import Path
+from django.core.management.base import BaseCommand
+from AI.providers import get_remote_embeddings
+from AI.vectorstore import (
+    COLLECTION_NAME,
+    SEARCH_KWARGS,
+    get_milvus_client,
+    hybrid_search,
+    hybrid_supported,
+    mmr_search,
+)
+
+QUESTION_TEMPLATES = [
+    "What is the {indicator_eng}?",
+    "Show me {indicator_eng} for the last five years",
+    "{indicator_code} trend",
+]
+
+
+class Command(BaseCommand):
+    help = "Compare recall@k and search latency of hybrid BM25+dense retrieval against dense MMR."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--file",
+            help="JSON list of {question, indicator_code}. Defaults to questions generated from sampled documents.",
+        )
+        parser.add_argument("--sample", type=int, default=100, help="Documents to sample when no --file is given.")
+        parser.add_argument("--seed", type=int, default=0)
+
+    def sample_questions(self, sample, seed):
+        """Known-item questions: each names one indicator that should come back in the top k."""
+        rows = get_milvus_client().query(
+            collection_name=COLLECTION_NAME,
+            filter='indicator_code != ""',
+            output_fields=["indicator_code", "indicator_eng"],
+            limit=16384,
+        )
+        rows = [row for row in rows if row.get("indicator_code") and row.get("indicator_eng")]
+        rng = random.Random(seed)
+        rows = rng.sample(rows, min(sample, len(rows)))
+        return [
+            {"question": rng.choice(QUESTION_TEMPLATES).format(**row), "indicator_code": row["indicator_code"]}
+            for row in rows
+        ]
+
+    def handle(self, *args, **options):
+        if options["file"]:
+            rows = json.loads(Path(options["file"]).read_text(encoding="utf-8"))
+        else:
+            rows = self.sample_questions(options["sample"], options["seed"])
+
+        if not rows:
+            self.stderr.write("No questions to evaluate.")
+            return
+        if not hybrid_supported():
+            self.stderr.write(f"{COLLECTION_NAME} has no BM25 field; rebuild and re-ingest it first.")
+            return
+
+        # The chat path embeds once and shares it, so embedding is not part of search latency.
+        embeddings = get_remote_embeddings().embed_documents([row["question"] for row in rows])
+        k = SEARCH_KWARGS["k"]
+
+        retrievers = {
+            "mmr": lambda row, embedding: mmr_search(embedding),
+            "hybrid": lambda row, embedding: hybrid_search(embedding, row["question"], k=k),
+        }
+
+        self.stdout.write(f"Questions: {len(rows)}")
+        for name, retrieve in retrievers.items():
+            found = 0
+            latencies = []
+            for row, embedding in zip(rows, embeddings):
+                started = time.perf_counter()
+                docs = retrieve(row, embedding)
+                latencies.append(time.perf_counter() - started)
+                found += any(doc.metadata.get("indicator_code") == row["indicator_code"] for doc in docs[:k])
+
+            latencies.sort()
+            p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+            self.stdout.write(
+                f"{name:>6}: recall@{k} {found}/{len(rows)} ({found / len(rows):.1%}), "
+                f"mean {sum(latencies) / len(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms"
+            )
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import random
+import time
+from django.core.management.base import BaseCommand
+from AI.streaming import StreamCoalescer
+
+
+class FrameCounter:
+    """Stands in for AsyncWebsocketConsumer.send: serialises like daphne would and counts frames."""
+
+    def __init__(self):
+        self.frames = 0
+        self.bytes = 0
+
+    async def send(self, text_data):
+        self.frames += 1
+        self.bytes += len(text_data.encode("utf-8"))
+        await asyncio.sleep(0)
+
+
+async def fake_llm_stream(tokens, tokens_per_second):
+    delay = 1 / tokens_per_second
+    for _ in range(tokens):
+        await asyncio.sleep(delay * random.uniform(0.5, 1.5))
+        yield random.choice(["<p>", " the", " GDP", " grew", " by", " 6.1", "%", " in", " 2015", "</p>", "<td>", "</td>"])
+
+
+async def chat(sink, tokens, tokens_per_second, flush_ms, flush_bytes):
+    if flush_ms == 0:
+        async for chunk in fake_llm_stream(tokens, tokens_per_second):
+            await sink.send(text_data=json.dumps({"message": chunk, "is_stream": True}))
+            await asyncio.sleep(0)
+    else:
+        stream = StreamCoalescer(sink.send, flush_interval=flush_ms / 1000, max_bytes=flush_bytes)
+        async for chunk in fake_llm_stream(tokens, tokens_per_second):
+            await stream.add(chunk)
+        await stream.close()
+
+    await sink.send(text_data=json.dumps({"message": "", "is_stream": False, "is_final": True}))
+
+
+class Command(BaseCommand):
+    help = "Load test websocket stream framing: frames/s and CPU with and without coalescing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chats", type=int, default=300, help="Concurrent chats.")
+        parser.add_argument("--tokens", type=int, default=300, help="Tokens per answer.")
+        parser.add_argument("--tps", type=float, default=60, help="Tokens per second per chat.")
+        parser.add_argument("--flush-ms", type=int, default=30)
+        parser.add_argument("--flush-bytes", type=int, default=512)
+
+    async def run(self, options, flush_ms):
+        sink = FrameCounter()
+        wall, cpu = time.perf_counter(), time.process_time()
+        await asyncio.gather(*[
+            chat(sink, options["tokens"], options["tps"], flush_ms, options["flush_bytes"])
+            for _ in range(options["chats"])
+        ])
+        return sink, time.perf_counter() - wall, time.process_time() - cpu
+
+    def handle(self, *args, **options):
+        for label, flush_ms in (("per-token frames", 0), (f"coalesced ({options['flush_ms']} ms / {options['flush_bytes']} B)", options["flush_ms"])):
+            sink, wall, cpu = asyncio.run(self.run(options, flush_ms))
+            self.stdout.write(label)
+            self.stdout.write(f"  frames:      {sink.frames} ({sink.frames / wall:.0f}/s)")
+            self.stdout.write(f"  bytes:       {sink.bytes}")
+            self.stdout.write(f"  wall / CPU:  {wall:.2f}s / {cpu:.2f}s ({cpu / wall:.0%} of one core)")
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from AI.intent_index import EXAMPLES_FILE, load_examples, seed_intent_collection
+
+
+class Command(BaseCommand):
+    help = "Embed the labelled intent examples and upsert them into the Milvus intent collection."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--file", default=str(EXAMPLES_FILE), help="Labelled examples (JSON list of {text, intent}).")
+
+    def handle(self, *args, **options):
+        count = seed_intent_collection(load_examples(options["file"]))
+        self.stdout.write(f"Indexed {count} intent examples.")
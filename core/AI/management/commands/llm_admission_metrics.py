@@ -0,0 +1,16 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from AI.admission import llm_admission
+
+
+class Command(BaseCommand):
+    help = "Print the LLM admission counters (admitted, rejected, timeouts, wait histogram) shared in Redis."
+
+    def handle(self, *args, **options):
+        metrics = asyncio.run(llm_admission.metrics())
+        if not metrics:
+            self.stdout.write("No LLM admission metrics recorded yet.")
+            return
+        width = max(len(name) for name in metrics)
+        for name in sorted(metrics):
+            self.stdout.write(f"{name:<{width}}  {metrics[name]:g}")
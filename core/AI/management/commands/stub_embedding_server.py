@@ -0,0 +1,74 @@
+import json
+import time
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+from django.core.management.base import BaseCommand
+
+
+def stub_vector(text, dim):
+    """Deterministic unit vector for a text, so repeated runs embed identically."""
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:4], "little")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+def make_handler(dim, latency, per_item):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            inputs = body["input"] if isinstance(body["input"], list) else [body["input"]]
+            time.sleep(latency + per_item * len(inputs))
+
+            payload = json.dumps({
+                "object": "list",
+                "model": body.get("model"),
+                "data": [
+                    {"object": "embedding", "index": i, "embedding": stub_vector(str(text), dim)}
+                    for i, text in enumerate(inputs)
+                ],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            }).encode()
+
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+    return Handler
+
+
+def start_stub_server(port=0, dim=768, latency=0.05, per_item=0.001):
+    """Serve OpenAI-style /v1/embeddings on a background thread; returns (server, base_url)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(dim, latency, per_item))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+class Command(BaseCommand):
+    help = "Run a local OpenAI-compatible embedding server with configurable latency (for ingestion benchmarks)."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--port", type=int, default=4001)
+        parser.add_argument("--dim", type=int, default=768)
+        parser.add_argument("--latency-ms", type=float, default=50, help="Fixed cost per request.")
+        parser.add_argument("--per-item-ms", type=float, default=1, help="Additional cost per embedded text.")
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer(
+            ("127.0.0.1", options["port"]),
+            make_handler(options["dim"], options["latency_ms"] / 1000, options["per_item_ms"] / 1000),
+        )
+        self.stdout.write(
+            f"Stub embeddings on http://127.0.0.1:{options['port']}/v1 "
+            f"(set EMBEDDING_API_BASE to use it). Ctrl-C to stop."
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
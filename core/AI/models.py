@@ -2,9 +2,30 @@ from django.db import models
 from userManagement.models import CustomUser as User
 
 class Document(models.Model):
+    PENDING = 'pending'
+    QUEUED = 'queued'
+    PROCESSING = 'processing'
+    RETRYING = 'retrying'
+    LOADED = 'loaded'
+    FAILED = 'failed'
+    status_choices = [
+        (PENDING, 'Pending'),
+        (QUEUED, 'Queued'),
+        (PROCESSING, 'Processing'),
+        (RETRYING, 'Retrying'),
+        (LOADED, 'Loaded'),
+        (FAILED, 'Failed'),
+    ]
+
     name = models.CharField(null=True, blank=True, max_length=100)
     file = models.FileField(upload_to='documents/')
     is_loaded = models.BooleanField(default=False)
+    status = models.CharField(choices=status_choices, default=PENDING, max_length=20, db_index=True)
+    # Rows (items or their chunks) embedded or failed, plus unchanged items skipped, so far.
+    progress = models.IntegerField(default=0)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+    updated_at = models.DateTimeField(auto_now=True)
 
     def __str__(self):
         return self.name
@@ -17,6 +38,8 @@ class ChatInstance(models.Model):
     user = models.ForeignKey(User, null=True, blank=True ,on_delete=models.SET_NULL)
     title = models.CharField(null=True, blank=True, max_length=100)
     is_deleted = models.BooleanField(default=False)
+    summary = models.TextField(blank=True, default="")
+    summarized_turns = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now=True, auto_now_add=False)
 
     class Meta:
@@ -0,0 +1,70 @@
+import os
+import re
+import time
+import hashlib
+import numpy as np
+from langchain_core.documents import Document
+from AI.cache import TieredCache, ingestion_generation
+
+EMBEDDING_CACHE_TTL = int(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 60 * 60)))
+RETRIEVAL_CACHE_TTL = int(os.getenv("RETRIEVAL_CACHE_TTL", str(24 * 60 * 60)))
+# How long a process trusts its last read of the ingestion generation.
+GENERATION_CHECK_SECONDS = float(os.getenv("RETRIEVAL_GENERATION_CHECK_SECONDS", "5"))
+
+# Layer one: normalised question -> embedding. Only the model changes it, so it
+# survives ingestion. Layer two: embedding + search parameters -> documents,
+# keyed on the ingestion generation so new documents are seen.
+embedding_cache = TieredCache("embeddings", EMBEDDING_CACHE_TTL, maxsize=4096)
+retrieval_cache = TieredCache("retrieval", RETRIEVAL_CACHE_TTL, maxsize=2048)
+
+_generation = None
+_generation_read_at = None
+
+
+def normalise_question(question):
+    return re.sub(r"\s+", " ", question or "").strip().lower()
+
+
+async def current_generation():
+    global _generation, _generation_read_at
+    now = time.monotonic()
+    if _generation_read_at is None or now - _generation_read_at >= GENERATION_CHECK_SECONDS:
+        generation = await ingestion_generation()
+        if generation != _generation:
+            retrieval_cache.local.clear()
+        _generation, _generation_read_at = generation, now
+    return _generation
+
+
+async def cached_embedding(model, question, embed):
+    """embed() is only awaited when this question has not been embedded before."""
+    key = embedding_cache.make_key(model, normalise_question(question))
+    return await embedding_cache.get_or_fetch(key, embed)
+
+
+async def cached_documents(embedding, params, search):
+    """
+    Documents for this embedding and search parameters; search() is only run
+    on a miss. params must be JSON-serialisable (question, filters, k, ...).
+    """
+    generation = await current_generation()
+    if generation is None:
+        # Without Redis ingestion cannot be observed; don't risk stale results.
+        return await search()
+
+    vector = hashlib.sha1(np.asarray(embedding, dtype=np.float32).tobytes()).hexdigest()
+    key = retrieval_cache.make_key(generation, vector, params)
+
+    async def fetch():
+        return [{"page_content": doc.page_content, "metadata": doc.metadata} for doc in await search()]
+
+    rows = await retrieval_cache.get_or_fetch(key, fetch)
+    return [Document(**row) for row in rows]
+
+
+def cache_stats():
+    """Hit/miss counters of both layers for this process."""
+    return {
+        name: {**cache.stats, "hit_rate": round(cache.hit_rate(), 3)}
+        for name, cache in (("embeddings", embedding_cache), ("retrieval", retrieval_cache))
+    }
@@ -1,22 +1,22 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.models.signals import post_save, post_migrate
 from django.dispatch import receiver
-from threading import Thread
 from .models import Document
-from .tasks import process_new_documents
-from .utils import text_splitter
-from .vectorstore import get_vector_store
-
-import asyncio
-
-def run_async_task():
-    vector_store = get_vector_store()
-    asyncio.run(
-        process_new_documents(text_splitter, vector_store)
-    )
+from .tasks import enqueue_document, backfill_loaded_status
 
 @receiver(post_save, sender=Document)
 def trigger_document_processing(sender, instance, created, **kwargs):
     if not created:
         return
 
-    Thread(target=run_async_task, daemon=True).start()
\ No newline at end of file
+    # Queue only once the row is committed, so the worker can see it.
+    transaction.on_commit(lambda: enqueue_document(instance.pk))
+
+
+@receiver(post_migrate)
+def mark_loaded_documents(sender, **kwargs):
+    if sender.name != "AI":
+        return
+    updated = backfill_loaded_status()
+    if updated:
+        print(f"✅ Marked {updated} previously loaded documents as loaded")
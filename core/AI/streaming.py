@@ -0,0 +1,91 @@
+import os
+import json
+import asyncio
+from urllib.parse import parse_qs
+
+STREAM_FLUSH_MS = int(os.getenv("STREAM_FLUSH_MS", "30"))
+STREAM_FLUSH_BYTES = int(os.getenv("STREAM_FLUSH_BYTES", "512"))
+
+
+def stream_settings(scope):
+    """
+    Per-connection coalescing settings from the websocket query string,
+    e.g. ws/chat/12/?flush_ms=50&flush_bytes=1024. flush_ms=0 disables coalescing.
+    """
+    params = parse_qs(scope.get("query_string", b"").decode())
+
+    def _int(name, default):
+        try:
+            return max(0, int(params[name][0]))
+        except (KeyError, ValueError, IndexError):
+            return default
+
+    return {
+        "flush_interval": _int("flush_ms", STREAM_FLUSH_MS) / 1000,
+        "max_bytes": _int("flush_bytes", STREAM_FLUSH_BYTES),
+    }
+
+
+class StreamCoalescer:
+    """
+    Buffers LLM chunks and sends them as one is_stream frame once max_bytes
+    have accumulated or flush_interval has passed since the first buffered
+    chunk, whichever comes first. close() flushes the remainder; the caller
+    still sends the is_final frame afterwards, so clients see the same
+    protocol, just fewer and larger frames.
+    """
+
+    def __init__(self, send, flush_interval=STREAM_FLUSH_MS / 1000, max_bytes=STREAM_FLUSH_BYTES):
+        self.send = send
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.frames = 0
+        self._buffer = []
+        self._size = 0
+        self._timer = None
+        self._lock = asyncio.Lock()
+
+    async def add(self, chunk):
+        if not chunk:
+            return
+
+        self._buffer.append(chunk)
+        self._size += len(chunk.encode("utf-8"))
+
+        if self.flush_interval <= 0 or self._size >= self.max_bytes:
+            await self.flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_interval)
+        self._timer = None
+        await self.flush()
+
+    async def flush(self):
+        if self._timer is not None and self._timer is not asyncio.current_task():
+            self._timer.cancel()
+            self._timer = None
+
+        async with self._lock:
+            if not self._buffer:
+                return
+            message = "".join(self._buffer)
+            self._buffer = []
+            self._size = 0
+            self.frames += 1
+            await self.send(text_data=json.dumps({
+                "message": message,
+                "is_stream": True,
+            }))
+
+    async def close(self):
+        await self.flush()
+
+    def discard(self):
+        """Drop anything buffered without sending it (the socket is going away)."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._buffer = []
+        self._size = 0
@@ -0,0 +1,153 @@
+import os
+import re
+import html
+import asyncio
+from channels.db import database_sync_to_async
+from AI.tokens import count_tokens
+from AI.context import truncate_to_tokens
+from AI.utils import history_window
+
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1500"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+
+SUMMARY_PROMPT = """
+You maintain a running summary of a conversation between a user and the MoPD Chat Bot
+about Ethiopian government indicators, ministry scores and ministry performance.
+
+Update the summary with the new turns below. Keep every indicator, ministry, year,
+reporting period and figure the user asked about or was given, and drop greetings
+and formatting. Reply with plain text only, at most 150 words.
+"""
+
+CHART_DATA = re.compile(r"<chart-data>.*?</chart-data>", re.S | re.I)
+# Raw chart JSON the rules ask for right after each table.
+CHART_JSON = re.compile(r'\{[^{}]*"type"\s*:\s*"[a-z_]+"[^{}]*\}', re.I)
+CELL_BREAK = re.compile(r"</t[dh]>\s*", re.I)
+LINE_BREAK = re.compile(r"<br\s*/?>|</(p|div|li|tr|h[1-6])>", re.I)
+TAG = re.compile(r"<[^>]+>")
+
+
+def strip_html(text):
+    """Plain text of a previous answer: charts dropped, table cells joined with ' | '."""
+    if not text:
+        return ""
+
+    text = CHART_DATA.sub("", text)
+    text = CHART_JSON.sub("", text)
+    text = CELL_BREAK.sub(" | ", text)
+    text = LINE_BREAK.sub("\n", text)
+    text = html.unescape(TAG.sub("", text))
+
+    lines = (re.sub(r"[ \t]+", " ", line).strip(" |") for line in text.split("\n"))
+    return "\n".join(line for line in lines if line)
+
+
+def budgeted_history(turns, budget=HISTORY_TOKEN_BUDGET):
+    """
+    Prior turns with plain-text answers, dropping the oldest until they fit in
+    `budget` tokens. The newest turn is always kept, cut to the budget if needed.
+    """
+    turns = [
+        {"question": turn.get("question"), "response": strip_html(turn.get("response"))}
+        for turn in turns
+    ]
+    costs = [count_tokens(t["question"] or "") + count_tokens(t["response"]) for t in turns]
+
+    while len(turns) > 1 and sum(costs) > budget:
+        turns.pop(0)
+        costs.pop(0)
+
+    if turns and costs[0] > budget:
+        turns[0]["response"] = truncate_to_tokens(
+            turns[0]["response"], max(budget - count_tokens(turns[0]["question"] or ""), 0)
+        )
+    return turns
+
+
+def summary_start(total, max_turns=3):
+    """Number of turns that precede utils.history_window, i.e. belong in the summary."""
+    return total - len(history_window(range(total), max_turns))
+
+
+class ConversationSummarizer:
+    """
+    Keeps ChatInstance.summary covering every turn older than the replayed
+    history window. It only changes when the window steps forward (every
+    max_turns answers), and is computed in a background task after the answer
+    has streamed, so the hot path never waits on it. Overlapping updates for
+    the same chat share one task.
+    """
+
+    def __init__(self, max_tokens=SUMMARY_MAX_TOKENS):
+        self.max_tokens = max_tokens
+        self._inflight = {}
+
+    def schedule(self, llm, instance_id, summarized, total, max_turns=3):
+        """Start an update if turns have left the window; returns the task or None."""
+        start = summary_start(total, max_turns)
+        if start <= summarized or llm is None:
+            return None
+
+        task = self._inflight.get(instance_id)
+        if task is None or task.done():
+            task = asyncio.create_task(self._update(llm, instance_id, start))
+            self._inflight[instance_id] = task
+            task.add_done_callback(lambda _: self._inflight.pop(instance_id, None))
+        return task
+
+    async def _update(self, llm, instance_id, start):
+        """Fold turns [summarized, start) into the summary; returns (summary, summarized)."""
+        summary, summarized = await self.load(instance_id)
+        if start <= summarized:
+            return summary, summarized
+
+        try:
+            turns = await self._turns(instance_id, summarized, start)
+            summary = await self.summarize(llm, summary, turns)
+            await self._save(instance_id, summary, start)
+        except Exception as e:
+            print(f"⚠️ Conversation summary update failed for chat {instance_id}: {e}")
+            return await self.load(instance_id)
+
+        print(f"📝 Summarised turns {summarized + 1}-{start} of chat {instance_id}")
+        return summary, start
+
+    async def summarize(self, llm, summary, turns):
+        lines = [f"Current summary:\n{summary or '(none)'}", "New turns:"]
+        for turn in turns:
+            lines.append(f"User: {turn['question']}")
+            lines.append(f"Assistant: {strip_html(turn['response'])}")
+
+        result = await llm.bind(max_tokens=self.max_tokens).ainvoke([
+            {"role": "system", "content": SUMMARY_PROMPT},
+            {"role": "user", "content": "\n".join(lines)},
+        ])
+        return (getattr(result, "content", None) or str(result)).strip()
+
+    @database_sync_to_async
+    def load(self, instance_id):
+        """(summary, summarized_turns) stored for the chat."""
+        from .models import ChatInstance
+        row = ChatInstance.objects.filter(id=instance_id).values("summary", "summarized_turns").first()
+        return (row["summary"], row["summarized_turns"]) if row else ("", 0)
+
+    @database_sync_to_async
+    def _turns(self, instance_id, offset, stop):
+        from .models import QuestionHistory
+        return list(
+            QuestionHistory.objects.filter(
+                instance_id=instance_id
+            ).order_by("id")
+             .values("question", "response")[offset:stop]
+        )
+
+    @database_sync_to_async
+    def _save(self, instance_id, summary, summarized):
+        from .models import ChatInstance
+        ChatInstance.objects.filter(
+            id=instance_id,
+            summarized_turns__lt=summarized,
+        ).update(summary=summary, summarized_turns=summarized)
+
+
+conversation_summarizer = ConversationSummarizer()
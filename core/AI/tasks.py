@@ -1,16 +1,113 @@
+import os
+import time
+import asyncio
 from asgiref.sync import sync_to_async
+from celery import shared_task
+from django.db.models import F
+from django.utils import timezone
 from .models import Document as doc
 from AI.utils import process_document
+from AI.cache import mark_ingested
 
+INGEST_TASK_MAX_RETRIES = int(os.getenv("INGEST_TASK_MAX_RETRIES", "3"))
+INGEST_TASK_RETRY_BACKOFF = int(os.getenv("INGEST_TASK_RETRY_BACKOFF", "30"))
+INGEST_PROGRESS_SECONDS = float(os.getenv("INGEST_PROGRESS_SECONDS", "2"))
 
+_loop = None
 
-# Load and process new documents
-async def process_new_documents(text_splitter, vector_store):
-    doc_data = await sync_to_async(lambda: list(doc.objects.filter(is_loaded=False)))()
-    
-    if len(doc_data) > 0:
-        print("Processing new documents...")
-        for document in doc_data:
-            await process_document(document, vector_store)
-    else:
-        print("No new documents to process.")
\ No newline at end of file
+
+def run_in_worker_loop(coro):
+    """
+    Run a coroutine on this worker process's own event loop. The embeddings
+    client is created once per process and keeps connections bound to the loop
+    it first ran on, so tasks share one loop instead of asyncio.run's new one.
+    """
+    global _loop
+    if _loop is None or _loop.is_closed():
+        _loop = asyncio.new_event_loop()
+    return _loop.run_until_complete(coro)
+
+
+def update_document(document_id, **fields):
+    doc.objects.filter(pk=document_id).update(updated_at=timezone.now(), **fields)
+
+
+def enqueue_document(document_id):
+    """Queue a Document for ingestion; if the broker is down it stays pending for the sweep."""
+    try:
+        ingest_document.delay(document_id)
+    except Exception as e:
+        print(f"⚠️ Could not queue document {document_id}, leaving it pending: {e}")
+        return
+    doc.objects.filter(pk=document_id, status=doc.PENDING).update(status=doc.QUEUED)
+
+
+async def ingest(document):
+    last_update = time.monotonic()
+
+    async def on_progress(done):
+        nonlocal last_update
+        if time.monotonic() - last_update >= INGEST_PROGRESS_SECONDS:
+            last_update = time.monotonic()
+            await sync_to_async(update_document)(document.pk, progress=done)
+
+    report = await process_document(document, on_progress)
+    if report.inserted or report.deleted:
+        await mark_ingested()
+    return report
+
+
+@shared_task(bind=True, acks_late=True, max_retries=INGEST_TASK_MAX_RETRIES)
+def ingest_document(self, document_id):
+    """
+    Embed one uploaded Document into Milvus. Failures are retried with
+    exponential backoff; once retries are exhausted (or the file itself is
+    bad) the Document is left in the FAILED dead-letter state with the error.
+    """
+    document = doc.objects.filter(pk=document_id).first()
+    if document is None or document.status == doc.LOADED or document.is_loaded:
+        return
+
+    update_document(document_id, status=doc.PROCESSING, progress=0, attempts=F("attempts") + 1)
+    try:
+        report = run_in_worker_loop(ingest(document))
+    except Exception as e:
+        if getattr(e, "retryable", True) and self.request.retries < self.max_retries:
+            print(f"⚠️ Ingesting document {document_id} failed, retrying: {e}")
+            update_document(document_id, status=doc.RETRYING, error=str(e))
+            raise self.retry(exc=e, countdown=INGEST_TASK_RETRY_BACKOFF * 2 ** self.request.retries)
+
+        print(f"❌ Ingesting document {document_id} failed: {e}")
+        update_document(document_id, status=doc.FAILED, error=str(e))
+        return
+
+    update_document(
+        document_id,
+        status=doc.LOADED,
+        is_loaded=True,
+        progress=report.inserted + report.skipped,
+        error="",
+    )
+
+
+def backfill_loaded_status():
+    """
+    Documents embedded before ingestion tracked a status are is_loaded=True
+    but still at the PENDING default; mark them LOADED so the sweep leaves
+    them alone. Runs after every migrate (see signals.py).
+    """
+    return doc.objects.filter(is_loaded=True).exclude(status=doc.LOADED).update(status=doc.LOADED)
+
+
+@shared_task
+def enqueue_pending_documents():
+    """
+    Queue Documents whose upload could not be queued (e.g. the broker was
+    down). Scheduled by celery beat (beat_schedule in project/celery.py).
+    """
+    pending = list(
+        doc.objects.filter(status=doc.PENDING, is_loaded=False).values_list("pk", flat=True)
+    )
+    for document_id in pending:
+        enqueue_document(document_id)
+    return len(pending)
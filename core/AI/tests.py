@@ -1,3 +1,1033 @@
-from django.test import TestCase
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
 
-# Create your tests here.
+from channels.routing import URLRouter
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from AI.consumers import ChatConsumer
+from AI.routing import websocket_urlpatterns
+
+
+IN_MEMORY_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+SLOW_CLASSIFY_SECONDS = 1.0
+
+ROUTE = json.dumps({
+    "intent": "TIME_SERIES",
+    "year": "2015",
+    "quarter": None,
+    "performance_type": None,
+})
+
+
+class FakeLLM:
+    """
+    Stand-in for the vLLM ChatOpenAI client.
+    The sync path sleeps on the thread (as a blocking HTTP call would), the async
+    path sleeps on the loop, so only the async path lets other sockets progress.
+    """
+
+    def __init__(self, chunks=("<p>", "Hello", "</p>")):
+        self.chunks = chunks
+
+    def _delay(self, prompt):
+        return SLOW_CLASSIFY_SECONDS if "slow" in str(prompt) else 0
+
+    def bind(self, **kwargs):
+        return self
+
+    def invoke(self, prompt):
+        time.sleep(self._delay(prompt))
+        return SimpleNamespace(content=ROUTE)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self._delay(prompt))
+        return SimpleNamespace(content=ROUTE)
+
+    async def astream(self, messages):
+        for chunk in self.chunks:
+            await asyncio.sleep(0.01)
+            yield SimpleNamespace(content=chunk)
+
+
+class EndlessLLM(FakeLLM):
+    """Streams until the consumer closes the stream, recording when that happened."""
+
+    def __init__(self):
+        super().__init__()
+        self.closed_at = None
+
+    async def astream(self, messages):
+        try:
+            while True:
+                await asyncio.sleep(0.005)
+                yield SimpleNamespace(content="token ")
+        finally:
+            self.closed_at = asyncio.get_running_loop().time()
+
+
+@asynccontextmanager
+async def free_slot(user, on_position=None):
+    yield
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class ChatConsumerConcurrencyTests(SimpleTestCase):
+
+    def setUp(self):
+        self.llm = FakeLLM()
+        patches = [
+            patch("AI.providers.get_llm_instance", return_value=self.llm),
+            patch("AI.vectorstore.aembed_query", AsyncMock(return_value=[0.1] * 768)),
+            patch("AI.vectorstore.aretrieve_by_vector", AsyncMock(return_value=[])),
+            patch("AI.answer_cache.answer_cache.lookup", AsyncMock(return_value=None)),
+            patch("AI.answer_cache.answer_cache.store", AsyncMock()),
+            patch("AI.intent_index.intent_index.aload", AsyncMock(return_value=False)),
+            patch("AI.consumers.entity_index.refresh_if_stale"),
+            patch.object(ChatConsumer, "get_chat", AsyncMock(return_value={"id": 1, "user_id": 7})),
+            patch("AI.consumers.llm_admission.slot", free_slot),
+            patch("AI.consumers.llm_admission.charge", AsyncMock()),
+            patch("AI.consumers.history_writer._schedule"),
+            # Nothing is flushed, so each test starts from an empty write queue;
+            # otherwise earlier tests' turns would show up as chat history.
+            patch("AI.consumers.history_writer._queue", []),
+            patch("AI.consumers.conversation_summarizer.load", AsyncMock(return_value=("", 0))),
+            patch("AI.consumers.conversation_summarizer.schedule", return_value=None),
+            patch.object(ChatConsumer, "get_recent_history", AsyncMock(return_value=([], 0))),
+        ]
+        for p in patches:
+            p.start()
+            self.addCleanup(p.stop)
+
+    async def _connect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), "/ws/chat/1/")
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    async def _drain(self, communicator, timeout):
+        frames = []
+        while True:
+            frame = json.loads(await communicator.receive_from(timeout=timeout))
+            frames.append(frame)
+            if frame.get("is_final"):
+                return frames
+
+    async def test_sockets_keep_streaming_while_one_is_classifying(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+
+        slow = await self._connect()
+        await slow.send_to(text_data=json.dumps({"message": "slow question"}))
+
+        fast = [await self._connect() for _ in range(5)]
+        for communicator in fast:
+            await communicator.send_to(text_data=json.dumps({"message": "GDP in 2015"}))
+
+        for communicator in fast:
+            frames = await self._drain(communicator, timeout=SLOW_CLASSIFY_SECONDS)
+            streamed = "".join(f["message"] for f in frames if f.get("is_stream"))
+            self.assertEqual(streamed, "<p>Hello</p>")
+
+        # Every fast socket finished while the slow one was still classifying.
+        self.assertLess(loop.time() - started, SLOW_CLASSIFY_SECONDS)
+        self.assertTrue(await slow.receive_nothing(timeout=0.05))
+
+        frames = await self._drain(slow, timeout=SLOW_CLASSIFY_SECONDS * 2)
+        self.assertTrue(frames[-1]["is_final"])
+
+        for communicator in [slow, *fast]:
+            await communicator.disconnect()
+
+    async def test_only_turns_without_history_use_the_answer_cache(self):
+        lookup, store = AsyncMock(return_value=None), AsyncMock()
+        with patch("AI.answer_cache.answer_cache.lookup", lookup), \
+                patch("AI.answer_cache.answer_cache.store", store):
+            communicator = await self._connect()
+            for question in ["GDP in 2015", "and in 2016?"]:
+                await communicator.send_to(text_data=json.dumps({"message": question}))
+                await self._drain(communicator, timeout=SLOW_CLASSIFY_SECONDS * 2)
+            await communicator.disconnect()
+
+        self.assertEqual(lookup.await_count, 1)
+        self.assertEqual(store.await_count, 1)
+
+    async def test_greetings_are_answered_without_retrieval(self):
+        find_documents = AsyncMock(return_value=[])
+        with patch.object(ChatConsumer, "find_documents", find_documents):
+            communicator = await self._connect()
+            await communicator.send_to(text_data=json.dumps({"message": "Hello!"}))
+            frames = await self._drain(communicator, timeout=SLOW_CLASSIFY_SECONDS)
+            await communicator.disconnect()
+
+        self.assertTrue(frames[-1]["is_final"])
+        find_documents.assert_not_called()
+
+    async def test_disconnect_closes_the_upstream_stream_and_keeps_the_partial_answer(self):
+        llm = EndlessLLM()
+        with patch("AI.providers.get_llm_instance", return_value=llm), \
+                patch("AI.consumers.history_writer.set_response") as set_response:
+            communicator = await self._connect()
+            await communicator.send_to(text_data=json.dumps({"message": "GDP in 2015"}))
+
+            frame = json.loads(await communicator.receive_from(timeout=1))
+            self.assertTrue(frame["is_stream"])
+
+            disconnected_at = asyncio.get_running_loop().time()
+            await communicator.disconnect()
+
+        self.assertIsNotNone(llm.closed_at)
+        self.assertLess(llm.closed_at - disconnected_at, 0.05)
+
+        partial = set_response.call_args.args[1]
+        self.assertTrue(partial.startswith(frame["message"]))
+
+    async def test_failed_answer_sends_a_final_error_and_cancels_its_tasks(self):
+        embedding_cancelled = asyncio.Event()
+
+        async def slow_embedding(text):
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                embedding_cancelled.set()
+                raise
+
+        async def failing_router(*args):
+            # Yield first, so the embedding task is running when it is cancelled.
+            await asyncio.sleep(0.01)
+            raise RuntimeError("router down")
+
+        with patch("AI.vectorstore.aembed_query", slow_embedding), \
+                patch.object(ChatConsumer, "resolve_route", failing_router), \
+                self.assertLogs("AI.consumers", "ERROR"):
+            communicator = await self._connect()
+            await communicator.send_to(text_data=json.dumps({"message": "GDP in 2015"}))
+            frame = json.loads(await communicator.receive_from(timeout=1))
+            await communicator.disconnect()
+
+        self.assertEqual(frame["error"], "failed")
+        self.assertTrue(frame["is_final"])
+        self.assertTrue(embedding_cancelled.is_set())
+
+    async def test_rejected_turns_count_towards_the_summary_offsets(self):
+        from AI.admission import AdmissionRejected
+
+        @asynccontextmanager
+        async def busy_slot(user, on_position=None):
+            raise AdmissionRejected("busy", "The assistant is busy.")
+            yield
+
+        schedule = Mock(return_value=None)
+        with patch("AI.consumers.conversation_summarizer.schedule", schedule):
+            communicator = await self._connect()
+            with patch("AI.consumers.llm_admission.slot", busy_slot):
+                await communicator.send_to(text_data=json.dumps({"message": "GDP in 2015"}))
+                frames = await self._drain(communicator, timeout=1)
+            self.assertEqual(frames[-1]["error"], "busy")
+
+            await communicator.send_to(text_data=json.dumps({"message": "GDP in 2016"}))
+            await self._drain(communicator, timeout=SLOW_CLASSIFY_SECONDS * 2)
+            await communicator.disconnect()
+
+        # Both questions have QuestionHistory rows, so both are counted.
+        self.assertEqual([c.args[3] for c in schedule.call_args_list], [1, 2])
+
+
+class RouterParsingTests(SimpleTestCase):
+
+    def test_valid_route(self):
+        from AI.classifier import _parse_route
+        route = _parse_route(json.dumps({
+            "intent": "ministry_performance",
+            "year": "2017",
+            "quarter": "9month",
+            "performance_type": "weak_performance",
+        }))
+        self.assertEqual(route, {
+            "intent": "MINISTRY_PERFORMANCE",
+            "year": "2017",
+            "quarter": "9month",
+            "performance_type": "weak_performance",
+        })
+
+    def test_fallbacks_per_field(self):
+        from AI.classifier import _parse_route
+        with self.assertLogs("AI.classifier", "WARNING") as logs:
+            self.assertEqual(_parse_route("not json"), {
+                "intent": "UNKNOWN", "year": None, "quarter": "12month", "performance_type": None,
+            })
+            # A completion cut off by max_tokens.
+            self.assertEqual(_parse_route('{"intent": "TIME_SERIES", "ye')["intent"], "UNKNOWN")
+            route = _parse_route('```json {"intent": "BOGUS", "year": "17", "quarter": null} ```')
+        self.assertEqual(len(logs.records), 3)
+        self.assertEqual(route["intent"], "UNKNOWN")
+        self.assertIsNone(route["year"])
+        self.assertIsNone(route["quarter"])
+        self.assertIsNone(route["performance_type"])
+
+
+class TieredCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        from AI.cache import TieredCache
+        self.cache = TieredCache("test", ttl=60, negative_ttl=1)
+        redis = AsyncMock()
+        redis.get.return_value = None
+        redis.getset.return_value = None
+        patcher = patch("AI.cache.get_redis", return_value=redis)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_hit_after_miss(self):
+        fetch = AsyncMock(return_value={"value": 1})
+        key = self.cache.make_key("GDP", 2015)
+
+        self.assertEqual(await self.cache.get_or_fetch(key, fetch), {"value": 1})
+        self.assertEqual(await self.cache.get_or_fetch(key, fetch), {"value": 1})
+
+        fetch.assert_awaited_once()
+        self.assertEqual(self.cache.stats["misses"], 1)
+        self.assertEqual(self.cache.stats["local_hits"], 1)
+
+    async def test_empty_responses_are_negatively_cached(self):
+        fetch = AsyncMock(return_value={})
+        key = self.cache.make_key("MISSING", 2015)
+
+        await self.cache.get_or_fetch(key, fetch)
+        await self.cache.get_or_fetch(key, fetch)
+
+        fetch.assert_awaited_once()
+        self.assertEqual(self.cache.stats["negative_hits"], 1)
+
+    async def test_failed_fetches_are_not_cached(self):
+        from AI.upstream import UpstreamError
+
+        fetch = AsyncMock(side_effect=[UpstreamError("HTTP 503"), {"value": 3}])
+        key = self.cache.make_key("GDP", 2017)
+
+        with self.assertRaises(UpstreamError):
+            await self.cache.get_or_fetch(key, fetch)
+        self.assertEqual(await self.cache.get_or_fetch(key, fetch), {"value": 3})
+
+    async def test_failed_and_late_fetches_are_reported(self):
+        from AI.upstream import UpstreamError, fetch_many
+
+        async def fetch(code):
+            if code == "SLOW":
+                await asyncio.sleep(1)
+            if code == "DOWN":
+                raise UpstreamError("HTTP 503")
+            return {"code": code}
+
+        results = await fetch_many(fetch, [("GDP",), ("DOWN",), ("SLOW",)], deadline=0.05)
+
+        self.assertEqual(results[("GDP",)], {"code": "GDP"})
+        self.assertEqual(results[("DOWN",)], {})
+        self.assertEqual(results.failed, {("DOWN",), ("SLOW",)})
+        self.assertFalse(results.complete)
+
+    async def test_concurrent_misses_share_one_fetch(self):
+        async def slow_fetch():
+            await asyncio.sleep(0.01)
+            return {"value": 2}
+
+        fetch = AsyncMock(side_effect=slow_fetch)
+        key = self.cache.make_key("GDP", 2016)
+        results = await asyncio.gather(*[self.cache.get_or_fetch(key, fetch) for _ in range(5)])
+
+        self.assertEqual(results, [{"value": 2}] * 5)
+        fetch.assert_awaited_once()
+
+    async def test_fetch_outlives_a_caller_that_gave_up(self):
+        async def slow_fetch():
+            await asyncio.sleep(0.05)
+            return {"value": 4}
+
+        key = self.cache.make_key("GDP", 2018)
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(self.cache.get_or_fetch(key, slow_fetch), 0.01)
+        await asyncio.sleep(0.1)
+
+        self.assertEqual(self.cache.local.get(key), {"value": 4})
+
+
+class FastRouteTests(SimpleTestCase):
+
+    def test_confident_routes(self):
+        from AI.fastpath import fast_route
+        self.assertEqual(fast_route("MoH score 2017 Q3"), {
+            "intent": "MINISTRY_SCORE", "year": "2017", "quarter": "9month", "performance_type": None,
+        })
+        self.assertEqual(fast_route("weak KPIs for MoA"), {
+            "intent": "MINISTRY_PERFORMANCE", "year": None, "quarter": None, "performance_type": "weak_performance",
+        })
+        self.assertEqual(fast_route("inflation 2015")["intent"], "TIME_SERIES")
+
+    def test_ambiguous_questions_fall_back_to_llm(self):
+        from AI.fastpath import fast_route
+        self.assertIsNone(fast_route("Compare inflation and the agriculture sector"))
+        self.assertIsNone(fast_route("What does MoPD do?"))
+        self.assertIsNone(fast_route("How good is the Ministry of Health score?"))
+        self.assertIsNone(fast_route("Is the Ministry of Health behind schedule in 2017?"))
+        self.assertIsNone(fast_route("Is MoF failing?"))
+
+    def test_held_out_negative_cases_defer_to_the_router(self):
+        from pathlib import Path
+        from AI.fastpath import fast_route
+
+        rows = json.loads((Path(__file__).resolve().parent / "benchmarks" / "routing_questions_heldout.json").read_text())
+        fired = [row["question"] for row in rows if row.get("fast") is False and fast_route(row["question"])]
+        self.assertEqual(fired, [])
+
+    def test_likely_route_always_guesses(self):
+        from AI.fastpath import likely_route
+        self.assertEqual(likely_route("What does MoPD do in 2016?")["intent"], "MINISTRY_SCORE")
+        self.assertEqual(likely_route("Compare inflation and the agriculture sector")["intent"], "TIME_SERIES")
+
+
+class IntentIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        from AI.intent_index import IntentIndex
+        self.index = IntentIndex(k=3, threshold=0.8, min_similarity=0.5)
+        self.index.fit(
+            [[1, 0, 0], [0.9, 0.1, 0], [0, 1, 0], [0, 0.9, 0.1]],
+            ["TIME_SERIES", "TIME_SERIES", "MINISTRY_SCORE", "MINISTRY_SCORE"],
+        )
+
+    def test_confident_neighbour_vote(self):
+        self.assertEqual(self.index.confident_intent([1, 0.05, 0]), "TIME_SERIES")
+
+    def test_low_confidence_escalates(self):
+        intent, confidence = self.index.classify([1, 1, 0])
+        self.assertLess(confidence, 0.8)
+        self.assertIsNone(self.index.confident_intent([1, 1, 0]))
+        self.assertIsNone(self.index.confident_intent([0, 0, 1]))
+
+    async def test_unreachable_milvus_falls_back_without_retrying_each_question(self):
+        from AI.intent_index import IntentIndex
+
+        index = IntentIndex()
+        with patch.object(index, "load", side_effect=ConnectionError("milvus down")) as load, \
+                self.assertLogs("AI.intent_index", "WARNING"):
+            self.assertFalse(await index.aload())
+            self.assertFalse(await index.aload())
+
+        load.assert_called_once()
+
+
+class ContextBudgetTests(SimpleTestCase):
+
+    def test_lowest_ranked_sections_degrade_first(self):
+        from AI.context import fit_to_budget
+        from AI.tokens import count_tokens
+
+        sections = [("top " * 50, "top"), ("mid " * 50, "mid"), ("low " * 50, "low")]
+        budget = count_tokens("top " * 50) + count_tokens("mid " * 50) + 5
+        self.assertEqual(fit_to_budget(sections, budget), ["top " * 50, "mid " * 50, "low"])
+
+    def test_sections_dropped_when_summaries_do_not_fit(self):
+        from AI.context import fit_to_budget
+        sections = [("a " * 50, "a " * 40), ("b " * 50, "b " * 40)]
+        chosen = fit_to_budget(sections, 45)
+        self.assertEqual(len(chosen), 1)
+        self.assertTrue(chosen[0].startswith("a"))
+
+    @override_settings(AI_CONTEXT_FORMAT="html")
+    def test_html_output_kept_behind_setting(self):
+        from langchain_core.documents import Document
+        from AI.context import build_ministry_score_context
+        context = build_ministry_score_context([Document(page_content="MoH", metadata={})], [{}])
+        self.assertIn("<h3>Ministry Metadata</h3>", context)
+        self.assertIn("No ministry performance data found.", context)
+
+
+class StreamCoalescerTests(SimpleTestCase):
+
+    async def test_chunks_are_coalesced_until_close(self):
+        from AI.streaming import StreamCoalescer
+        send = AsyncMock()
+        stream = StreamCoalescer(send, flush_interval=10, max_bytes=1000)
+        for chunk in ["<p>", "Hel", "lo", "</p>"]:
+            await stream.add(chunk)
+
+        send.assert_not_awaited()
+        await stream.close()
+        send.assert_awaited_once_with(text_data=json.dumps({"message": "<p>Hello</p>", "is_stream": True}))
+
+    async def test_flushes_on_size_and_interval(self):
+        from AI.streaming import StreamCoalescer
+        send = AsyncMock()
+        stream = StreamCoalescer(send, flush_interval=0.01, max_bytes=4)
+
+        await stream.add("abcd")
+        self.assertEqual(send.await_count, 1)
+
+        await stream.add("e")
+        await asyncio.sleep(0.05)
+        self.assertEqual(send.await_count, 2)
+
+    def test_per_connection_settings(self):
+        from AI.streaming import stream_settings
+        self.assertEqual(
+            stream_settings({"query_string": b"flush_ms=50&flush_bytes=64"}),
+            {"flush_interval": 0.05, "max_bytes": 64},
+        )
+
+
+class HistoryWriterTests(SimpleTestCase):
+
+    def setUp(self):
+        from AI.history import HistoryWriter
+        self.writer = HistoryWriter(flush_interval=0)
+        self.written = []
+
+        def write(batch):
+            for turn in batch:
+                if turn.pk is None:
+                    turn.pk = len(self.written) + 1
+                    self.written.append(("insert", turn.pk, turn.response))
+                elif turn.response_dirty:
+                    self.written.append(("update", turn.pk, turn.response))
+                turn.response_dirty = False
+
+        for patcher in [
+            patch.object(self.writer, "_write", AsyncMock(side_effect=write)),
+            patch.object(self.writer, "_schedule"),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_answer_before_flush_is_a_single_insert(self):
+        turn = self.writer.add_question(1, "GDP 2015?")
+        self.writer.set_response(turn, "<p>6.1%</p>")
+        await self.writer.flush()
+
+        self.assertEqual(self.written, [("insert", 1, "<p>6.1%</p>")])
+        self.assertEqual(self.writer.pending(1), [])
+
+    async def test_answer_after_flush_updates_by_primary_key(self):
+        first = self.writer.add_question(1, "GDP 2015?")
+        await self.writer.flush()
+        second = self.writer.add_question(1, "GDP 2016?")
+        self.writer.set_response(first, "<p>6.1%</p>")
+        await self.writer.flush()
+
+        self.assertEqual(self.written, [
+            ("insert", 1, None),
+            ("insert", 2, None),
+            ("update", 1, "<p>6.1%</p>"),
+        ])
+        self.assertEqual(second.pk, 2)
+
+    def test_ring_tail_matches_full_history_window(self):
+        from AI.history import HISTORY_RING_SIZE
+        from AI.utils import history_window
+
+        history = [{"question": str(i), "response": str(i)} for i in range(20)]
+        for total in range(len(history) + 1):
+            ring = history[:total][-HISTORY_RING_SIZE:]
+            self.assertEqual(history_window(ring, 3, total), history_window(history[:total], 3))
+
+
+class HistoryWriterDatabaseTests(TransactionTestCase):
+
+    def setUp(self):
+        from AI.history import HistoryWriter
+        from AI.models import ChatInstance
+
+        self.writer = HistoryWriter(flush_interval=0)
+        self.chat = ChatInstance.objects.create(title="chat")
+        patcher = patch.object(self.writer, "_schedule")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def rows(self):
+        from AI.models import QuestionHistory
+        return list(QuestionHistory.objects.order_by("id").values_list("question", "response"))
+
+    async def test_bulk_insert_then_update(self):
+        first = self.writer.add_question(self.chat.id, "GDP 2015?")
+        second = self.writer.add_question(self.chat.id, "x" * 600)
+        self.writer.set_response(second, "<p>long</p>")
+        await self.writer.flush()
+        self.writer.set_response(first, "<p>6.1%</p>")
+        await self.writer.flush()
+
+        rows = await database_sync_to_async(self.rows)()
+        self.assertEqual(rows, [("GDP 2015?", "<p>6.1%</p>"), ("x" * 500, "<p>long</p>")])
+        self.assertEqual(self.writer.pending(self.chat.id), [])
+
+    async def test_a_bad_row_does_not_hold_back_the_batch(self):
+        from AI.history import HISTORY_MAX_ATTEMPTS
+
+        self.writer.add_question(self.chat.id, "GDP 2015?")
+        bad = self.writer.add_question(self.chat.id + 1000, "orphan")  # no such chat
+        self.writer.add_question(self.chat.id, "GDP 2016?")
+
+        for _ in range(HISTORY_MAX_ATTEMPTS):
+            await self.writer.flush()
+
+        rows = await database_sync_to_async(self.rows)()
+        self.assertEqual(rows, [("GDP 2015?", None), ("GDP 2016?", None)])
+        self.assertEqual(bad.attempts, HISTORY_MAX_ATTEMPTS)
+        self.assertEqual(self.writer.pending(self.chat.id + 1000), [])
+
+
+class HistoryReplayTests(SimpleTestCase):
+
+    def test_compressed_page_round_trips(self):
+        import base64
+        import zlib
+        from AI.history import history_frame
+
+        turns = [{"id": i, "question": f"GDP {2000 + i}?", "response": "<p>6.1%</p>" * 20} for i in range(1, 11)]
+        frame = json.loads(history_frame(turns, 1, True, compress=True))
+
+        self.assertEqual(frame["encoding"], "zlib+base64")
+        self.assertEqual(json.loads(zlib.decompress(base64.b64decode(frame["turns"]))), turns)
+        self.assertEqual((frame["cursor"], frame["has_more"]), (1, True))
+
+    def test_small_pages_are_sent_plain(self):
+        from AI.history import history_frame
+
+        frame = json.loads(history_frame([], None, False, compress=True))
+        self.assertNotIn("encoding", frame)
+        self.assertEqual(frame["turns"], [])
+
+
+class HistoryBudgetTests(SimpleTestCase):
+
+    def test_strip_html_drops_charts_and_flattens_tables(self):
+        from AI.summary import strip_html
+
+        answer = (
+            "<p>GDP growth by year:</p><table><tr><th>Year</th><th>Value</th></tr>"
+            "<tr><td>2015</td><td>6.1%</td></tr></table>"
+            '<chart-data>{ "type": "bar", "label": "GDP", "labels": ["2015"], "data": [6.1] }</chart-data>'
+            '{ "type": "line", "label": "GDP", "labels": ["2015"], "data": [6.1] }'
+        )
+        self.assertEqual(strip_html(answer), "GDP growth by year:\nYear | Value\n2015 | 6.1%")
+
+    def test_oldest_turns_are_dropped_first(self):
+        from AI.summary import budgeted_history
+
+        turns = [{"question": f"q{i}", "response": "<p>" + "word " * 50 + "</p>"} for i in range(5)]
+        kept = budgeted_history(turns, budget=120)
+
+        self.assertEqual([t["question"] for t in kept], ["q3", "q4"])
+        self.assertNotIn("<p>", kept[-1]["response"])
+
+    def test_summary_covers_turns_before_the_window(self):
+        from AI.summary import summary_start
+
+        self.assertEqual([summary_start(n) for n in range(2, 10)], [0, 0, 0, 0, 3, 3, 3, 6])
+
+
+class LLMAdmissionTests(SimpleTestCase):
+
+    async def test_user_over_quota_is_rejected_before_queueing(self):
+        from AI.admission import LLMAdmission, AdmissionRejected
+
+        admission = LLMAdmission(token_quota=1000)
+        with patch.object(admission, "tokens_used", AsyncMock(return_value=1000)), \
+                patch.object(admission, "_acquire", AsyncMock()) as acquire, \
+                patch.object(admission, "_record", AsyncMock()):
+            with self.assertRaises(AdmissionRejected) as ctx:
+                async with admission.slot("user:7"):
+                    pass
+
+        self.assertEqual(ctx.exception.reason, "quota")
+        acquire.assert_not_called()
+
+    async def test_queue_positions_are_reported_until_admitted(self):
+        from AI.admission import LLMAdmission
+
+        admission = LLMAdmission(token_quota=0)
+        positions = []
+
+        async def on_position(position):
+            positions.append(position)
+
+        with patch.object(admission, "_acquire", AsyncMock(side_effect=[3, 3, 1, 0])), \
+                patch.object(admission, "_release", AsyncMock()) as release, \
+                patch.object(admission, "_record", AsyncMock()), \
+                patch.object(admission, "_record_wait", AsyncMock()), \
+                patch("AI.admission.LLM_QUEUE_POLL", 0):
+            async with admission.slot("user:7", on_position):
+                pass
+
+        self.assertEqual(positions, [3, 1])
+        release.assert_awaited_once()
+
+    async def test_redis_failure_skips_redis_until_the_backoff_expires(self):
+        from redis.exceptions import ConnectionError
+        from AI.admission import LLMAdmission
+
+        admission = LLMAdmission(token_quota=0, redis_backoff=60)
+        acquire = AsyncMock(side_effect=ConnectionError("down"))
+
+        with patch.object(admission, "_acquire", acquire), \
+                patch.object(admission, "_record_wait", AsyncMock()):
+            for _ in range(3):
+                async with admission.slot("user:7"):
+                    pass
+
+            self.assertEqual(acquire.await_count, 1)
+            self.assertEqual(admission.stats["admitted_local"], 3)
+            self.assertEqual((await admission.metrics())["admitted_local"], 3)
+
+            admission._redis_down_until = 0
+            async with admission.slot("user:7"):
+                pass
+            self.assertEqual(acquire.await_count, 2)
+
+
+class HybridSearchTests(SimpleTestCase):
+
+    def test_filter_expression_for_resolved_entities(self):
+        from AI.vectorstore import filter_expression
+
+        self.assertEqual(filter_expression(None), "")
+        self.assertEqual(
+            filter_expression({"indicator_code": ["GDP_01"], "responsible_ministry_id": [12], "topic": []}),
+            'indicator_code in ["GDP_01"] and responsible_ministry_id in [12]',
+        )
+
+    def test_chunks_of_one_item_are_collapsed(self):
+        from langchain_core.documents import Document
+        from AI.vectorstore import collapse_chunks
+
+        hits = [
+            Document(page_content="second half", metadata={"parent_id": "gdp", "chunk_index": 1}),
+            Document(page_content="inflation", metadata={"parent_id": "cpi"}),
+            Document(page_content="first half", metadata={"parent_id": "gdp", "chunk_index": 0}),
+            Document(page_content="legacy row", metadata={}),
+        ]
+
+        docs = collapse_chunks(hits, 2)
+
+        self.assertEqual([doc.page_content for doc in docs], ["first half\nsecond half", "inflation"])
+
+    def test_overlap_between_adjacent_chunks_is_not_repeated(self):
+        from AI.ingestion import join_chunks
+
+        chunks = [
+            (1, "growth rate was 6.1 percent in 2015"),
+            (0, "Annual GDP growth rate was"),
+            (3, "Source: ministry of finance"),
+        ]
+
+        self.assertEqual(
+            join_chunks(chunks),
+            "Annual GDP growth rate was 6.1 percent in 2015\nSource: ministry of finance",
+        )
+
+
+class EntityIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        from AI.entity_index import EntityIndex
+        self.index = EntityIndex()
+        self.index.build([
+            {"pk": "1", "text": "GDP growth", "indicator_code": "NA_GDP_G", "indicator_eng": "GDP growth rate",
+             "responsible_ministry_id": 4, "responsible_ministry_eng": "Ministry of Finance"},
+            {"pk": "2", "text": "DPT3 coverage", "indicator_code": "HE_DPT3", "indicator_eng": "DPT3 coverage",
+             "responsible_ministry_id": 9, "responsible_ministry_eng": "Ministry of Health",
+             "responsible_ministry_code": "MoH"},
+        ])
+
+    def test_named_indicator_resolves_to_its_document(self):
+        matches = self.index.match("What was the  GDP Growth Rate in 2015?")
+        self.assertEqual([d.metadata["pk"] for d in matches.documents("TIME_SERIES")], ["1"])
+
+    def test_ministry_resolves_only_for_ministry_intents(self):
+        matches = self.index.match("How is MoH doing?")
+        self.assertEqual([d.metadata["pk"] for d in matches.documents("MINISTRY_SCORE")], ["2"])
+        self.assertEqual(matches.documents("TIME_SERIES"), [])
+        self.assertEqual(matches.filters(), {"responsible_ministry_id": [9]})
+
+    def test_partial_words_do_not_match(self):
+        self.assertFalse(self.index.match("MoHA budget and ministry of healthcare"))
+
+
+class RetrievalCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        redis = AsyncMock()
+        redis.get.return_value = None
+        for patcher in [
+            patch("AI.cache.get_redis", return_value=redis),
+            patch("AI.retrieval_cache.GENERATION_CHECK_SECONDS", 0),
+        ]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    async def test_results_are_reused_until_the_next_ingestion(self):
+        from langchain_core.documents import Document
+        from AI.retrieval_cache import cached_documents
+
+        search = AsyncMock(return_value=[Document(page_content="GDP", metadata={"indicator_code": "NA_GDP_G"})])
+        generation = AsyncMock(return_value=1)
+
+        with patch("AI.retrieval_cache.ingestion_generation", generation):
+            first = await cached_documents([0.1] * 8, {"question": "gdp"}, search)
+            second = await cached_documents([0.1] * 8, {"question": "gdp"}, search)
+            generation.return_value = 2
+            await cached_documents([0.1] * 8, {"question": "gdp"}, search)
+
+        self.assertEqual(second[0].metadata, first[0].metadata)
+        self.assertEqual(search.await_count, 2)
+
+    async def test_questions_differing_in_case_share_an_embedding(self):
+        from AI.retrieval_cache import cached_embedding
+
+        embed = AsyncMock(return_value=[0.1] * 8)
+        await cached_embedding("bge", "GDP in 2015?", embed)
+        await cached_embedding("bge", "  gdp in   2015? ", embed)
+
+        embed.assert_awaited_once()
+
+    async def test_questions_differing_in_case_share_search_results(self):
+        from langchain_core.documents import Document
+        from AI.vectorstore import aretrieve_by_vector
+
+        with patch("AI.retrieval_cache.ingestion_generation", AsyncMock(return_value=1)), \
+                patch("AI.vectorstore.search", return_value=[Document(page_content="GDP")]) as search:
+            await aretrieve_by_vector([0.2] * 8, "GDP in 2015?")
+            await aretrieve_by_vector([0.2] * 8, "  gdp in   2015? ")
+
+        search.assert_called_once()
+
+
+class IngestionPipelineTests(SimpleTestCase):
+
+    async def test_documents_are_embedded_in_batches_and_failures_reported(self):
+        from langchain_core.documents import Document
+        from AI.ingestion import ingest_documents
+
+        calls = []
+
+        async def aembed_documents(texts):
+            calls.append(list(texts))
+            if "doc-2" in texts:
+                raise RuntimeError("embedding server unavailable")
+            return [[0.0] * 4 for _ in texts]
+
+        inserted = []
+        embeddings = SimpleNamespace(aembed_documents=aembed_documents)
+        items = ((str(i), Document(page_content=f"doc-{i}")) for i in range(5))
+
+        with patch("AI.ingestion.INGEST_RETRY_BACKOFF", 0), patch("AI.ingestion.INGEST_MAX_ATTEMPTS", 2):
+            report = await ingest_documents(
+                items, embeddings, lambda texts, vectors, metadatas, ids: inserted.extend(ids),
+                batch_size=2, concurrency=2,
+            )
+
+        self.assertEqual(sorted(inserted), ["0", "1", "4"])
+        self.assertEqual(report.failed_ids, ["2", "3"])
+        self.assertEqual((report.documents, report.inserted), (5, 3))
+        self.assertEqual(len(calls), 4)
+
+    def test_json_array_is_parsed_incrementally(self):
+        import io
+        from AI.ingestion import iter_json_array
+
+        items = [{"page_content": "GDP ]}, \"quoted\"", "metadata": {"year": 2015}}, 12345, [], None]
+        text = json.dumps(items, indent=2)
+
+        for read_size in (1, 7, len(text)):
+            self.assertEqual(list(iter_json_array(io.StringIO(text), read_size)), items)
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"page_content": "GDP"}'), 4))
+
+    def test_json_array_needs_exactly_one_comma_between_items(self):
+        import io
+        from AI.ingestion import iter_json_array
+
+        self.assertEqual(list(iter_json_array(io.StringIO(" [ ] "), 1)), [])
+        for text in ("[1 2]", "[1,,2]", "[,1]", "[1,]", '[{"a": 1} {"b": 2}]'):
+            with self.subTest(text=text), self.assertRaises(ValueError):
+                list(iter_json_array(io.StringIO(text), 2))
+
+    def test_large_item_is_not_decoded_once_per_read(self):
+        import io
+        from AI.ingestion import iter_json_array
+
+        item = {"page_content": "x" * 100_000}
+        source = io.StringIO(json.dumps([item]))
+        reads = []
+        read = source.read
+        source.read = lambda size: reads.append(size) or read(size)
+
+        self.assertEqual(list(iter_json_array(source, 64)), [item])
+        self.assertLess(len(reads), 20)
+
+    def test_non_object_items_fail_without_retry(self):
+        import os
+        import tempfile
+        from AI.ingestion import IngestionFailed
+        from AI.utils import iter_json_documents
+
+        with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+            json.dump([{"page_content": "GDP"}, "not an object"], f)
+        self.addCleanup(os.remove, f.name)
+
+        with self.assertRaises(IngestionFailed) as ctx:
+            list(iter_json_documents(f.name))
+        self.assertFalse(ctx.exception.retryable)
+
+    def test_ingestion_keys_do_not_replace_the_exports_source(self):
+        from langchain_core.documents import Document
+        from AI.ingestion import Reingestion
+        from AI.utils import document_source
+
+        doc = Document(page_content="GDP growth", metadata={"indicator_code": "NA_GDP_G", "source": "World Bank"})
+        [(_, written)] = Reingestion("name:exports", {}).changed([doc])
+
+        self.assertEqual(written.metadata["source"], "World Bank")
+        self.assertEqual(written.metadata["ingest_source"], "name:exports")
+
+        renamed_upload = SimpleNamespace(pk=9, name="", file=SimpleNamespace(name="documents/export_AbC123.json"))
+        self.assertEqual(document_source(renamed_upload), "document:9")
+        self.assertEqual(document_source(SimpleNamespace(pk=9, name="exports")), "name:exports")
+
+    def test_reingestion_skips_unchanged_items_and_finds_removed_ones(self):
+        from langchain_core.documents import Document
+        from AI.ingestion import Reingestion
+
+        def export():
+            return [
+                Document(page_content="GDP growth", metadata={"indicator_code": "NA_GDP_G"}),
+                Document(page_content="Inflation", metadata={"indicator_code": "CPI"}),
+                Document(page_content="Exports", metadata={"indicator_code": "EXP"}),
+            ]
+
+        first = Reingestion("export.json", {})
+        stored = {pk: (doc.metadata["content_hash"], [pk]) for pk, doc in first.changed(export())}
+
+        update = export()[:2]
+        update[1].page_content = "Inflation, year on year"
+        second = Reingestion("export.json", stored)
+        changed = list(second.track(second.changed(update)))
+
+        self.assertEqual([doc.metadata["indicator_code"] for _, doc in changed], ["CPI"])
+        self.assertIn(changed[0][0], stored)
+        self.assertEqual(second.skipped, 1)
+        # Only the dropped EXP item goes; CPI's row was overwritten in place.
+        exports = [pk for pk, (_, rows) in stored.items() if pk not in second.seen]
+        self.assertEqual(second.removed(), exports)
+
+        # An item stored only in part (stored_rows gives it no hash) is
+        # written again even though its content did not change.
+        partly = {**stored, changed[0][0]: (None, [changed[0][0]])}
+        third = Reingestion("export.json", partly)
+        update = export()[:2]
+        update[1].page_content = "Inflation, year on year"
+        rewritten = list(third.track(third.changed(update)))
+
+        self.assertEqual([pk for pk, _ in rewritten], [changed[0][0]])
+        self.assertEqual(third.removed(), exports)
+
+    def test_long_items_are_chunked_and_stale_chunks_removed(self):
+        from langchain_core.documents import Document
+        from AI.ingestion import Reingestion, chunk_documents
+
+        def split(text):
+            return [text[i:i + 10] for i in range(0, len(text), 10)]
+
+        def ingest(reingestion, text):
+            doc = Document(page_content=text, metadata={"indicator_code": "NA_GDP_G"})
+            rows = chunk_documents(reingestion.changed([doc]), split, 10, workers=0)
+            return list(reingestion.track(rows))
+
+        first = ingest(Reingestion("export.json", {}), "a" * 25)
+        parent = first[0][1].metadata["parent_id"]
+        self.assertEqual([doc.metadata["chunk_index"] for _, doc in first], [0, 1, 2])
+        self.assertEqual({doc.metadata["parent_id"] for _, doc in first}, {parent})
+
+        stored = {parent: (first[0][1].metadata["content_hash"], [pk for pk, _ in first])}
+        second = Reingestion("export.json", stored)
+        rewritten = ingest(second, "b" * 15)
+
+        self.assertEqual([pk for pk, _ in rewritten], [pk for pk, _ in first[:2]])
+        self.assertEqual(second.removed(), [first[2][0]])
+
+    def test_partially_stored_item_is_written_again(self):
+        from langchain_core.documents import Document
+        from AI.ingestion import Reingestion, chunk_documents, stored_rows
+
+        def split(text):
+            return [text[i:i + 10] for i in range(0, len(text), 10)]
+
+        def export():
+            return [Document(page_content="a" * 40, metadata={"indicator_code": "NA_GDP_G"})]
+
+        first = list(chunk_documents(Reingestion("export.json", {}).changed(export()), split, 10, workers=0))
+        self.assertEqual([doc.metadata["chunk_count"] for _, doc in first], [4] * 4)
+
+        def milvus_with(rows):
+            # Only the first batch of chunks made it into Milvus.
+            batches = iter([[{**doc.metadata, "pk": pk} for pk, doc in rows], []])
+            return SimpleNamespace(query_iterator=lambda **kwargs: SimpleNamespace(
+                next=lambda: next(batches), close=lambda: None,
+            ))
+
+        stored = stored_rows(milvus_with(first[:2]), "ai_docs", "export.json")
+        retry = Reingestion("export.json", stored)
+        self.assertEqual(len(list(retry.changed(export()))), 1)
+        self.assertEqual(retry.skipped, 0)
+
+        stored = stored_rows(milvus_with(first), "ai_docs", "export.json")
+        again = Reingestion("export.json", stored)
+        self.assertEqual(list(again.changed(export())), [])
+        self.assertEqual(again.skipped, 1)
+
+
+class IngestionTaskTests(SimpleTestCase):
+
+    def test_bad_file_is_dead_lettered_without_retrying(self):
+        from AI.ingestion import IngestionFailed
+        from AI.models import Document
+        from AI.tasks import ingest_document
+
+        document = SimpleNamespace(pk=1, status=Document.QUEUED, is_loaded=False)
+        with patch("AI.tasks.doc.objects") as objects, \
+                patch("AI.tasks.update_document") as update, \
+                patch("AI.tasks.process_document", AsyncMock(side_effect=IngestionFailed("Unsupported file extension .pdf", retryable=False))), \
+                patch.object(ingest_document, "retry") as retry:
+            objects.filter.return_value.first.return_value = document
+            ingest_document(1)
+
+        retry.assert_not_called()
+        self.assertEqual(update.call_args.kwargs["status"], Document.FAILED)
+        self.assertIn(".pdf", update.call_args.kwargs["error"])
+
+
+class DocumentStatusBackfillTests(TransactionTestCase):
+
+    def test_legacy_loaded_documents_are_marked_loaded_and_not_swept(self):
+        from AI.models import Document
+        from AI.tasks import backfill_loaded_status, enqueue_pending_documents
+
+        # bulk_create skips post_save, so nothing is queued on creation.
+        legacy, pending = Document.objects.bulk_create([
+            Document(name="legacy", file="documents/legacy.json", is_loaded=True),
+            Document(name="new", file="documents/new.json"),
+        ])
+
+        with patch("AI.tasks.enqueue_document") as enqueue:
+            self.assertEqual(enqueue_pending_documents(), 1)
+        enqueue.assert_called_once()
+
+        self.assertEqual(backfill_loaded_status(), 1)
+        self.assertEqual(
+            dict(Document.objects.values_list("name", "status")),
+            {"legacy": Document.LOADED, "new": Document.PENDING},
+        )
@@ -0,0 +1,33 @@
+import os
+import re
+
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "o200k_base")
+
+_encoding = None
+_encoding_failed = False
+
+
+def _get_encoding():
+    global _encoding, _encoding_failed
+    if _encoding is not None or _encoding_failed:
+        return _encoding
+
+    try:
+        import tiktoken
+        _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+    except Exception as e:
+        # tiktoken downloads its BPE files on first use; offline hosts fall back to an estimate.
+        print(f"⚠️ tiktoken unavailable, estimating token counts: {e}")
+        _encoding_failed = True
+    return _encoding
+
+
+def tokenize(text):
+    encoding = _get_encoding()
+    if encoding is not None:
+        return encoding.encode(text or "", disallowed_special=())
+    return re.findall(r"\w+|[^\w\s]", text or "")
+
+
+def count_tokens(text):
+    return len(tokenize(text))
@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+import httpx
+from AI.cache import TieredCache
+
+logger = logging.getLogger(__name__)
+
+TIME_SERIES_URL = "https://time-series.mopd.gov.et/api/mobile/annual_value/"
+DPMES_URL = "https://dpmes.mopd.gov.et"
+
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "10"))
+UPSTREAM_DEADLINE = float(os.getenv("UPSTREAM_DEADLINE", "6"))
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "50"))
+
+TIME_SERIES_CACHE_TTL = int(os.getenv("TIME_SERIES_CACHE_TTL", str(6 * 60 * 60)))
+DPMES_CACHE_TTL = int(os.getenv("DPMES_CACHE_TTL", str(60 * 60)))
+NEGATIVE_CACHE_TTL = int(os.getenv("UPSTREAM_NEGATIVE_CACHE_TTL", "300"))
+CACHE_STATS_LOG_SECONDS = float(os.getenv("UPSTREAM_CACHE_STATS_LOG_SECONDS", "300"))
+
+# Upstream data changes at most quarterly; every chat question hits these.
+CACHES = {
+    "time_series": TieredCache("time_series", TIME_SERIES_CACHE_TTL, NEGATIVE_CACHE_TTL),
+    "ministry_score": TieredCache("ministry_score", DPMES_CACHE_TTL, NEGATIVE_CACHE_TTL),
+    "ministry_performance": TieredCache("ministry_performance", DPMES_CACHE_TTL, NEGATIVE_CACHE_TTL),
+}
+
+_client = None
+_client_loop = None
+
+
+def get_http_client():
+    """
+    Shared keep-alive client for the time-series and DPMES services.
+    httpx clients are bound to the event loop they were first used on, so a new
+    one is created if we are called from a different loop (e.g. a worker thread).
+    """
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+
+    if _client is not None and _client_loop is loop and not _client.is_closed:
+        return _client
+
+    _client = httpx.AsyncClient(
+        timeout=UPSTREAM_TIMEOUT,
+        limits=httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_CONNECTIONS,
+        ),
+    )
+    _client_loop = loop
+    return _client
+
+
+class UpstreamError(Exception):
+    """The upstream service gave no usable answer. Unlike an empty 200 this is not cached."""
+
+
+async def get_json(url, params):
+    try:
+        response = await get_http_client().get(url, params=params)
+    except httpx.HTTPError as e:
+        raise UpstreamError(f"{url}: {e!r}") from e
+
+    if response.status_code != 200:
+        raise UpstreamError(f"{url}: HTTP {response.status_code}")
+    try:
+        return response.json()
+    except ValueError as e:
+        raise UpstreamError(f"{url}: invalid JSON: {e}") from e
+
+
+def _period_params(year, quarter):
+    params = {}
+    if year and str(year).lower() != "null":
+        params["year"] = year
+    if quarter and quarter.lower() != "null":
+        params["quarter"] = quarter
+    return params
+
+
+async def fetch_time_series_value(indicator_code, year):
+    params = {"code": indicator_code}
+    if year is not None:
+        params["year"] = year
+
+    cache = CACHES["time_series"]
+    key = cache.make_key(indicator_code, year)
+    return await cache.get_or_fetch(key, lambda: get_json(TIME_SERIES_URL, params))
+
+
+async def fetch_ministry_score(ministry_id, year, quarter):
+    url = f"{DPMES_URL}/api/ai/ministry-score/{ministry_id}"
+    params = _period_params(year, quarter)
+
+    cache = CACHES["ministry_score"]
+    key = cache.make_key(ministry_id, year, quarter)
+    return await cache.get_or_fetch(key, lambda: get_json(url, params))
+
+
+async def fetch_ministry_performance(ministry_id, year, quarter, performance_requested):
+    url = f"{DPMES_URL}/api/ai/ministry-kpi-performance/{ministry_id}"
+    params = _period_params(year, quarter)
+    if performance_requested:
+        params["performance_type"] = performance_requested
+
+    cache = CACHES["ministry_performance"]
+    key = cache.make_key(ministry_id, year, quarter, performance_requested)
+    return await cache.get_or_fetch(key, lambda: get_json(url, params))
+
+
+def cache_stats():
+    """Hit/miss counters per upstream endpoint for this process."""
+    return {
+        name: {**cache.stats, "hit_rate": round(cache.hit_rate(), 3)}
+        for name, cache in CACHES.items()
+    }
+
+
+_stats_logged_at = time.monotonic()
+
+
+def log_cache_stats_if_due():
+    """The counters are per process, so each process logs its own every CACHE_STATS_LOG_SECONDS."""
+    global _stats_logged_at
+    now = time.monotonic()
+    if now - _stats_logged_at >= CACHE_STATS_LOG_SECONDS:
+        _stats_logged_at = now
+        logger.info("Upstream cache stats (pid %s): %s", os.getpid(), cache_stats())
+
+
+class FetchResults(dict):
+    """{key: response} from fetch_many; `failed` holds the keys that errored or missed the deadline."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.failed = set()
+
+    @property
+    def complete(self):
+        return not self.failed
+
+
+async def fetch_many(fetch, keys, deadline=UPSTREAM_DEADLINE):
+    """
+    Run fetch(*key) concurrently for every distinct key and return {key: response}.
+
+    Keys are deduplicated, so several documents pointing at the same ministry or
+    indicator share a single request. Anything that fails or is still running
+    when the deadline expires resolves to {} ("Data not available") and is
+    listed in the result's `failed`.
+    """
+    unique_keys = list(dict.fromkeys(keys))
+    if not unique_keys:
+        return FetchResults()
+
+    tasks = {key: asyncio.create_task(fetch(*key)) for key in unique_keys}
+    try:
+        done, pending = await asyncio.wait(tasks.values(), timeout=deadline)
+    except asyncio.CancelledError:
+        # e.g. a speculative prefetch that turned out to be for the wrong intent
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+    for task in pending:
+        task.cancel()
+    if pending:
+        logger.warning("%s upstream request(s) missed the %ss deadline", len(pending), deadline)
+
+    results = FetchResults()
+    for key, task in tasks.items():
+        if task in done and not task.cancelled() and task.exception() is None:
+            results[key] = task.result()
+        else:
+            if task in done and not task.cancelled():
+                logger.warning("Upstream request failed for %s: %s", key, task.exception())
+            results[key] = {}
+            results.failed.add(key)
+
+    log_cache_stats_if_due()
+    return results
@@ -1,89 +1,159 @@
 from langchain_core.documents import Document
-from uuid import uuid4
 import os
-import json
-from asgiref.sync import sync_to_async
+import asyncio
+from contextlib import aclosing
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from .rules import SYSTEM_RULES, MINISTRY_SCORE_SYSTEM_RULES, MINISTRY_PERFORMANCE_SYSTEM_RULES
+from .providers import get_remote_embeddings
+from .vectorstore import ensure_collection, COLLECTION_NAME
+from .ingestion import (
+    IngestionFailed, Reingestion, chunk_documents, delete_rows, ingest_documents,
+    iter_json_array, milvus_upsert, stored_rows, CHUNK_SIZE, CHUNK_OVERLAP,
+)
 
 # Initialize once here
 text_splitter = RecursiveCharacterTextSplitter(
-    chunk_size=800,
-    chunk_overlap=160
+    chunk_size=CHUNK_SIZE,
+    chunk_overlap=CHUNK_OVERLAP
 )
 
-def split_json(file_path):
+def split_text(text):
+    """Module-level so the chunking process pool can pickle it."""
+    return text_splitter.split_text(text)
+
+def iter_json_documents(file_path):
+    """
+    Lazily yield a Document per item of a JSON export. The file is parsed
+    incrementally, so memory does not grow with the file size.
+    """
     with open(file_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    documents = []
-    for item in data:
-        if not item: continue
-        
-        page_content = item.get("page_content", "")
-        metadata = item.get("metadata", {}) 
-
-        documents.append(
-            Document(
-                page_content=page_content, 
-                metadata=metadata
+        for index, item in enumerate(iter_json_array(f)):
+            if not item: continue
+            if not isinstance(item, dict):
+                raise IngestionFailed(
+                    f"Item {index} of {os.path.basename(file_path)} is a {type(item).__name__}, expected an object",
+                    retryable=False,
+                )
+
+            yield Document(
+                page_content=item.get("page_content", ""),
+                metadata=item.get("metadata", {})
             )
-        )
-    return documents
 
-async def process_document(to_be_loaded_doc, vector_store) -> bool:
+def split_json(file_path):
+    return list(iter_json_documents(file_path))
+
+def document_source(to_be_loaded_doc):
+    """
+    Key that ties re-uploads of the same export together: the Document's name.
+    The stored file name is no use, since storage renames colliding uploads,
+    so an unnamed Document is keyed on its pk and only re-ingests itself.
+    """
+    if to_be_loaded_doc.name:
+        return f"name:{to_be_loaded_doc.name}"
+    return f"document:{to_be_loaded_doc.pk}"
+
+async def process_document(to_be_loaded_doc, on_progress=None):
     """
     Process a single document file, split JSON content into documents,
     and add them to the Milvus vector store with dynamic metadata.
+
+    Re-uploads of the same source are incremental: unchanged items are
+    skipped, changed ones upserted under the same pk and removed ones deleted.
+    Long items are split into chunks that share the item's parent_id.
+    on_progress(items_done) is awaited as batches finish. Returns the
+    IngestionReport; raises IngestionFailed (or the underlying error) when the
+    file was not fully ingested.
     """
-    try:
-        file_path = to_be_loaded_doc.file.path
-        ext = os.path.splitext(file_path)[1].lower()
-        print(f"Loading document: {file_path}")
+    file_path = to_be_loaded_doc.file.path
+    ext = os.path.splitext(file_path)[1].lower()
+    print(f"Loading document: {file_path}")
 
-        if ext != ".json":
-            print(f"Unsupported file extension {ext}, skipping.")
-            return False
+    if ext != ".json":
+        raise IngestionFailed(f"Unsupported file extension {ext}", retryable=False)
 
-        documents = split_json(file_path)
+    client = ensure_collection()
+    if client is None:
+        raise IngestionFailed("Milvus is unavailable")
 
-        if not documents:
-            print(f"No documents found in {file_path}.")
-            return False
+    loop = asyncio.get_running_loop()
+    source = document_source(to_be_loaded_doc)
+    existing = await loop.run_in_executor(None, stored_rows, client, COLLECTION_NAME, source)
+    reingestion = Reingestion(source, existing)
 
-        ids = [str(uuid4()) for _ in range(len(documents))]
+    async def on_batch(report):
+        if on_progress is not None:
+            await on_progress(report.inserted + len(report.failed_ids) + reingestion.skipped)
 
-        await sync_to_async(vector_store.add_documents)(
-            documents=documents,
-            ids=ids
+    # Documents are produced lazily, so only the batches in flight are held
+    # in memory. Items over CHUNK_SIZE are embedded as chunks.
+    rows = chunk_documents(reingestion.changed(iter_json_documents(file_path)), split_text, CHUNK_SIZE)
+    try:
+        report = await ingest_documents(
+            reingestion.track(rows),
+            get_remote_embeddings(),
+            milvus_upsert(client, COLLECTION_NAME),
+            on_batch=on_batch,
         )
+    except ValueError as e:
+        raise IngestionFailed(f"Invalid JSON in {file_path}: {e}", retryable=False)
 
-    
-        to_be_loaded_doc.is_loaded = True
-        await sync_to_async(to_be_loaded_doc.save)()
+    report.skipped = reingestion.skipped
+    if not reingestion.seen:
+        raise IngestionFailed(f"No documents found in {file_path}", retryable=False)
 
-        print(f"{len(documents)} documents processed and added to vector store: {file_path}")
-        return True
+    if report.failed_ids:
+        # Batches that made it in are skipped as unchanged on the retry.
+        raise IngestionFailed(f"{len(report.failed_ids)} of {len(reingestion.seen)} documents failed")
 
-    except Exception as e:
-        print(f"Error processing document {file_path}: {e}")
-        return False
+    removed = reingestion.removed()
+    if removed:
+        await loop.run_in_executor(None, delete_rows, client, COLLECTION_NAME, removed)
+        report.deleted = len(removed)
 
-def run_chain(prompt, llm, conversation_list, context, question):
+    print(f"📥 {file_path}: {report}")
+    return report
+
+def history_window(history, max_turns=3, total=None):
     """
-    Invoke the llm chain with proper inputs.
+    Select the prior turns to replay. Instead of sliding by one every message
+    (which changes the prompt right after the system rules each time), the
+    window start advances in steps of max_turns, so between steps the replayed
+    turns are a stable prefix and only grow at the end. Keeps between
+    max_turns and 2 * max_turns - 1 turns once the chat is long enough.
+
+    `history` may be just the tail of the conversation (e.g. a bounded ring);
+    `total` is then the number of turns in the whole conversation.
     """
+    total = len(history) if total is None else total
+    if total <= max_turns:
+        return list(history)
+    start = (total - max_turns) // max_turns * max_turns
+    return list(history)[max(0, start - (total - len(history))):]
 
-    messages = [
-        {"role": "system", "content": SYSTEM_RULES},
-        {"role": "user", "content": f"Context:\n{context}"},
-    ]
+def build_messages(system_rule, conversation_list, context, question):
+    """
+    Order messages from most to least stable so vLLM's automatic prefix cache
+    can reuse the system rules and the prior turns across messages: the
+    per-question retrieved context goes last, just before the question.
+    """
+    messages = [{"role": "system", "content": system_rule}]
 
     for m in conversation_list:
-        messages.append({"role": m.type, "content": m.content})
+        role = m.get("role") if isinstance(m, dict) else m.type
+        content = m.get("content") if isinstance(m, dict) else m.content
+        messages.append({"role": role, "content": content})
 
+    messages.append({"role": "user", "content": f"Context:\n{context}"})
     messages.append({"role": "user", "content": question})
+    return messages
 
+def run_chain(prompt, llm, conversation_list, context, question):
+    """
+    Invoke the llm chain with proper inputs.
+    """
+
+    messages = build_messages(SYSTEM_RULES, conversation_list, context, question)
 
     return llm.invoke(messages)
 
@@ -107,20 +177,13 @@ async def run_chain_stream(llm, conversation_list, context, question, intent=Non
     else:
         selected_system_rule = SYSTEM_RULES 
 
-    messages = [
-        {"role": "system", "content": selected_system_rule},
-        {"role": "user", "content": f"Context:\n{context}"},
-    ]
-
-    for m in conversation_list:
-        role = m.get("role") if isinstance(m, dict) else m.type
-        content = m.get("content") if isinstance(m, dict) else m.content
-        messages.append({"role": role, "content": content})
-
-    messages.append({"role": "user", "content": question})
+    messages = build_messages(selected_system_rule, conversation_list, context, question)
 
-    async for chunk in llm.astream(messages):
-        if hasattr(chunk, 'content'):
-            yield chunk.content
-        else:
-            yield str(chunk)
\ No newline at end of file
+    # Closing the stream closes the HTTP response, which makes vLLM abort the
+    # sequence when the caller stops early (e.g. the websocket went away).
+    async with aclosing(llm.astream(messages)) as stream:
+        async for chunk in stream:
+            if hasattr(chunk, 'content'):
+                yield chunk.content
+            else:
+                yield str(chunk)
\ No newline at end of file
@@ -1,11 +1,38 @@
 import os 
 import asyncio
-from pymilvus import MilvusClient, DataType, FieldSchema, CollectionSchema
+from concurrent.futures import ThreadPoolExecutor
+import json
+from pymilvus import (
+    MilvusClient, DataType, FieldSchema, CollectionSchema,
+    Function, FunctionType, AnnSearchRequest, RRFRanker,
+)
+from langchain_core.documents import Document
 from langchain_milvus import Milvus
 from .providers import get_remote_embeddings
+from .retrieval_cache import cached_embedding, cached_documents, normalise_question
+from .ingestion import join_chunks
 
 COLLECTION_NAME = "admas_data"
+INTENT_COLLECTION_NAME = "admas_intents"
 MILVUS_URI = os.getenv("MILVUS_URI", "http://localhost:19530")
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", "8"))
+
+# Hybrid retrieval: BM25 over `text` (computed by Milvus into SPARSE_FIELD)
+# fused with the dense `vector` search by reciprocal rank.
+SPARSE_FIELD = "sparse"
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "10"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+# Long items are stored as chunks sharing a parent_id; search fetches this
+# many times k rows so k distinct items remain after collapsing them.
+CHUNK_OVERFETCH = int(os.getenv("CHUNK_OVERFETCH", "2"))
+
+# Retrieval does a blocking embedding HTTP call plus a Milvus search, so it runs
+# on its own bounded pool instead of the event loop (or the shared DB thread).
+_retrieval_executor = ThreadPoolExecutor(
+    max_workers=RETRIEVAL_WORKERS,
+    thread_name_prefix="retrieval",
+)
 
 def ensure_collection():
     try:
@@ -17,12 +44,24 @@ def ensure_collection():
             fields = [
     
                 FieldSchema(name="pk", dtype=DataType.VARCHAR, is_primary=True, max_length=100),
-                FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=8192),
+                FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=8192, enable_analyzer=True),
                 FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=768),
+                FieldSchema(name=SPARSE_FIELD, dtype=DataType.SPARSE_FLOAT_VECTOR),
             ]
-            schema = CollectionSchema(fields, description="Admas docs", enable_dynamic_field=True)
+            bm25 = Function(
+                name="text_bm25",
+                function_type=FunctionType.BM25,
+                input_field_names=["text"],
+                output_field_names=[SPARSE_FIELD],
+            )
+            schema = CollectionSchema(
+                fields, description="Admas docs", enable_dynamic_field=True, functions=[bm25]
+            )
+            index_params = client.prepare_index_params()
+            index_params.add_index(field_name="vector", index_type="HNSW", metric_type="L2", params={"M": 8, "efConstruction": 64})
+            index_params.add_index(field_name=SPARSE_FIELD, index_type="SPARSE_INVERTED_INDEX", metric_type="BM25")
             
-            client.create_collection(collection_name=COLLECTION_NAME, schema=schema)
+            client.create_collection(collection_name=COLLECTION_NAME, schema=schema, index_params=index_params)
         
         print('📦 Milvus Schema Connected!')
         return client
@@ -31,6 +70,36 @@ def ensure_collection():
         return None
     
 
+def ensure_intent_collection():
+    """Labelled example questions used by the nearest-neighbour intent classifier."""
+    try:
+        client = MilvusClient(uri=MILVUS_URI)
+
+        if not client.has_collection(collection_name=INTENT_COLLECTION_NAME):
+            print(f"📦 Creating collection: {INTENT_COLLECTION_NAME}")
+
+            fields = [
+                FieldSchema(name="pk", dtype=DataType.VARCHAR, is_primary=True, max_length=100),
+                FieldSchema(name="text", dtype=DataType.VARCHAR, max_length=1024),
+                FieldSchema(name="intent", dtype=DataType.VARCHAR, max_length=64),
+                FieldSchema(name="vector", dtype=DataType.FLOAT_VECTOR, dim=768),
+            ]
+            schema = CollectionSchema(fields, description="Admas intent examples")
+            index_params = client.prepare_index_params()
+            index_params.add_index(field_name="vector", index_type="FLAT", metric_type="COSINE")
+
+            client.create_collection(
+                collection_name=INTENT_COLLECTION_NAME,
+                schema=schema,
+                index_params=index_params,
+            )
+
+        return client
+    except Exception as e:
+        print(f"⚠️ Milvus Intent Schema Check Failed: {e}")
+        return None
+
+
 _vector_store = None  
 
 def get_vector_store():
@@ -66,9 +135,146 @@ def get_vector_store():
     )
     return _vector_store
 
+SEARCH_KWARGS = {"k": 4, "fetch_k": 10, "lambda_mult": 0.5}
+
 def get_retriever():
     vs = get_vector_store()
     return vs.as_retriever(
         search_type="mmr",
-        search_kwargs={"k": 4, "fetch_k": 10, "lambda_mult": 0.5},
-    )
\ No newline at end of file
+        search_kwargs=SEARCH_KWARGS,
+    )
+
+async def aretrieve(retriever, question):
+    """Run retriever.invoke on the bounded retrieval pool without blocking the loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_retrieval_executor, retriever.invoke, question)
+
+async def aembed_query(question):
+    """Embed the question once so retrieval and the answer cache can share it."""
+    embeddings = get_remote_embeddings()
+    return await cached_embedding(
+        embeddings.model, question, lambda: embeddings.aembed_query(question)
+    )
+
+async def aretrieve_by_vector(embedding, question=None, filters=None):
+    """
+    Search for a precomputed question embedding on the retrieval pool: hybrid
+    BM25 + dense when the question text is given, MMR otherwise.
+    """
+    loop = asyncio.get_running_loop()
+    params = {
+        # BM25's analyzer ignores case and spacing, so neither splits the cache.
+        "question": normalise_question(question) if question else None,
+        "filters": filters or None,
+        "hybrid": bool(HYBRID_SEARCH and question),
+        "search": SEARCH_KWARGS,
+        "candidates": HYBRID_CANDIDATES,
+        "overfetch": CHUNK_OVERFETCH,
+    }
+    return await cached_documents(
+        embedding,
+        params,
+        lambda: loop.run_in_executor(_retrieval_executor, lambda: search(embedding, question, filters)),
+    )
+
+_milvus_client = None
+_hybrid_supported = None
+
+def get_milvus_client():
+    global _milvus_client
+    if _milvus_client is None:
+        _milvus_client = MilvusClient(uri=MILVUS_URI)
+    return _milvus_client
+
+def hybrid_supported():
+    """
+    True if the collection has the BM25 sparse field. Collections created
+    before it existed keep using dense MMR until they are rebuilt and re-ingested.
+    """
+    global _hybrid_supported
+    if _hybrid_supported is None:
+        try:
+            fields = get_milvus_client().describe_collection(COLLECTION_NAME)["fields"]
+            _hybrid_supported = any(field["name"] == SPARSE_FIELD for field in fields)
+        except Exception as e:
+            print(f"⚠️ Could not inspect {COLLECTION_NAME}, using dense retrieval: {e}")
+            return False
+        if not _hybrid_supported:
+            print(f"⚠️ {COLLECTION_NAME} has no '{SPARSE_FIELD}' field; rebuild it to enable hybrid search.")
+    return _hybrid_supported
+
+def filter_expression(filters):
+    """
+    Milvus boolean expression restricting results to already resolved entities,
+    e.g. {"indicator_code": ["GDP_01"], "responsible_ministry_id": [12]}.
+    """
+    clauses = [
+        f"{field} in {json.dumps(list(values))}"
+        for field, values in (filters or {}).items()
+        if values
+    ]
+    return " and ".join(clauses)
+
+def _hit_to_document(hit):
+    entity = dict(hit["entity"])
+    text = entity.pop("text", "")
+    entity.pop("vector", None)
+    entity.pop(SPARSE_FIELD, None)
+    entity.setdefault("pk", hit.get("id"))
+    return Document(page_content=text, metadata=entity)
+
+def hybrid_search(embedding, question, k=SEARCH_KWARGS["k"], filters=None):
+    """BM25 and dense candidates fused with reciprocal rank fusion (RRFRanker)."""
+    expr = filter_expression(filters)
+    requests = [
+        AnnSearchRequest(data=[embedding], anns_field="vector", param={}, limit=HYBRID_CANDIDATES, expr=expr),
+        AnnSearchRequest(data=[question], anns_field=SPARSE_FIELD, param={"metric_type": "BM25"}, limit=HYBRID_CANDIDATES, expr=expr),
+    ]
+    hits = get_milvus_client().hybrid_search(
+        collection_name=COLLECTION_NAME,
+        reqs=requests,
+        ranker=RRFRanker(RRF_K),
+        limit=k,
+        output_fields=["*"],
+    )
+    return [_hit_to_document(hit) for hit in hits[0]]
+
+def mmr_search(embedding, filters=None, k=SEARCH_KWARGS["k"]):
+    kwargs = dict(SEARCH_KWARGS)
+    kwargs["k"] = min(k, kwargs["fetch_k"])
+    expr = filter_expression(filters)
+    if expr:
+        kwargs["expr"] = expr
+    return get_vector_store().max_marginal_relevance_search_by_vector(embedding, **kwargs)
+
+def collapse_chunks(docs, k):
+    """
+    One Document per parent item, in the rank of its best chunk, keeping the
+    first k. Chunks of the same item that were retrieved together are joined
+    in document order, without the text adjacent chunks repeat. Rows stored
+    without a parent_id stand alone.
+    """
+    groups = {}
+    for doc in docs:
+        groups.setdefault(doc.metadata.get("parent_id") or id(doc), []).append(doc)
+
+    collapsed = []
+    for chunks in list(groups.values())[:k]:
+        if len(chunks) == 1:
+            collapsed.append(chunks[0])
+            continue
+        chunks.sort(key=lambda doc: doc.metadata.get("chunk_index", 0))
+        collapsed.append(Document(
+            page_content=join_chunks((doc.metadata.get("chunk_index", 0), doc.page_content) for doc in chunks),
+            metadata=chunks[0].metadata,
+        ))
+    return collapsed
+
+def search(embedding, question, filters=None):
+    """Hybrid search when the collection supports it, dense MMR otherwise."""
+    k = SEARCH_KWARGS["k"]
+    if HYBRID_SEARCH and question and hybrid_supported():
+        docs = hybrid_search(embedding, question, k=k * CHUNK_OVERFETCH, filters=filters)
+    else:
+        docs = mmr_search(embedding, filters, k=k * CHUNK_OVERFETCH)
+    return collapse_chunks(docs, k)
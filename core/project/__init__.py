@@ -0,0 +1,7 @@
+from __future__ import absolute_import, unicode_literals
+
+# Load the Celery app (and its task_routes) whenever Django starts, so tasks
+# queued from the web process go to the right queue.
+from .celery import app as celery_app
+
+__all__ = ('celery_app',)
@@ -10,8 +10,20 @@ app.autodiscover_tasks()
 
 
 
+# Re-queue Documents left pending because the broker was down at upload time.
+INGEST_SWEEP_SECONDS = float(os.getenv('INGEST_SWEEP_SECONDS', '300'))
+
+app.conf.beat_schedule = {
+    'enqueue-pending-documents': {
+        'task': 'AI.tasks.enqueue_pending_documents',
+        'schedule': INGEST_SWEEP_SECONDS,
+    },
+}
+
 app.conf.task_routes = {
-    'AI.tasks.handle_question_task': {'queue': 'async_worker'}
+    'AI.tasks.handle_question_task': {'queue': 'async_worker'},
+    'AI.tasks.ingest_document': {'queue': 'ingestion'},
+    'AI.tasks.enqueue_pending_documents': {'queue': 'ingestion'},
 }
 
 
@@ -238,6 +238,30 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 #Logging 
 
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'simple': {
+            'format': '[{asctime}] {levelname} {name}: {message}',
+            'style': '{',
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': 'simple',
+        },
+    },
+    'loggers': {
+        'AI': {
+            'handlers': ['console'],
+            'level': os.getenv('AI_LOG_LEVEL', 'INFO'),
+            'propagate': False,
+        },
+    },
+}
+
 # LOGGING = {
 #     'version': 1,
 #     'disable_existing_loggers': False,
@@ -309,6 +333,14 @@ DEFAULT_FROM_EMAIL = os.getenv('EMAIL')
 
 ASGI_APPLICATION = "project.asgi.application"
 
+# Chat context rendering: "compact" (token-budgeted plain text) or "html" (original verbose output)
+AI_CONTEXT_FORMAT = os.getenv("AI_CONTEXT_FORMAT", "compact")
+AI_CONTEXT_TOKEN_BUDGETS = {
+    "TIME_SERIES": 2500,
+    "MINISTRY_SCORE": 1500,
+    "MINISTRY_PERFORMANCE": 2500,
+}
+
 CHANNEL_LAYERS = {
     "default": {
         "BACKEND": "channels_redis.core.RedisChannelLayer",